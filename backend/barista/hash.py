@@ -1,29 +1,68 @@
 import hashlib
 import os
 
-def hashFile(path):
-    """Hashes a file and returns the hashvalue"""
-    m = hashlib.md5()
+from backend.barista.utils.hash_cache import fingerprint, getHashCache
+
+
+def hashFile(path, save=True):
+    """Hashes a file and returns the hashvalue
+
+    Values are cached until the file changes. The value is sent to clients
+    with GETFILEHASH, so it stays the plain md5 of the whole file and is not
+    a tree hash.
+    """
     try:
-        file = open(path, "r")
-        for chunk in iter(lambda: file.read(4096), b""):
-            m.update(chunk)
-        return m.hexdigest()
+        value = getHashCache().get(path, "md5", _hashFile)
+        if save:
+            getHashCache().save()
+        return value
     except Exception as e:
         print e
-        exit -1
+        return None
+
+def fingerprintFile(path):
+    """Returns a fingerprint of a file
+
+    This is not a hash of the whole content but of its size and sampled blocks, see hash_cache.fingerprint.
+    """
+    try:
+        return fingerprint(path)
+    except Exception as e:
+        print e
+        return None
 
 def hashDir(path):
-    """Hashes a directory and returns the hashvalue"""
-    hash = ""
-
-    for root, dirs, files in os.walk(path):
-        for names in sorted(files):
-            try:
-                filepath = os.path.join(root, names)
-                hash += hashFile(filepath)
-            except Exception as e:
-                print e
-                exit -1
-
-    return hash
\ No newline at end of file
+    """Hashes a directory and returns the hashvalue
+
+    The value is the root of a Merkle tree: the hash of a directory covers
+    the names and hashes of its entries, so a change only rehashes the
+    changed files.
+    """
+    value = _hashDir(path)
+    getHashCache().save()
+    return value
+
+# private methods
+
+def _hashFile(path):
+    m = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+def _hashDir(path):
+    m = hashlib.md5()
+    for name in sorted(os.listdir(path)):
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            value = _hashDir(entry)
+            m.update("d")
+        else:
+            value = hashFile(entry, False)
+            if value is None:
+                continue
+            m.update("f")
+        m.update(name)
+        m.update(value)
+    return m.hexdigest()
@@ -1,14 +1,30 @@
+import tempfile
+import zlib
+from collections import deque
+
 from PyQt5.QtCore import QTimer
 
 from backend.barista.session.session import *
 from backend.barista.session.session_utils import State
 from backend.barista.utils.logger import Log
+from backend.caffe.caffemodel_index import BlobCache
+from backend.parser.metric_store import MetricStore
 from backend.parser.parser_dummy import ParserDummy
 from backend.networking.net_util import buildTransaction
 from backend.networking.protocol import Protocol, SessionProtocol
-from gui.main_window.docks.weight_visualization.weights import loadNetParamFromString
+from gui.main_window.docks.weight_visualization.weights import loadNetParameter
+
+# layer blobs received from the servers, see ClientSession.loadLayerBlobs()
+_layerBlobCache = BlobCache()
+
 
 class ClientSession(QObject):
+    # file transfers: bytes per chunk, chunks requested ahead, retries of a
+    # chunk with a wrong checksum
+    TRANSFER_CHUNK_SIZE = 1024 * 1024
+    TRANSFER_WINDOW = 4
+    TRANSFER_RETRIES = 3
+
     # event signals
     stateChanged = pyqtSignal(object)
     stateDictChanged = pyqtSignal(object, bool)
@@ -24,7 +40,8 @@ class ClientSession(QObject):
             SessionProtocol.UPDATEPARSER: self._updateParser,
             SessionProtocol.UPDATEKEYS: self._updateParserKeys,
             SessionProtocol.ADDSNAPSHOT: self._addSnapshot,
-            SessionProtocol.PARSEHANDLE: self._parseHandle
+            SessionProtocol.PARSEHANDLE: self._parseHandle,
+            SessionProtocol.UPDATEPARSER_BATCH: self._updateParserBatch
         }
 
         self.firstConnect = True
@@ -39,6 +56,8 @@ class ClientSession(QObject):
         self.uid = uid
         self.lastStateDict = None
         self.state = State.NOTCONNECTED
+        # True while the session waits in the training queue of the server
+        self.queued = False
         self.invalidErrorsList = []
         # setup timer
         # see details in setStateDict()
@@ -50,6 +69,8 @@ class ClientSession(QObject):
 
         self.lastIter = 0
         self.lastMaxIter = 0
+        # unfinished file transfers by file name, see _downloadFile()
+        self.downloads = {}
 
         # maybe get log
 
@@ -71,8 +92,7 @@ class ClientSession(QObject):
         if not self.isConnected:
             trans = buildTransaction(self.remote[0], self.remote[1])
             if trans:
-                trans.send({"key": Protocol.CONNECTTOSESSION, "uid": self.uid})
-                ret = trans.asyncRead(attr=("key", Protocol.CONNECTTOSESSION))
+                ret = trans.request({"key": Protocol.CONNECTTOSESSION, "uid": self.uid})
                 if ret:
                     if ret["status"]:
                         self.transaction = trans
@@ -114,6 +134,18 @@ class ClientSession(QObject):
         for error in errors:
             Log.error(error, self.getCallerId())
 
+    def _setQueued(self, queued):
+        """ Update the queued flag after a start, proceed or pause request.
+
+        A queued session keeps its state until the server starts it, so the
+        listeners of stateChanged are notified explicitly.
+        """
+        if queued:
+            Log.log("Session is queued and starts when a device of the host is free.", self.getCallerId())
+        if queued != self.queued:
+            self.queued = queued
+            self.stateChanged.emit(self.state)
+
     def _printLog(self):
         msg = self.transaction.asyncRead(attr=("subkey", SessionProtocol.PRINTLOG))
         logs = msg["log"]
@@ -141,6 +173,25 @@ class ClientSession(QObject):
         self.parser.sendParserUpdate(phase, row)
         #TODO plotter
 
+    def _updateParserBatch(self):
+        msg = self.transaction.asyncRead(attr=("subkey", SessionProtocol.UPDATEPARSER_BATCH))
+        lastIter = None
+        for update in msg["updates"]:
+            subkey = update[0]
+            if subkey == SessionProtocol.UPDATEPARSER:
+                phase, row = update[1:]
+                lastIter = row["NumIters"]
+                self.parser.sendParserUpdate(phase, row)
+            elif subkey == SessionProtocol.UPDATEKEYS:
+                phase, key = update[1:]
+                self.parser.sendParserRegisterKeys(phase, key)
+            elif subkey == SessionProtocol.PARSEHANDLE:
+                event, message, groups = update[1:]
+                self.parser.sendParserHandle(event, message, groups)
+        if lastIter is not None:
+            self.lastIter = lastIter
+            self.iterationChanged.emit()
+
     def _updateParserKeys(self):
         msg = self.transaction.asyncRead(attr=("subkey", SessionProtocol.UPDATEKEYS))
         phase = msg["phase"]
@@ -179,8 +230,7 @@ class ClientSession(QObject):
     def checkFiles(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.CHECKFILES}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.CHECKFILES))
+            ret = self.transaction.request(msg)
             if ret:
                 self._handleErrors(ret["error"])
                 return
@@ -191,8 +241,7 @@ class ClientSession(QObject):
         """
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETSNAPSHOTS}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETSNAPSHOTS))
+            ret = self.transaction.request(msg)
             if ret:
                 return ret["snapshots"]
         self._handleErrors(["Failed to connect to remote session to acquire Snapshots."])
@@ -202,8 +251,7 @@ class ClientSession(QObject):
         # Maybe let this be local + signal
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETITERATION}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETITERATION))
+            ret = self.transaction.request(msg)
             if ret:
                 self.lastIter = ret["iteration"]
                 return self.lastIter
@@ -216,8 +264,7 @@ class ClientSession(QObject):
             return self.lastMaxIter
         elif self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETMAXITERATION}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETMAXITERATION))
+            ret = self.transaction.request(msg)
             if ret:
                 self.lastMaxIter = ret["iteration"]
                 return self.lastMaxIter
@@ -227,8 +274,7 @@ class ClientSession(QObject):
     def getPretrainedWeights(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETPRETRAINED}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETPRETRAINED))
+            ret = self.transaction.request(msg)
             if ret:
                 return ret.get("pretrained", None)
         self._handleErrors(["Failed to connect to remote session to acquire pre-trained weights."])
@@ -248,8 +294,7 @@ class ClientSession(QObject):
     def delete(self):
         if self._assertConnection():
             msg = {"key": Protocol.DELETESESSION, "uid": self.uid}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("key", Protocol.DELETESESSION))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     self.project.deleteSession.emit(self.getSessionId())
@@ -265,8 +310,7 @@ class ClientSession(QObject):
     def reset(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.RESET}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.RESET))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     self.iterationChanged.emit()
@@ -283,10 +327,10 @@ class ClientSession(QObject):
         self.getStateFirstTime = False
         if self._assertConnection(): 
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETSTATE}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETSTATE))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
+                    self.queued = ret.get("queued", False)
                     self.setState(ret["state"], True)
                     return ret["state"]
                     
@@ -303,11 +347,17 @@ class ClientSession(QObject):
         if not silent:
             self.stateChanged.emit(self.state)
 
+    def isQueued(self):
+        """ Return True if the session waits on the server for a free device.
+        """
+        return self.queued
+
     def setErrorList(self, errorList):
         self.invalidErrorsList = errorList
 
     def _updateState(self):
         msg = self.transaction.asyncRead(attr=("subkey", SessionProtocol.UPDATESTATE))
+        self.queued = msg.get("queued", False)
         self.setState(msg["state"])
 
     def getErrorList(self):
@@ -317,8 +367,7 @@ class ClientSession(QObject):
         Log.log("Saving current Session status to disk.", self.getCallerId())
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.SAVE}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(attr=("subkey", SessionProtocol.SAVE))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     return True
@@ -348,8 +397,7 @@ class ClientSession(QObject):
                 del layers[id]["type"]
 
             msg["statedict"] = transferDict
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(attr=("subkey", SessionProtocol.SETSTATEDICT))
+            ret = self.transaction.request(msg)
             if ret:
                 if not ret["status"]:
                     self._handleErrors(ret["error"])
@@ -378,8 +426,7 @@ class ClientSession(QObject):
         if self.lastStateDict is None:
             if self._assertConnection():
                 msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.GETSTATEDICT}
-                self.transaction.send(msg)
-                ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.GETSTATEDICT))
+                ret = self.transaction.request(msg)
                 if ret:
                     if ret["status"]:
                         self.lastStateDict = ret["statedict"]
@@ -412,8 +459,7 @@ class ClientSession(QObject):
     def checkTraining(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.CHECKTRAINING}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.CHECKTRAINING))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     return ret["check"]
@@ -434,10 +480,10 @@ class ClientSession(QObject):
                 msg["solverstate"] = solverstate
             if caffemodel is not None:
                 msg["caffemodel"] = caffemodel
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.START))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
+                    self._setQueued(ret.get("queued", False))
                     return True
                 else:
                     self._handleErrors(ret["error"])
@@ -447,10 +493,10 @@ class ClientSession(QObject):
     def pause(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.PAUSE}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.PAUSE))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
+                    self._setQueued(False)
                     self.iterationChanged.emit()
                     return True
                 else:
@@ -461,8 +507,7 @@ class ClientSession(QObject):
     def snapshot(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.TAKESNAPSHOT}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.TAKESNAPSHOT))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     return True
@@ -478,10 +523,10 @@ class ClientSession(QObject):
             if snapshot is not None:
                 msg["snapshot"] = snapshot
                 print "proceed with snapshot", msg
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.PROCEED))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
+                    self._setQueued(ret.get("queued", False))
                     return True
                 else:
                     self._handleErrors(ret["error"])
@@ -507,11 +552,10 @@ class ClientSession(QObject):
     def fetchParserData(self):
         if self._assertConnection() and self.transaction is not None:
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.FETCHPARSERDATA}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.FETCHPARSERDATA))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
-                    parserRows = ret["ParserRows"]
+                    parserColumns = MetricStore.fromColumns(ret["ParserColumns"])
                     parserKeys = ret["ParserKeys"]
                     parserHandle = ret["ParserHandle"]
                     parserLog = ret["ParserLogs"]
@@ -519,8 +563,9 @@ class ClientSession(QObject):
                     for phase, key in parserKeys:
                         self.parser.sendParserRegisterKeys(phase, key)
 
-                    for phase, row in parserRows:
-                        self.parser.sendParserUpdate(phase, row)
+                    for phase in (ParserDummy.TRAIN, ParserDummy.TEST):
+                        for row in parserColumns.iterRows(phase):
+                            self.parser.sendParserUpdate(phase, row)
 
                     for event, line, groups in parserHandle:
                         self.parser.sendParserHandle(event, line, groups)
@@ -564,8 +609,7 @@ class ClientSession(QObject):
     def loadInternalNetFile(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADINTERNALNET}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.LOADINTERNALNET))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     return ret["NetInternal"]
@@ -577,8 +621,7 @@ class ClientSession(QObject):
     def loadDeployedNetAsString(self):
         if self._assertConnection():
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADDEPLOYEDNET}
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.LOADDEPLOYEDNET))
+            ret = self.transaction.request(msg)
             if ret:
                 if ret["status"]:
                     return ret["Net"]
@@ -588,26 +631,44 @@ class ClientSession(QObject):
         return ""
 
     def loadNetParameter(self, snapshot):
-        if self._assertConnection():
-            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADNETPARAMETER}
-            msg["snapshot"] = snapshot
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.LOADNETPARAMETER))
-            if ret:
-                if ret["status"]:
-                    net = ret["NetParams"]
-                    net = loadNetParamFromString(net)
-                    if net is not None:
-                        return net
-                    else:
-                        self._handleErrors(["Failed to load " + str(snapshot),
+        path = self._downloadFile(snapshot)
+        if path is not None:
+            net = loadNetParameter(path)
+            os.remove(path)
+            if net is not None:
+                return net
+            else:
+                self._handleErrors(["Failed to load " + str(snapshot),
                                     "HDF5 snapshot format is not supported for weight "
                                     "visualization. This can be changed by setting the "
                                     "snapshot_format in the solver properties."])
+        self._handleErrors(["Failed to load NetParameter for snapshot '" + snapshot + "'"])
+        return None
 
+    def loadLayerBlobs(self, snapshot, layer):
+        """ Return the blobs of one layer in the caffemodel of the snapshot as
+        float32 arrays, or None if they could not be loaded.
+
+        Only the blobs of the layer are transferred. Received layers are kept
+        in a cache of caffemodel_index.BLOB_CACHE_SIZE bytes shared by all
+        remote sessions.
+        """
+        key = (self.uid, snapshot, layer)
+        blobs = _layerBlobCache.get(key)
+        if blobs is not None:
+            return blobs
+        if self._assertConnection():
+            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADLAYERBLOBS,
+                   "snapshot": snapshot, "layer": layer}
+            ret = self.transaction.request(msg)
+            if ret:
+                if ret["status"]:
+                    _layerBlobCache.put(key, ret["blobs"])
+                    return ret["blobs"]
                 else:
                     self._handleErrors(ret["error"])
-        self._handleErrors(["Failed to load NetParameter for snapshot '" + snapshot + "'"])
+                    return None
+        self._handleErrors(["Failed to load layer '" + layer + "' of snapshot '" + snapshot + "'"])
         return None
 
     def getCaffemodelContents(self, snapshot):
@@ -618,15 +679,98 @@ class ClientSession(QObject):
     def loadCaffemodel(self, snapshot):
         """ Loads the contents of the caffemodel file belonging to the given snapshot
         from the server. """
-        if self._assertConnection():
-            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADCAFFEMODEL}
-            msg["snapshot"] = snapshot
-            self.transaction.send(msg)
-            ret = self.transaction.asyncRead(staging=True, attr=("subkey", SessionProtocol.LOADCAFFEMODEL))
-            if ret:
-                if ret["status"]:
-                    return ret["caffemodel"]
-                else:
-                    self._handleErrors(ret["error"])
+        path = self._downloadFile(snapshot)
+        if path is not None:
+            with open(path, 'rb') as f:
+                caffemodel = f.read()
+            os.remove(path)
+            return caffemodel
         self._handleErrors(["Failed to load caffemodel contents for snapshot '" + snapshot + "'"])
         return None
+
+    def _downloadFile(self, snapshot):
+        """ Download a file of the session directory in chunks to a temporary
+        file and return its path.
+
+        Up to TRANSFER_WINDOW chunks are requested ahead. A chunk with a wrong
+        checksum is requested again. If the transfer fails, e.g. because the
+        connection is lost, the next call continues at the last received chunk
+        unless the file on the server has changed.
+        Return None if the transfer failed.
+        """
+        if not self._assertConnection():
+            return None
+        download = self.downloads.get(snapshot)
+        if download is None or not os.path.isfile(download["path"]):
+            fd, path = tempfile.mkstemp(suffix="_" + os.path.basename(snapshot))
+            os.close(fd)
+            download = {"path": path, "offset": 0, "filesize": None, "mtime": None}
+            self.downloads[snapshot] = download
+        # request ids of the requested chunks in the order of their offsets
+        requests = deque()
+        try:
+            with open(download["path"], 'r+b') as f:
+                f.truncate(download["offset"])
+                f.seek(download["offset"])
+                requested = download["offset"]
+                retries = 0
+                while True:
+                    # keep the window of requested chunks filled, until the
+                    # file size is known only the next chunk is requested
+                    if download["filesize"] is None:
+                        end = download["offset"] + 1
+                    else:
+                        end = min(download["filesize"],
+                                  download["offset"] + self.TRANSFER_WINDOW * self.TRANSFER_CHUNK_SIZE)
+                    while requested < end:
+                        msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.LOADFILECHUNK}
+                        msg["snapshot"] = snapshot
+                        msg["offset"] = requested
+                        msg["size"] = self.TRANSFER_CHUNK_SIZE
+                        requestId = self.transaction.sendRequest(msg)
+                        if requestId is None:
+                            return None
+                        requests.append(requestId)
+                        requested += self.TRANSFER_CHUNK_SIZE
+                    ret = self.transaction.waitForResponse(requests.popleft())
+                    if not ret:
+                        return None
+                    if not ret["status"]:
+                        self._handleErrors(ret["error"])
+                        self._removeDownload(snapshot)
+                        return None
+                    if download["mtime"] is not None and (ret["filesize"] != download["filesize"] or
+                                                          ret["mtime"] != download["mtime"]):
+                        # the file changed since the transfer started, restart it
+                        self._removeDownload(snapshot)
+                        return self._downloadFile(snapshot)
+                    download["filesize"] = ret["filesize"]
+                    download["mtime"] = ret["mtime"]
+                    data = ret["data"]
+                    if zlib.crc32(data) & 0xffffffff != ret["checksum"]:
+                        retries += 1
+                        if retries > self.TRANSFER_RETRIES:
+                            self._handleErrors(["Checksum error while loading " + str(snapshot)])
+                            return None
+                        # request the chunk and all following ones again
+                        while requests:
+                            self.transaction.cancelRequest(requests.popleft())
+                        requested = download["offset"]
+                        continue
+                    retries = 0
+                    f.write(data)
+                    download["offset"] += len(data)
+                    if download["offset"] >= download["filesize"] or len(data) == 0:
+                        break
+        finally:
+            for requestId in requests:
+                self.transaction.cancelRequest(requestId)
+        del self.downloads[snapshot]
+        return download["path"]
+
+    def _removeDownload(self, snapshot):
+        """ Discard an unfinished file transfer.
+        """
+        download = self.downloads.pop(snapshot, None)
+        if download is not None and os.path.isfile(download["path"]):
+            os.remove(download["path"])
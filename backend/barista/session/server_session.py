@@ -7,13 +7,14 @@ import sys
 import time
 import uuid
 import shutil
+import zlib
 
 from collections import OrderedDict
 from subprocess import Popen, PIPE, STDOUT
 
 
 from PyQt5.Qt import QObject
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QThread
 
 import backend.caffe.dict_helper as helper
 import backend.caffe.proto_info as info
@@ -25,15 +26,26 @@ from backend.barista.session.session_pool import SessionPool
 from backend.barista.session.session_utils import Paths, Events
 from backend.networking.protocol import Protocol, SessionProtocol
 from backend.parser.concatenator import Concatenator
+from backend.parser.metric_store import MetricStore
+from backend.parser.parse_worker import parseLogFiles
 from backend.parser.parser import Parser
 from backend.parser.parser_listener import ParserListener
 import backend.barista.caffe_versions as caffeVersions
 from backend.barista.deployed_net import DeployedNet
 from backend.caffe.proto_info import UnknownLayerTypeException
+from backend.caffe.caffemodel_index import loadLayerBlobs, CaffemodelFormatError
 
 from PyQt5.QtCore import QTimer
 from threading import Lock
 
+# maximum size of a chunk sent by _msgLoadFileChunk
+FILE_CHUNK_SIZE = 4 * 1024 * 1024
+# milliseconds parser updates are collected before they are sent to the client
+PARSER_BATCH_INTERVAL = 50
+# maximum number of parser updates sent in one message
+PARSER_BATCH_SIZE = 500
+
+
 class ServerSession(QObject, ParserListener, SessionCommon):
     logsig = pyqtSignal(str, bool)  # This is the way to do threadsafe logging while the session is running
     parssig = pyqtSignal(str, OrderedDict)
@@ -69,6 +81,8 @@ class ServerSession(QObject, ParserListener, SessionCommon):
                         SessionProtocol.LOADDEPLOYEDNET: self._msgLoadDeployedNet,
                         SessionProtocol.LOADNETPARAMETER: self._msgLoadNetParameter,
                         SessionProtocol.LOADCAFFEMODEL: self._msgLoadCaffemodel,
+                        SessionProtocol.LOADFILECHUNK: self._msgLoadFileChunk,
+                        SessionProtocol.LOADLAYERBLOBS: self._msgLoadLayerBlobs,
                         SessionProtocol.RESET: self._reset,
                         SessionProtocol.DELETE: self.delete}
 
@@ -106,7 +120,9 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         self.parse_old = False
         self.parser_initialized = False
 
-        self.parserRows = []
+        self.metricStore = None
+        # number of rows per phase which were already sent to the client
+        self.parserRowCounts = {Parser.TRAIN: 0, Parser.TEST: 0}
         self.parserKeys = []
         self.parserHandle = []
         self.parserLogs = []
@@ -118,6 +134,14 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         self.logBuffer = []
         self.logLock = Lock()
 
+        # parser rows, keys and events are sent in batches of (subkey, ...) tuples
+        self.parserTimer = QTimer()
+        self.parserTimer.timeout.connect(self.transmitParserBatch)
+        self.parserTimer.setSingleShot(True)
+        self.parserTimer.setInterval(PARSER_BATCH_INTERVAL)
+        self.parserBatch = []
+        self.parserBatchLock = Lock()
+
         if not parse_old:
             self.pid = pid
         else:
@@ -125,6 +149,19 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             self._parseSessionAndRunID()
             self.parse_old = True
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        """ Set the state and let the manager update its state index.
+        """
+        changed = getattr(self, "_state", None) != state
+        self._state = state
+        if changed and self.manager is not None:
+            self.manager.sessionStateChanged(self)
+
     def __lt__(self, other):
         if type(other) is not ServerSession:
             return True
@@ -176,6 +213,10 @@ class ServerSession(QObject, ParserListener, SessionCommon):
 
     def disconnect(self):
         self.isConnected = False
+        self.parserTimer.stop()
+        self.parserBatchLock.acquire()
+        self.parserBatch = []
+        self.parserBatchLock.release()
         if self.transaction is not None:
             self.transaction.bufferReady.disconnect()
             self.transaction.socketClosed.disconnect()
@@ -209,12 +250,25 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         self.invalidErrorsList = errorList
 
     def setState(self, state):
+        if QThread.currentThread() != self.thread():
+            # called by the parser thread, e.g. for OptimizationDone. The
+            # timers and the socket belong to the thread of the session, so
+            # statesig queues the call to that thread.
+            self.statesig.emit(state)
+            return
         self.state = state
         if (self.isConnected):
+            self.transmitParserBatch()
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.UPDATESTATE}
             msg["state"] = state
+            msg["queued"] = self.isQueued()
             self.transaction.send(msg)
 
+    def isQueued(self):
+        """ Return True if the session waits in the training queue for a device.
+        """
+        return self.manager is not None and self.manager.scheduler.isQueued(self)
+
 
 
     def Log(self, log, error=False):
@@ -236,33 +290,58 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         self.logBuffer = []
         self.logLock.release()
         if self.isConnected:
+            self.transmitParserBatch()
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.PRINTLOG}
             msg["log"] = log
             self.transaction.send(msg)
 
+    def transmitParserBatch(self):
+        """ Send all queued parser updates to the client in one message.
+        """
+        self.parserTimer.stop()
+        self.parserBatchLock.acquire()
+        batch = self.parserBatch
+        self.parserBatch = []
+        self.parserBatchLock.release()
+        if self.isConnected and batch:
+            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.UPDATEPARSER_BATCH, "updates": batch}
+            self.transaction.send(msg)
+
     def addParserRow(self, phase, row):
-        self.parserRows.append((phase, row))
+        self.parserRowCounts[phase] += 1
         if self.isConnected:
-            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.UPDATEPARSER, "phase": phase, "row": row}
-            self.transaction.send(msg)
+            self._queueParserUpdate((SessionProtocol.UPDATEPARSER, phase, row))
 
     def addParserKey(self, phase, key):
         self.parserKeys.append((phase, key))
         if self.isConnected:
-            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.UPDATEKEYS, "phase": phase, "parserkey": key}
-            self.transaction.send(msg)
+            self._queueParserUpdate((SessionProtocol.UPDATEKEYS, phase, key))
 
     def addSnapshot(self, snapshot):
         if self.isConnected:
+            self.transmitParserBatch()
             msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.ADDSNAPSHOT, "snapshot": snapshot}
             self.transaction.send(msg)
 
     def addHandle(self, event, message, groups):
         self.parserHandle.append([event, message, groups])
         if self.isConnected:
-            msg = {"key": Protocol.SESSION, "subkey": SessionProtocol.PARSEHANDLE,
-                   "event": event, "message": message, "groups": groups}
-            self.transaction.send(msg)
+            self._queueParserUpdate((SessionProtocol.PARSEHANDLE, event, message, groups))
+
+    def _queueParserUpdate(self, update):
+        """ Queue a parser update and send the batch when it is full.
+
+        Other messages to the client flush the batch first, so the client
+        receives all updates in order.
+        """
+        self.parserBatchLock.acquire()
+        self.parserBatch.append(update)
+        full = len(self.parserBatch) >= PARSER_BATCH_SIZE
+        self.parserBatchLock.release()
+        if full:
+            self.transmitParserBatch()
+        elif not self.parserTimer.isActive():
+            self.parserTimer.start()
 
     def getDirectory(self):
         return self.directory
@@ -346,6 +425,7 @@ class ServerSession(QObject, ParserListener, SessionCommon):
     def _msgGetState(self):
         msg = self.transaction.asyncRead()
         msg["state"] = self._getState()
+        msg["queued"] = self.isQueued()
         msg["status"] = True
         self.transaction.send(msg)
 
@@ -481,12 +561,14 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             return True
             
 
-    def prepairInternalPrototxt(self):
+    def prepairInternalPrototxt(self, device=None):
         error = []
         serializedDict = copy.deepcopy(self.state_dictionary)
+        if device is None:
+            device = self.manager.parent.trainOnHW
         if "solver" in self.state_dictionary:
             solverDict = self.state_dictionary["solver"]
-            if self.manager.parent.trainOnHW == 0:
+            if device == 0:
                 solverDict["solver_mode"] = 'CPU'
             else:
                 solverDict["solver_mode"] = 'GPU'
@@ -653,12 +735,6 @@ class ServerSession(QObject, ParserListener, SessionCommon):
 
     def _start(self):
         msg = self.transaction.asyncRead()
-        if self.manager.isTraining():
-            msg["error"] = ["Could not start Session. There is already one running Session on this Server."]
-            msg["status"] = False
-            self.transaction.send(msg)
-            return
-        
         solverstate = None
         if "solverstate" in msg:
             solverstate = msg["solverstate"]
@@ -666,17 +742,35 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         if "caffemodel" in msg:
             caffemodel = msg["caffemodel"]
 
-        msg["error"] = self.start(solverstate, caffemodel)
-        msg["status"] = len(msg["error"]) == 0
+        job = lambda device, threads: self.start(solverstate, caffemodel, device, threads)
+        self._scheduleJob(msg, job)
+
+    def _scheduleJob(self, msg, job):
+        """ Hand a training job to the scheduler and answer the message.
+
+        The job starts at once if a device is free, otherwise it is queued.
+        """
+        errors = self.manager.scheduler.submit(self, job, msg.get("priority", 0), msg.get("threads"))
+        msg["queued"] = errors is None
+        if errors is None:
+            errors = []
+            self.Log("Session " + os.path.basename(self.directory) + " was queued and starts when a device is free.")
+        msg["error"] = errors
+        msg["status"] = len(errors) == 0
         self.transaction.send(msg)
 
     def _pause(self):
         msg = self.transaction.asyncRead()
-        msg["status"] = self.pause()
+        # a queued session is only removed from the queue
+        cancelled = self.manager.scheduler.cancel(self)
+        msg["status"] = cancelled or self.pause()
         msg["iteration"] = self.iteration
         if not msg["status"]:
             msg["error"] = ["Could not pause a session in state " + str(self.state)]
         self.transaction.send(msg)
+        if cancelled:
+            # tell the client that the session does not wait any longer
+            self.setState(self.state)
         self.save()
 
     def _reset(self):
@@ -690,17 +784,11 @@ class ServerSession(QObject, ParserListener, SessionCommon):
 
     def _proceed(self):
         msg = self.transaction.asyncRead()
-        if self.manager.isTraining():
-            msg["error"] = ["Could not proceed Session. There is already one running Session on this Server."]
-            msg["status"] = False
-            self.transaction.send(msg)
-            return
         snapshot = None
         if "snapshot" in msg:
             snapshot = msg["snapshot"]
-        msg["error"] = self.proceed(snapshot)
-        msg["status"] = len(msg["error"]) == 0
-        self.transaction.send(msg)
+        job = lambda device, threads: self.proceed(snapshot, device, threads)
+        self._scheduleJob(msg, job)
 
     def _msgSave(self):
         msg = self.transaction.asyncRead()
@@ -732,10 +820,19 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         if self.parser is None:
             self.parser = Parser(None, Events.events)
             self.parser.setLogging(True)
+            self.parser.setMetricStore(self.getMetricStore())
+            self.parser.setCheckpointing(True)
             self.parser.printLogSignl.connect(self.Log, Qt.AutoConnection)
             self.parser.addListener(self)
         return self.parser
 
+    def getMetricStore(self):
+        """ Return the store of the parsed records of this session.
+        """
+        if self.metricStore is None:
+            self.metricStore = MetricStore.forSession(self.directory)
+        return self.metricStore
+
     def getLogs(self):
         """ Return the log directory.
         """
@@ -753,8 +850,12 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         pool = SessionPool()
         pool.addSession(self)
 
-    def parseOldLogs(self):
+    def parseOldLogs(self, processes=None):
         """ Parse all log files in the log directory.
+
+        If a process pool is given, the log files are parsed into the metric
+        store by a worker process. The parser of the session then resumes at
+        the checkpoints written by the worker.
         """
         locked = self.lock.acquire()
         if locked is False:
@@ -777,8 +878,27 @@ class ServerSession(QObject, ParserListener, SessionCommon):
                 for run_id in sorted(log_files.keys()):
                     log_file = os.path.join(self.getLogs(), log_files[run_id])
                     log_list.append(log_file)
-                con = Concatenator(log_list)
-                logs = con.concate()
+                store = self.getMetricStore()
+                if processes is not None:
+                    res = processes.apply(parseLogFiles, (log_list, Events.events, store.directory))
+                    logs = res["Logs"]
+                    store.reload()
+                else:
+                    con = Concatenator(log_list)
+                    logs = con.concate()
+                # resume at the checkpoints of the logs, the records parsed
+                # so far are served from the metric store. The lines before
+                # the checkpoints are not parsed again, so the last events
+                # found in them are replayed to restore max_iter, the last
+                # snapshots and the finished state. This includes the events
+                # parsed by the worker process, whose checkpoints are restored.
+                for event, message, groups in self.getParser().restoreCheckpoints(logs):
+                    self.handle(event, message, groups)
+                for phase in self.parserRowCounts:
+                    self.parserRowCounts[phase] = store.getRowCount(phase)
+                iterations = store.getColumn(Parser.TRAIN, 'NumIters')
+                if len(iterations) > 0:
+                    self.iteration = float(iterations[-1])
                 for log in logs:
                     try:
                         self.getParser().addLogStream(log)
@@ -863,8 +983,12 @@ class ServerSession(QObject, ParserListener, SessionCommon):
         self.iteration = self.max_iter
         self.setState(State.FINISHED)
 
-    def start(self, solverstate=None, caffemodel=None):
-        # TODO only one training per server
+    def start(self, solverstate=None, caffemodel=None, device=None, threads=None):
+        """ Start the training on the hardware id device.
+
+        Without a device the hardware selected on the server is used. threads
+        limits the number of threads of a training on the CPU.
+        """
         error = []
         # (re-)write all session files
         self.save(includeProtoTxt=True, errors=error)
@@ -878,13 +1002,12 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             self._parseSessionAndRunID()
         if self.state is State.WAITING:
             self.rid += 1
-            error.extend(self.prepairInternalPrototxt())
+            error.extend(self.prepairInternalPrototxt(device))
             if len(error) > 0:
                 return error
             caffe_bin = caffeVersions.getDefaultVersion().getBinarypath()
             try:
                 self.getParser().setLogging(True)
-                # TODO set hardware trainOnHW
                 cmd = [
                     caffe_bin, 'train', '-solver',
                     os.path.join(self.directory, Paths.FILE_NAME_SOLVER)]
@@ -894,14 +1017,13 @@ class ServerSession(QObject, ParserListener, SessionCommon):
                 if caffemodel is not None:
                     cmd.append('-weights')
                     cmd.append(str(caffemodel))
-                if self.manager.parent.trainOnHW > 0:
-                    cmd.append('-gpu')
-                    cmd.append(str(self.manager.parent.trainOnHW-1))
+                cmd.extend(self._deviceArguments(device))
                 self.proc = Popen(
                     cmd,
                     stdout=PIPE,
                     stderr=STDOUT,
-                    cwd=self.getSnapshotDirectory())
+                    cwd=self.getSnapshotDirectory(),
+                    env=self._trainEnvironment(device, threads))
                 try:
                     self.tee = Popen(
                         ['tee', '-a', self.getRunLogFileName()],
@@ -966,7 +1088,9 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             self.Log('Could not take a snapshot in state ' + str(self.state))
         return False
 
-    def proceed(self, snapshot=None):
+    def proceed(self, snapshot=None, device=None, threads=None):
+        """ Proceed the training from a snapshot on the hardware id device.
+        """
         if self.state is State.PAUSED:
             if snapshot is None:
                 snapshot = self.getLastSnapshot()
@@ -979,14 +1103,13 @@ class ServerSession(QObject, ParserListener, SessionCommon):
                     os.path.join(self.directory, Paths.FILE_NAME_SOLVER)]
                 cmd.append('-snapshot')
                 cmd.append(snapshot)
-                if self.manager.parent.trainOnHW > 0:
-                    cmd.append('-gpu')
-                    cmd.append(str(self.manager.parent.trainOnHW-1))
+                cmd.extend(self._deviceArguments(device))
                 self.proc = Popen(
                     cmd,
                     stdout=PIPE,
                     stderr=STDOUT,
-                    cwd=self.getDirectory())
+                    cwd=self.getDirectory(),
+                    env=self._trainEnvironment(device, threads))
                 try:
                     self.tee = Popen(
                         ['tee', '-a', self.getRunLogFileName()],
@@ -1004,6 +1127,25 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             self.statesig.emit(self.state)
             return ["Can't proceed a session in state " + str(self.state)]
 
+    def _deviceArguments(self, device):
+        """ Return the caffe arguments to train on the hardware id device.
+        """
+        if device is None:
+            device = self.manager.parent.trainOnHW
+        if device > 0:
+            return ['-gpu', str(device - 1)]
+        return []
+
+    def _trainEnvironment(self, device, threads):
+        """ Return the environment of a caffe process, a training on the CPU
+        is limited to the given number of threads.
+        """
+        env = dict(os.environ)
+        if device == 0 and threads:
+            for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+                env[name] = str(threads)
+        return env
+
     def __ensureDirectory(self):
         if os.path.exists(self.directory) is False:
             try:
@@ -1015,7 +1157,7 @@ class ServerSession(QObject, ParserListener, SessionCommon):
 
     def _msgFetchParserData(self):
         msg = self.transaction.asyncRead()
-        msg["ParserRows"] = self.parserRows
+        msg["ParserColumns"] = self.getMetricStore().getColumns(self.parserRowCounts)
         msg["ParserKeys"] = self.parserKeys
         msg["ParserHandle"] = self.parserHandle
         msg["ParserLogs"] = self.parserLogs
@@ -1086,6 +1228,65 @@ class ServerSession(QObject, ParserListener, SessionCommon):
             msg["error"] = ["No Snapshot provided"]
         self.transaction.send(msg)
 
+    def _msgLoadFileChunk(self):
+        """ Send a chunk of a file in the session directory.
+
+        The client requests the chunks of a file one after another by offset.
+        Every chunk contains a checksum and the size and modification time
+        of the file, so the client can resume an interrupted transfer as long
+        as the file did not change.
+        """
+        msg = self.transaction.asyncRead()
+        msg["status"] = False
+        if "snapshot" in msg.keys():
+            path = os.path.realpath(os.path.join(self.directory, msg["snapshot"]))
+            if not path.startswith(os.path.realpath(self.directory) + os.sep):
+                msg["error"] = ["Invalid path " + str(msg["snapshot"])]
+            elif os.path.isfile(path):
+                try:
+                    size = min(int(msg.get("size", FILE_CHUNK_SIZE)), FILE_CHUNK_SIZE)
+                    with open(path, 'rb') as f:
+                        f.seek(int(msg.get("offset", 0)))
+                        data = f.read(size)
+                    msg["data"] = data
+                    msg["checksum"] = zlib.crc32(data) & 0xffffffff
+                    msg["filesize"] = os.path.getsize(path)
+                    msg["mtime"] = os.path.getmtime(path)
+                    msg["status"] = True
+                except (IOError, OSError, ValueError):
+                    msg["error"] = ["Failed to load " + str(path)]
+            else:
+                msg["error"] = ["File not found " + str(path)]
+        else:
+            msg["error"] = ["No Snapshot provided"]
+        self.transaction.send(msg)
+
+    def _msgLoadLayerBlobs(self):
+        """ Send the blobs of one layer of a caffemodel in the session directory.
+
+        Only the requested layer is decoded, so the client receives the blobs
+        of the layer instead of the whole model.
+        """
+        msg = self.transaction.asyncRead()
+        msg["status"] = False
+        if "snapshot" in msg.keys() and "layer" in msg.keys():
+            path = os.path.realpath(os.path.join(self.directory, msg["snapshot"]))
+            if not path.startswith(os.path.realpath(self.directory) + os.sep):
+                msg["error"] = ["Invalid path " + str(msg["snapshot"])]
+            elif os.path.isfile(path):
+                try:
+                    msg["blobs"] = loadLayerBlobs(path, msg["layer"])
+                    msg["status"] = True
+                except KeyError:
+                    msg["error"] = ["Layer " + str(msg["layer"]) + " not found in " + str(path)]
+                except (IOError, OSError, CaffemodelFormatError) as e:
+                    msg["error"] = ["Failed to load " + str(path) + ": " + str(e)]
+            else:
+                msg["error"] = ["File not found " + str(path)]
+        else:
+            msg["error"] = ["No Snapshot or layer provided"]
+        self.transaction.send(msg)
+
     def reset(self):
         self.pause()
         for dirpath, dirnames, filenames in os.walk(self.directory, topdown=True):
@@ -1108,6 +1309,9 @@ class ServerSession(QObject, ParserListener, SessionCommon):
                     except OSError as e:
                         self.logsig.emit('Failed to delete ' + str(filename) + ': ' + str(e), self.getCallerId(), True)
             break
+        self.getMetricStore().clear()
+        for phase in self.parserRowCounts:
+            self.parserRowCounts[phase] = 0
         self.iteration = 0
         self.state = State.UNDEFINED
         self._getState()
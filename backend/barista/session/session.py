@@ -260,6 +260,11 @@ class Session(QObject, LogCaller, ParserListener, SessionCommon):
     def getErrorList(self):
         return self.invalidErrorsList
 
+    def isQueued(self):
+        """ Local sessions start at once, only remote sessions are queued.
+        """
+        return False
+
     def setState(self, state):
         """ Set the state of the session and emit a stateChanged signal.
         """
@@ -632,8 +637,11 @@ class Session(QObject, LogCaller, ParserListener, SessionCommon):
         """
         return self.getLogFileName(True)
 
-    def parseOldLogs(self):
+    def parseOldLogs(self, processes=None):
         """ Parse all log files in the log directory.
+
+        If a process pool is given, the log files are scanned for snapshots in
+        parallel.
         """
         locked = self.lock.acquire()
         if locked is False:
@@ -656,7 +664,7 @@ class Session(QObject, LogCaller, ParserListener, SessionCommon):
                 for run_id in sorted(log_files.keys()):
                     log_file = os.path.join(self.getLogs(), log_files[run_id])
                     log_list.append(log_file)
-                con = Concatenator(log_list)
+                con = Concatenator(log_list, processes)
                 logs = con.concate()
                 for log in logs:
                     try:
@@ -1,3 +1,4 @@
+import logging
 import multiprocessing
 import sys
 if sys.version_info[0] == 2:
@@ -29,6 +30,11 @@ class SessionPool:
     priority.
     The pool allocates and starts threads on demand. It allocates no more then
     CPU_COUNT - 2 threads, but at least 1.
+    If the pool is activated with processes, the threads hand the parsing of
+    the old log files over to a process pool of the same size, so parsing is
+    not limited by the GIL. The process pool forks the current process, it
+    has to be started by startProcesses before any Qt objects or threads
+    exist.
     """
 
     __metaclass__ = Singleton
@@ -37,6 +43,9 @@ class SessionPool:
         self.sessions = PriorityQueue()
         self.pool = []
         self.__start_jobs = False
+        self.processes = None
+        # parse the old log files in the process pool
+        self.__use_processes = False
         self.MAX_THREADS = multiprocessing.cpu_count() - 2
         if self.MAX_THREADS <= 0:
             self.MAX_THREADS = 1
@@ -48,9 +57,26 @@ class SessionPool:
         if self.__start_jobs:
             self.__startJob()
 
-    def activate(self, emptyJob):
+    def startProcesses(self):
+        """ Start the process pool for parsing.
+
+        Forking a process with running Qt timers, sockets or threads can
+        deadlock the workers, so this has to be called at startup before the
+        application creates any of them.
+        """
+        if self.processes is None:
+            self.processes = multiprocessing.Pool(self.MAX_THREADS)
+
+    def activate(self, emptyJob, processes=False):
         """ Activates this pool by starting threads.
+
+        If processes is True, the threads parse old log files in the process
+        pool. It is not started here, because the process has threads by now,
+        without startProcesses the threads parse the logs themselves.
         """
+        if processes and self.processes is None:
+            logging.warning('No process pool was started, log files are parsed by threads.')
+        self.__use_processes = processes
         self.__start_jobs = True
         self.emptyJob = emptyJob
         qs = self.sessions.qsize()
@@ -58,6 +84,14 @@ class SessionPool:
         for i in range(0, starts):
             self.__startJob()
 
+    def getProcessPool(self):
+        """ Return the process pool started by startProcesses or None.
+
+        Other parallel jobs of the application, e.g. the consistency check of
+        databases, use this pool instead of forking their own.
+        """
+        return self.processes
+
     # private methods
 
     def __startJob(self):
@@ -90,7 +124,7 @@ class SessionPool:
             while True:
                 session = self.sessions.get(True, 1)
                 if session:
-                    session.parseOldLogs()
+                    session.parseOldLogs(self.processes if self.__use_processes else None)
                     parser = session.getParser()
                     parser.parseLog()
                     self.sessions.task_done()
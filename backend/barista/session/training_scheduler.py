@@ -0,0 +1,176 @@
+import itertools
+import multiprocessing
+from threading import Lock
+
+from PyQt5.QtCore import QTimer
+
+from backend.barista.session.session_utils import State
+
+
+class TrainingScheduler(object):
+    """ Start the training of sessions on the free devices of the server.
+
+    Sessions are queued with a priority and started as soon as a device is
+    free. Devices are the hardware ids of the server: 0 is the CPU, i > 0 is
+    the GPU i - 1. If a GPU is selected on the server, jobs run on all GPUs
+    with at most JOBS_PER_GPU jobs per GPU, the selected one is preferred.
+    Otherwise jobs run on the CPU and share its threads.
+
+    A device is released when its session stops running. This may happen in
+    any thread, the queue is then processed on the next check in the thread
+    of the scheduler.
+    """
+
+    # milliseconds between the checks for released devices
+    SCHEDULE_INTERVAL = 1000
+    # number of sessions training on one GPU at the same time
+    JOBS_PER_GPU = 1
+
+    def __init__(self, server):
+        self.server = server
+        # entries [-priority, number, session, job, threads]
+        self.queue = []
+        self.counter = itertools.count()
+        # session uid -> (hardware id, cpu threads)
+        self.running = {}
+        self.cpuThreads = multiprocessing.cpu_count()
+        self.defaultThreads = max(1, self.cpuThreads // 2)
+        self.released = False
+        self.lock = Lock()
+        self.timer = QTimer()
+        self.timer.setInterval(TrainingScheduler.SCHEDULE_INTERVAL)
+        self.timer.timeout.connect(self._checkReleased)
+        self.timer.start()
+
+    def submit(self, session, job, priority=0, threads=None):
+        """ Queue the training job of a session and start jobs on free devices.
+
+        job is called with the hardware id and the number of cpu threads to
+        use and returns a list of errors. Return the errors of the job if it
+        was started at once, otherwise None.
+        """
+        if threads is None:
+            threads = self.defaultThreads
+        threads = min(max(1, int(threads)), self.cpuThreads)
+        self.lock.acquire()
+        try:
+            if self._find(session) is not None or session.uid in self.running:
+                return ["Session is already scheduled."]
+            self.queue.append([-priority, next(self.counter), session, job, threads])
+        finally:
+            self.lock.release()
+        self.server.invalidateStatus()
+        return self.schedule().get(session.uid)
+
+    def cancel(self, session):
+        """ Remove a session from the queue. Return True if it was queued.
+        """
+        self.lock.acquire()
+        try:
+            entry = self._find(session)
+            if entry is None:
+                return False
+            self.queue.remove(entry)
+        finally:
+            self.lock.release()
+        self.server.invalidateStatus()
+        return True
+
+    def isQueued(self, session):
+        return self._find(session) is not None
+
+    def queueLength(self):
+        return len(self.queue)
+
+    def sessionStateChanged(self, session):
+        """ Release the device of a session which stopped running.
+        """
+        if session.state != State.RUNNING:
+            self.lock.acquire()
+            if self.running.pop(session.uid, None) is not None:
+                self.released = True
+            self.lock.release()
+
+    def wakeUp(self):
+        """ Process the queue on the next check, e.g. after the devices changed.
+        """
+        self.released = True
+
+    def schedule(self):
+        """ Start queued jobs while devices are free.
+
+        Return the errors of the started jobs keyed by session uid.
+        """
+        results = {}
+        while True:
+            self.lock.acquire()
+            try:
+                started = None
+                for entry in sorted(self.queue):
+                    device = self._freeDevice(entry[4])
+                    if device is not None:
+                        started = entry
+                        self.queue.remove(entry)
+                        threads = entry[4] if device == 0 else 0
+                        self.running[entry[2].uid] = (device, threads)
+                        break
+            finally:
+                self.lock.release()
+            if started is None:
+                break
+            _, _, session, job, threads = started
+            try:
+                errors = job(device, threads)
+            except Exception as e:
+                errors = ["Failed to start session: " + str(e)]
+            if errors:
+                self.lock.acquire()
+                self.running.pop(session.uid, None)
+                self.lock.release()
+            results[session.uid] = errors
+        if results:
+            self.server.invalidateStatus()
+        return results
+
+    # private methods
+
+    def _checkReleased(self):
+        if self.released:
+            self.released = False
+            for uid, errors in self.schedule().items():
+                session = self.server.sessionManager.findSessionBySessionUid(uid)
+                if session is None:
+                    # the session was deleted while its job was starting
+                    continue
+                for error in errors:
+                    session.Log(error, True)
+                if errors:
+                    # the session left the queue without starting
+                    session.setState(session.state)
+
+    def _find(self, session):
+        for entry in self.queue:
+            if entry[2].uid == session.uid:
+                return entry
+        return None
+
+    def _freeDevice(self, threads):
+        """ Return the hardware id of a free device or None.
+        """
+        if self.server.hardwareScan is not None:
+            # wait until the devices are known
+            return None
+        hardware = self.server.hardware
+        selected = self.server.trainOnHW
+        if selected > 0 and len(hardware) > 1:
+            devices = range(1, len(hardware))
+            devices.sort(key=lambda hid: hid != selected)
+            for hid in devices:
+                jobs = len([1 for device, _ in self.running.values() if device == hid])
+                if jobs < TrainingScheduler.JOBS_PER_GPU:
+                    return hid
+            return None
+        used = sum(t for device, t in self.running.values() if device == 0)
+        if used + threads <= self.cpuThreads:
+            return 0
+        return None
@@ -1,6 +1,7 @@
 import os
 import hashlib
 
+from backend.barista.utils.hash_cache import fingerprint, getHashCache
 from backend.barista.utils.logger import *
 
 """
@@ -14,6 +15,12 @@ Logger ID used in functions below.
 """
 DBUTIL_LOGGER_ID = Log.getCallerId("dbutil")
 
+"""
+Modes of getMultipleHash: the full content hash or a fast fingerprint, see getFingerprint.
+"""
+HASH_FULL = "full"
+HASH_FINGERPRINT = "fingerprint"
+
 """
 returns a hash value by calling a hash function for the opened file of the given path
 Warning: This is not meant to be used for HDF5TXT files. You need to use getHdf5List() and call getMultipleHash
@@ -25,24 +32,50 @@ with the result.
 @pre dbPath is a valid path
 """
 def getHash(dbPath):
+    value = getHashCache().get(dbPath, "sha256", _sha256)
+    return int(value, 16)
+
+"""
+returns the sha256 hex digest of a whole file
+
+The value of getHash is used as database id, so the file is hashed in one piece and not with a tree hash.
+"""
+def _sha256(dbPath):
     hashObject = hashlib.sha256()
     with open(dbPath, "rb") as openDB:
-        for chunk in iter(lambda: openDB.read(2**15), b""):
+        for chunk in iter(lambda: openDB.read(2**20), b""):
             hashObject.update(chunk)
-    return int(hashObject.hexdigest(), 16)
+    return hashObject.hexdigest()
+
+"""
+returns a fingerprint of a database file as int
+
+A fingerprint is not a cryptographic hash: it covers the file size, the metadata pages at head and tail of the file
+and evenly spaced sampled blocks. It is meant for fast change detection of huge databases and must not be compared
+with values of getHash.
+
+@param dbPath: a path to a database file, for example a data.mdb
+@return a fingerprint of the database as int
+@pre dbPath is a valid path
+"""
+def getFingerprint(dbPath):
+    return int(fingerprint(dbPath), 16)
 
 """
 hashes all files in the given paths
 
 @author j_stru18
 @param dbPaths a list of paths
+@param mode HASH_FULL to hash the whole content or HASH_FINGERPRINT for a fingerprint of every file
 @return a hash value for all files in the given paths as int
 """
-def getMultipleHash(dbPaths):
+def getMultipleHash(dbPaths, mode=HASH_FULL):
+    hashFunction = getFingerprint if mode == HASH_FINGERPRINT else getHash
     hashValue = 0
     for path in dbPaths:  # hash all the old .h5 and .hdf5 files in HDF5TXT
         if os.path.exists(path):
-            hashValue += getHash(path)
+            hashValue += hashFunction(path)
+    getHashCache().save()
     return hashValue
 
 """
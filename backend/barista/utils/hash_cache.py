@@ -0,0 +1,214 @@
+import hashlib
+import json
+import mmap
+import os
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from backend.barista.utils.logger import Log
+
+"""
+This file contains a persistent cache for hash values of files, the tree hash for large files and fingerprints.
+
+A cached value is valid as long as size, mtime and inode of the file did not change.
+"""
+
+"""
+Default location of the cache file.
+"""
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".barista", "hashcache.json")
+
+"""
+Files are split into chunks of this size for the tree hash.
+"""
+TREE_CHUNK_SIZE = 64 * 1024 * 1024
+
+"""
+Number of chunks hashed at the same time. hashlib releases the GIL while hashing, so threads are sufficient.
+"""
+TREE_THREADS = 4
+
+"""
+Number and size of the evenly spaced blocks read for a fingerprint.
+"""
+FINGERPRINT_SAMPLES = 64
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+"""
+Head and tail of a file are always part of a fingerprint. The head holds the meta pages of a LMDB data.mdb, the tail
+the footer and index of a LevelDB table file.
+"""
+FINGERPRINT_HEAD_SIZE = 64 * 1024
+FINGERPRINT_TAIL_SIZE = 64 * 1024
+
+"""
+Logger ID used in functions below.
+"""
+HASHCACHE_LOGGER_ID = Log.getCallerId("hashcache")
+
+
+class HashCache(object):
+    """ Cache hash values of files keyed by path, size, mtime and inode.
+
+    Values are cached per algorithm name, so one file can have several
+    cached hashes. The cache is written to disk by save.
+    """
+
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+        self.entries = None
+        self.dirty = False
+        self.lock = Lock()
+
+    def get(self, path, algorithm, compute):
+        """ Return the hash of the file computed with compute(path).
+
+        compute is only called if no valid value is cached for the algorithm.
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime, stat.st_ino]
+        self.lock.acquire()
+        try:
+            entry = self._getEntries().get(path)
+            if entry is not None and entry["key"] == key and algorithm in entry["hashes"]:
+                return entry["hashes"][algorithm]
+        finally:
+            self.lock.release()
+        value = compute(path)
+        self.lock.acquire()
+        try:
+            entries = self._getEntries()
+            entry = entries.get(path)
+            if entry is None or entry["key"] != key:
+                entry = {"key": key, "hashes": {}}
+                entries[path] = entry
+            entry["hashes"][algorithm] = value
+            self.dirty = True
+        finally:
+            self.lock.release()
+        return value
+
+    def invalidate(self, path):
+        """ Remove all cached values of a file.
+        """
+        self.lock.acquire()
+        try:
+            if self._getEntries().pop(os.path.realpath(path), None) is not None:
+                self.dirty = True
+        finally:
+            self.lock.release()
+
+    def save(self):
+        """ Write the cache to disk if it changed. Entries of deleted files are dropped.
+        """
+        self.lock.acquire()
+        try:
+            if not self.dirty:
+                return
+            for path in [path for path in self.entries if not os.path.exists(path)]:
+                del self.entries[path]
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = self.filename + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.filename)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            Log.error("Could not write hash cache " + self.filename + ": " + str(e), HASHCACHE_LOGGER_ID)
+        finally:
+            self.lock.release()
+
+    # private methods
+
+    def _getEntries(self):
+        if self.entries is None:
+            self.entries = {}
+            try:
+                with open(self.filename, "r") as f:
+                    self.entries = json.load(f)
+            except (IOError, ValueError):
+                pass
+        return self.entries
+
+
+_hashCache = None
+
+
+def getHashCache():
+    """ Return the hash cache shared by all hash functions.
+    """
+    global _hashCache
+    if _hashCache is None:
+        _hashCache = HashCache()
+    return _hashCache
+
+
+def treeHash(path, algorithm="sha256"):
+    """ Return the hex digest of a tree hash of the file.
+
+    The file is split into chunks of TREE_CHUNK_SIZE which are hashed in
+    parallel. The result is the hash of the file size and the chunk digests.
+    """
+    size = os.path.getsize(path)
+    offsets = range(0, size, TREE_CHUNK_SIZE)
+
+    def hashChunk(offset):
+        h = hashlib.new(algorithm)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            remaining = min(TREE_CHUNK_SIZE, size - offset)
+            while remaining > 0:
+                data = f.read(min(2 ** 20, remaining))
+                if not data:
+                    break
+                h.update(data)
+                remaining -= len(data)
+        return h.digest()
+
+    if len(offsets) > 1:
+        pool = ThreadPool(min(TREE_THREADS, len(offsets)))
+        try:
+            digests = pool.map(hashChunk, offsets)
+        finally:
+            pool.close()
+    else:
+        digests = [hashChunk(offset) for offset in offsets]
+    root = hashlib.new(algorithm)
+    root.update(str(size))
+    for digest in digests:
+        root.update(digest)
+    return root.hexdigest()
+
+
+def fingerprint(path):
+    """ Return the hex digest of a fingerprint of the file.
+
+    A fingerprint is NOT a cryptographic hash of the content. It only covers
+    the file size, head, tail and FINGERPRINT_SAMPLES evenly spaced blocks, so
+    changes between the sampled blocks which keep the size are not detected.
+    It reads a few megabytes independent of the file size.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha256()
+    h.update("fingerprint:" + str(size))
+    if size == 0:
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            h.update(data[:FINGERPRINT_HEAD_SIZE])
+            h.update(data[max(0, size - FINGERPRINT_TAIL_SIZE):])
+            step = size // FINGERPRINT_SAMPLES
+            if step > FINGERPRINT_BLOCK_SIZE:
+                for i in xrange(FINGERPRINT_SAMPLES):
+                    offset = i * step
+                    h.update(data[offset:offset + FINGERPRINT_BLOCK_SIZE])
+            elif size > FINGERPRINT_HEAD_SIZE + FINGERPRINT_TAIL_SIZE:
+                # the samples would cover the whole file
+                h.update(data[FINGERPRINT_HEAD_SIZE:size - FINGERPRINT_TAIL_SIZE])
+        finally:
+            data.close()
+    return h.hexdigest()
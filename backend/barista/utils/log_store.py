@@ -0,0 +1,169 @@
+import codecs
+import logging
+from collections import deque
+from threading import Lock
+
+'''
+Bounded storage of the log lines of the Logger
+'''
+
+
+class LogStore:
+    '''
+    Ring buffer of the last capacity log lines with indexes per caller and
+    message type.
+
+    Every line gets an increasing sequence number. A line is overwritten by
+    the line capacity positions later, if a spill file is set the overwritten
+    line is appended to it first. The indexes hold the sequence numbers of the
+    lines of each caller and type, so filtered views need no scan of the whole
+    buffer.
+    '''
+
+    def __init__(self, capacity):
+        self.__capacity = capacity
+        self.__lines = [None] * capacity
+        # sequence number of the next line and of the oldest line in the buffer
+        self.__next = 0
+        self.__first = 0
+        # callerId -> deque of sequence numbers
+        self.__byCaller = {}
+        # typeId -> deque of sequence numbers
+        self.__byType = {}
+        self.__spillPath = None
+        self.__spillFile = None
+        self.__lock = Lock()
+
+    def __len__(self):
+        return self.__next - self.__first
+
+    def append(self, logline):
+        '''
+        stores the line and returns its sequence number
+        '''
+        with self.__lock:
+            seq = self.__next
+            if seq - self.__first == self.__capacity:
+                self.__evict()
+            self.__lines[seq % self.__capacity] = logline
+            self.__byCaller.setdefault(logline.caller.callerId, deque()).append(seq)
+            self.__byType.setdefault(logline.msgType.typeId, deque()).append(seq)
+            self.__next = seq + 1
+            return seq
+
+    def get(self, seq):
+        '''
+        returns the line with the sequence number or None if it was
+        overwritten or removed
+        '''
+        if seq < self.__first or seq >= self.__next:
+            return None
+        return self.__lines[seq % self.__capacity]
+
+    def firstSeq(self):
+        '''
+        sequence number of the oldest line in the buffer
+        '''
+        return self.__first
+
+    def nextSeq(self):
+        '''
+        sequence number the next line will get
+        '''
+        return self.__next
+
+    def getSeqs(self, callerId=None, typeId=None, start=0, end=None):
+        '''
+        returns the ascending sequence numbers of the stored lines of the
+        caller and type in [start, end), None matches all callers or types
+
+        The indexes are walked from the newest line, so fetching the lines
+        since the last call only costs the number of new lines.
+        '''
+        with self.__lock:
+            start = max(start, self.__first)
+            if end is None or end > self.__next:
+                end = self.__next
+            if callerId is None and typeId is None:
+                return [seq for seq in range(start, end) if self.__lines[seq % self.__capacity] is not None]
+            if callerId is None:
+                seqs = self.__byType.get(typeId, ())
+            else:
+                seqs = self.__byCaller.get(callerId, ())
+            result = []
+            for seq in reversed(seqs):
+                if seq >= end:
+                    continue
+                if seq < start:
+                    break
+                logline = self.__lines[seq % self.__capacity]
+                if logline is None:
+                    continue
+                if typeId is not None and logline.msgType.typeId != typeId:
+                    continue
+                result.append(seq)
+            result.reverse()
+            return result
+
+    def getLines(self, callerId=None, typeId=None):
+        '''
+        returns the stored lines of the caller and type
+        '''
+        return [self.get(seq) for seq in self.getSeqs(callerId, typeId)]
+
+    def removeCaller(self, callerId):
+        '''
+        removes all lines of the caller
+        '''
+        with self.__lock:
+            for seq in self.__byCaller.pop(callerId, ()):
+                if seq >= self.__first:
+                    self.__lines[seq % self.__capacity] = None
+
+    def setSpillFile(self, path):
+        '''
+        lines which are overwritten are appended to the file at path,
+        None disables spilling
+        '''
+        with self.__lock:
+            if self.__spillFile is not None:
+                self.__spillFile.close()
+                self.__spillFile = None
+            self.__spillPath = path
+
+    # private methods
+
+    def __evict(self):
+        seq = self.__first
+        pos = seq % self.__capacity
+        logline = self.__lines[pos]
+        self.__lines[pos] = None
+        self.__first = seq + 1
+        if logline is None:
+            return
+        self.__trim(self.__byCaller, logline.caller.callerId)
+        self.__trim(self.__byType, logline.msgType.typeId)
+        if self.__spillPath is not None:
+            self.__spill(logline)
+
+    def __trim(self, index, key):
+        seqs = index.get(key)
+        if seqs is None:
+            return
+        # removed lines can leave older numbers in front
+        while seqs and seqs[0] < self.__first:
+            seqs.popleft()
+        if not seqs:
+            del index[key]
+
+    def __spill(self, logline):
+        try:
+            if self.__spillFile is None:
+                self.__spillFile = codecs.open(self.__spillPath, 'a', 'utf-8')
+            self.__spillFile.write(u'[{}, {}, {}] {}\n'.format(
+                logline.time, logline.caller.description, logline.msgType.description, logline.line))
+            self.__spillFile.flush()
+        except (IOError, OSError, UnicodeError) as e:
+            # the Logger can not be used here, it appends to this store
+            logging.warning('Could not write log file %s: %s', self.__spillPath, e)
+            self.__spillPath = None
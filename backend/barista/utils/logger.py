@@ -7,6 +7,8 @@ import inspect
 import datetime
 import time as tim
 
+from backend.barista.utils.log_store import LogStore
+
 '''
 Model/Helper-Classes
 '''
@@ -30,6 +32,8 @@ class LogLine:
         self.caller = caller
         self.msgType = msgType
         self.time = time
+        # position in the LogStore, set when the line is stored
+        self.seq = None
 
 
 class Caller:
@@ -68,8 +72,8 @@ class LogCaller:
 
 class Logger(QObject):
     """
-    TODO: Selection is removed on insertion, fix needed?
-    TODO: Logfile schreiben
+    Keeps the last MAX_LINES log lines in a LogStore. Older lines are dropped
+    or, if a file is set, written to it.
     """
 
     newLine = QtCore.pyqtSignal(object)
@@ -85,13 +89,15 @@ class Logger(QObject):
     TEXT = None
     ALL = None
 
+    # number of lines kept in memory
+    MAX_LINES = 100000
+
     def __init__(self):
         super(Logger, self).__init__()
-        self.__loglines = []
+        self.__loglines = LogStore(Logger.MAX_LINES)
         self.__callerIdCount = 0
         self.__removedCallers = []
         self.__callers = {}
-        self.__guiConsole = None
         self.__filePath = None
         self.__defaultCaller = Caller(-1, "Caller could not be identified", False)
 
@@ -138,8 +144,9 @@ class Logger(QObject):
 
     def appendLine(self, line, callerId, msgType=None):
         '''
-        appends a sing line to the logger and if existing to console
-        and file
+        appends a line to the log store, text with several lines is stored
+        as one LogLine per line, because the console shows every LogLine in a
+        row of one line height
         line: String , the string to append
         callerId: Int, the id created by getCallerId
         msgType: MessageType, An Object indicating which Type this logline is
@@ -151,14 +158,14 @@ class Logger(QObject):
         st = datetime.datetime.fromtimestamp(ts).strftime("%H:%M:%S")
         caller = self.getCallerFromIdWithFallback(callerId)
         caller.setUsed()
-        logline = LogLine(line, caller, msgType, st)
-        self.__loglines.append(logline)
+        if not isinstance(line, (str, type(u''))):
+            line = str(line)
+        for text in line.splitlines() or [line]:
+            logline = LogLine(text, caller, msgType, st)
+            logline.seq = self.__loglines.append(logline)
 
-        # notify all consoles etc about new line
-        self.newLine.emit(logline)
-
-        if self.__filePath is not None:
-            self.__guiConsole.appendLineToConsole(logline)
+            # notify all consoles etc about new line
+            self.newLine.emit(logline)
 
     def appendLines(self, lines, callerId):
         '''
@@ -189,14 +196,24 @@ class Logger(QObject):
 
         self.__callers.pop(callerId, None)
         if(keepLines == False):
-            filterLines = lambda logline: logline.caller.callerId != callerId
-            self.__loglines = list(filter(filterLines, self.__loglines))
+            self.__loglines.removeCaller(callerId)
             self.refreshGui()
         else:
             self.refreshCallers()
 
     def setFile(self, filePath):
+        '''
+        lines which do not fit into the log store anymore are appended to
+        the file, None drops them
+        '''
         self.__filePath = filePath
+        self.__loglines.setSpillFile(filePath)
+
+    def getStore(self):
+        '''
+        returns the LogStore holding the log lines
+        '''
+        return self.__loglines
 
     def refreshGui(self):
         '''
@@ -207,7 +224,7 @@ class Logger(QObject):
 
     def refreshConsole(self):
         '''
-        refreshs/validates the whole console
+        refreshs/validates the whole console, the LogStore is emitted
         '''
         self.sigRefreshGui.emit(self.__loglines)
 
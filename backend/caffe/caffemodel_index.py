@@ -0,0 +1,294 @@
+import mmap
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+"""
+This file contains an index of the layers in a binary caffemodel, so single blobs can be read without parsing the
+whole NetParameter.
+
+The protobuf wire format of the file is scanned once. For every layer the index stores its type and the byte range of
+every BlobProto, a blob is only decoded when it is requested.
+"""
+
+"""
+Field numbers of caffe.proto which are used by the index.
+"""
+_NET_LAYER = 100
+_NET_LAYERS_V1 = 2
+_LAYER_NAME = 1
+_LAYER_TYPE = 2
+_LAYER_BLOBS = 7
+_V1_NAME = 4
+_V1_TYPE = 5
+_V1_BLOBS = 6
+_BLOB_NUM = 1
+_BLOB_CHANNELS = 2
+_BLOB_HEIGHT = 3
+_BLOB_WIDTH = 4
+_BLOB_DATA = 5
+_BLOB_SHAPE = 7
+_BLOB_DOUBLE_DATA = 8
+_SHAPE_DIM = 1
+
+"""
+Protobuf wire types.
+"""
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+_HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+"""
+Maximum number of bytes of decoded blobs kept by the shared blob cache.
+"""
+BLOB_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class CaffemodelFormatError(Exception):
+    pass
+
+
+class CaffemodelIndex(object):
+    """ Index of the layers and blobs of a binary caffemodel.
+
+    The file is memory mapped, so scanning only touches the pages with the
+    field headers and decoding a blob only reads its own bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        # layer name -> (type, [(start, end) of each blob])
+        self.layers = OrderedDict()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise CaffemodelFormatError("Empty caffemodel " + path)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(_HDF5_SIGNATURE)] == _HDF5_SIGNATURE:
+                raise CaffemodelFormatError("HDF5 caffemodels are not supported: " + path)
+            self._scan(data)
+        finally:
+            data.close()
+        if not self.layers:
+            raise CaffemodelFormatError("No layers found in " + path)
+
+    def getLayerNames(self):
+        return list(self.layers.keys())
+
+    def getLayerType(self, layerName):
+        return self.layers[layerName][0]
+
+    def getBlobCount(self, layerName):
+        return len(self.layers[layerName][1])
+
+    def readBlobs(self, layerName):
+        """ Decode all blobs of the layer and return them as float32 arrays in their shape.
+        """
+        ranges = self.layers[layerName][1]
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [_decodeBlob(data, start, end) for start, end in ranges]
+            finally:
+                data.close()
+
+    # private methods
+
+    def _scan(self, data):
+        for field, wireType, start, end in _fields(data, 0, len(data)):
+            if wireType != _LENGTH_DELIMITED:
+                continue
+            if field == _NET_LAYER:
+                self._scanLayer(data, start, end, _LAYER_NAME, _LAYER_TYPE, _LAYER_BLOBS)
+            elif field == _NET_LAYERS_V1:
+                self._scanLayer(data, start, end, _V1_NAME, _V1_TYPE, _V1_BLOBS)
+
+    def _scanLayer(self, data, start, end, nameField, typeField, blobsField):
+        name = None
+        type = None
+        blobs = []
+        for field, wireType, fieldStart, fieldEnd in _fields(data, start, end):
+            if field == nameField and wireType == _LENGTH_DELIMITED:
+                name = data[fieldStart:fieldEnd].decode('utf-8')
+            elif field == typeField:
+                # a string for LayerParameter, an enum value for V1LayerParameter
+                if wireType == _LENGTH_DELIMITED:
+                    type = data[fieldStart:fieldEnd].decode('utf-8')
+                else:
+                    type = fieldStart
+            elif field == blobsField and wireType == _LENGTH_DELIMITED:
+                blobs.append((fieldStart, fieldEnd))
+        if name is not None:
+            self.layers[name] = (type, blobs)
+
+
+class BlobCache(object):
+    """ LRU of decoded layer blobs which is bounded by the number of bytes of
+    the blobs.
+    """
+
+    def __init__(self, maxBytes=BLOB_CACHE_SIZE):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        """ Return the cached blobs of the key or None.
+        """
+        with self.lock:
+            blobs = self.entries.pop(key, None)
+            if blobs is not None:
+                self.entries[key] = blobs
+            return blobs
+
+    def put(self, key, blobs):
+        """ Cache the blobs, the least recently used entries are dropped if the cache is full.
+        """
+        size = sum(blob.nbytes for blob in blobs)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= sum(blob.nbytes for blob in old)
+            if size > self.maxBytes:
+                return
+            while self.entries and self.size + size > self.maxBytes:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= sum(blob.nbytes for blob in dropped)
+            self.entries[key] = blobs
+            self.size += size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_indexes = {}
+_indexLock = Lock()
+_blobCache = BlobCache()
+
+
+def getIndex(path):
+    """ Return the index of the caffemodel, it is built again if the file changed.
+    """
+    path = os.path.realpath(path)
+    mtime = os.path.getmtime(path)
+    with _indexLock:
+        index = _indexes.get(path)
+    if index is None or index.mtime != mtime:
+        index = CaffemodelIndex(path)
+        with _indexLock:
+            _indexes[path] = index
+    return index
+
+
+def loadLayerBlobs(path, layerName):
+    """ Return the blobs of a layer in the caffemodel as float32 arrays.
+
+    Decoded layers are kept in a shared cache of BLOB_CACHE_SIZE bytes.
+    Raise KeyError if the layer does not exist and CaffemodelFormatError if the
+    file is no binary caffemodel.
+    """
+    index = getIndex(path)
+    key = (index.path, index.mtime, layerName)
+    blobs = _blobCache.get(key)
+    if blobs is None:
+        blobs = index.readBlobs(layerName)
+        _blobCache.put(key, blobs)
+    return blobs
+
+
+def _readVarint(data, pos, end):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= end:
+            raise CaffemodelFormatError("Truncated varint")
+        byte = ord(data[pos:pos + 1])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data, pos, end):
+    """ Yield (field number, wire type, start, end) of the fields of the message
+    between pos and end. For varints start is the value instead.
+    """
+    while pos < end:
+        tag, pos = _readVarint(data, pos, end)
+        field = tag >> 3
+        wireType = tag & 7
+        if wireType == _VARINT:
+            value, pos = _readVarint(data, pos, end)
+            yield field, wireType, value, pos
+        elif wireType == _LENGTH_DELIMITED:
+            length, pos = _readVarint(data, pos, end)
+            if pos + length > end:
+                raise CaffemodelFormatError("Truncated field " + str(field))
+            yield field, wireType, pos, pos + length
+            pos += length
+        elif wireType == _FIXED32:
+            if pos + 4 > end:
+                raise CaffemodelFormatError("Truncated field " + str(field))
+            yield field, wireType, pos, pos + 4
+            pos += 4
+        elif wireType == _FIXED64:
+            if pos + 8 > end:
+                raise CaffemodelFormatError("Truncated field " + str(field))
+            yield field, wireType, pos, pos + 8
+            pos += 8
+        else:
+            raise CaffemodelFormatError("Unsupported wire type " + str(wireType))
+
+
+def _decodeBlob(data, start, end):
+    """ Decode the BlobProto between start and end into a float32 array.
+    """
+    shape = None
+    legacyShape = [1, 1, 1, 1]
+    legacy = False
+    chunks = []
+    for field, wireType, fieldStart, fieldEnd in _fields(data, start, end):
+        if field == _BLOB_SHAPE and wireType == _LENGTH_DELIMITED:
+            shape = _decodeShape(data, fieldStart, fieldEnd)
+        elif field in (_BLOB_NUM, _BLOB_CHANNELS, _BLOB_HEIGHT, _BLOB_WIDTH) and wireType == _VARINT:
+            legacyShape[field - _BLOB_NUM] = fieldStart
+            legacy = True
+        elif field == _BLOB_DATA:
+            # data is packed, single values are accepted as well
+            chunks.append(np.frombuffer(data[fieldStart:fieldEnd], dtype='<f4'))
+        elif field == _BLOB_DOUBLE_DATA:
+            chunks.append(np.frombuffer(data[fieldStart:fieldEnd], dtype='<f8').astype(np.float32))
+    if chunks:
+        values = np.concatenate(chunks).astype(np.float32, copy=False)
+    else:
+        values = np.empty(0, dtype=np.float32)
+    if shape is None:
+        shape = legacyShape if legacy else [len(values)]
+    if int(np.prod(shape)) != len(values):
+        raise CaffemodelFormatError("Blob data does not match its shape " + str(shape))
+    return values.reshape(shape)
+
+
+def _decodeShape(data, start, end):
+    dims = []
+    for field, wireType, fieldStart, fieldEnd in _fields(data, start, end):
+        if field != _SHAPE_DIM:
+            continue
+        if wireType == _VARINT:
+            dims.append(fieldStart)
+        elif wireType == _LENGTH_DELIMITED:
+            pos = fieldStart
+            while pos < fieldEnd:
+                dim, pos = _readVarint(data, pos, fieldEnd)
+                dims.append(dim)
+    return dims
@@ -1,12 +1,24 @@
+import json
+import logging
+import os
+from os import path
 from subprocess import Popen, PIPE, STDOUT
 from sys import stdout
-from os import path
-import logging
-from backend.networking.protocol import Protocol
+from threading import Lock, Thread
+
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
 
-def checkHardware(binary, silent=False, transaction=None):
+# number of device queries which run at the same time
+PARALLEL_QUERIES = 8
+
+# serializes the updates of the hardware cache by concurrent scans
+_cacheLock = Lock()
+
+
+def checkHardware(binary, silent=False, progress=None):
     """
-    probe caffe continuously for incrementing until missing id
+    probe caffe for all devices, up to PARALLEL_QUERIES ids are queried at once
+    progress is called with name and id of every device found, the id of the CPU is -1
     structure:
     [
         { "id": 0,
@@ -20,7 +32,6 @@ def checkHardware(binary, silent=False, transaction=None):
         ...
     ]
     """
-    gid = 0
     hw = []
     if not silent:
         stdout.write("Checking Hardware...\n")
@@ -31,35 +42,123 @@ def checkHardware(binary, silent=False, transaction=None):
     if not silent:
         stdout.write("CPU found: " + name + "\n")
         logging.info("CPU found: %s", name)
-    if transaction:
-        msg = {"key": Protocol.SCANHARDWARE, "finished": False, "name": name}
-        transaction.send(msg)
-    while True:
-        log = _getId(gid, binary)
-        if not _isValid(log) or _isCpuOnly(log):
-            if not silent and gid is 0:
-                stdout.write("No GPU found, CPU mode\n")
-                logging.info("No GPU found, CPU mode")
-            break
-        name = _getName(log)
-        if not silent:
-            stdout.write("GPU " + str(gid) + " found: " + name + "\n")
-        if transaction:
-            msg = {"key": Protocol.SCANHARDWARE, "finished": False, "name": name, "id": gid}
-            transaction.send(msg)
-        hw.append({"id": gid, "name": name, "log": _parseLog(log)})
-        gid += 1
+    if progress:
+        progress(name, -1)
+    gid = 0
+    searching = True
+    while searching:
+        gids = range(gid, gid + PARALLEL_QUERIES)
+        for gid, log in zip(gids, _queryIds(gids, binary)):
+            if not _isValid(log) or _isCpuOnly(log):
+                searching = False
+                break
+            name = _getName(log)
+            if not silent:
+                stdout.write("GPU " + str(gid) + " found: " + name + "\n")
+            if progress:
+                progress(name, gid)
+            hw.append({"id": gid, "name": name, "log": _parseLog(log)})
+        else:
+            gid += 1
+    if not silent and len(hw) == 1:
+        stdout.write("No GPU found, CPU mode\n")
+        logging.info("No GPU found, CPU mode")
     return hw
 
 
-def _getId(gid, binary):
-    """probe caffe for gpu id"""
-    proc = Popen([binary, "device_query", "-gpu", str(gid)], stdout=PIPE, stderr=STDOUT)
-    it = iter(proc.stdout.readline, '')
-    log = []
-    for i in it:
-        log.append(i[:-1])
-    return log
+def loadCachedHardware(filename, binary):
+    """ Return the cached devices of the caffe binary or None if they are
+    missing or the binary changed since the scan.
+    """
+    try:
+        with open(filename, "r") as f:
+            entry = json.load(f).get(binary)
+        if entry is not None and entry["mtime"] == path.getmtime(binary):
+            return entry["hardware"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def saveCachedHardware(filename, binary, hardware):
+    """ Cache the devices found with the caffe binary.
+
+    The cache is written to a temporary file which replaces the old one, so
+    a crash does not leave a truncated cache.
+    """
+    tmp = filename + ".tmp"
+    with _cacheLock:
+        try:
+            cache = {}
+            if path.isfile(filename):
+                try:
+                    with open(filename, "r") as f:
+                        cache = json.load(f)
+                except ValueError:
+                    # an unreadable cache is replaced
+                    cache = {}
+            cache[binary] = {"mtime": path.getmtime(binary), "hardware": hardware}
+            with open(tmp, "w") as f:
+                json.dump(cache, f)
+            os.rename(tmp, filename)
+        except (IOError, OSError) as e:
+            logging.warning("Could not cache hardware in %s: %s", filename, str(e))
+
+
+class HardwareScan(QObject):
+    """ Run checkHardware in a worker thread.
+
+    The callbacks are called in the thread which created the scan: found with
+    name and id of every device, finished with the list of devices and failed
+    with an error message.
+    """
+
+    _found = pyqtSignal(str, int)
+    _finished = pyqtSignal(list)
+    _failed = pyqtSignal(str)
+
+    def __init__(self, binary, silent, found, finished, failed):
+        super(HardwareScan, self).__init__()
+        self.binary = binary
+        self.silent = silent
+        self.found = found
+        self.finished = finished
+        self.failed = failed
+        # the signals are emitted in the worker thread and queued to the slots of this object
+        self._found.connect(self._onFound, Qt.AutoConnection)
+        self._finished.connect(self._onFinished, Qt.AutoConnection)
+        self._failed.connect(self._onFailed, Qt.AutoConnection)
+
+    def start(self):
+        thread = Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    # private methods
+
+    def _run(self):
+        try:
+            hw = checkHardware(self.binary, self.silent, self._found.emit)
+        except Exception as e:
+            self._failed.emit(str(e))
+            return
+        self._finished.emit(hw)
+
+    def _onFound(self, name, gid):
+        self.found(name, gid)
+
+    def _onFinished(self, hw):
+        self.finished(hw)
+
+    def _onFailed(self, error):
+        self.failed(error)
+
+
+def _queryIds(gids, binary):
+    """query caffe for several gpu ids at once"""
+    procs = [Popen([binary, "device_query", "-gpu", str(gid)], stdout=PIPE, stderr=STDOUT) for gid in gids]
+    return [proc.communicate()[0].splitlines() for proc in procs]
+
 
 def _getCPU():
     proc = Popen(["cat", "/proc/cpuinfo"], stdout=PIPE)
@@ -0,0 +1,205 @@
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+import lmdb  # pip install lmdb
+
+'''
+Consistency checks for databases of caffe Datum records.
+
+Only the channels, height and width fields of a record are decoded. The
+protobuf wire format is read directly, so the pixel data is skipped without
+being parsed or copied.
+'''
+
+# number of key ranges per process, more ranges balance the load better
+RANGES_PER_PROCESS = 8
+
+# number of records between two progress reports of verifyRecords
+PROGRESS_INTERVAL = 10000
+
+# protobuf wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+# field numbers of channels, height, width and label in caffe.proto Datum
+_HEADER_FIELDS = {1: 0, 2: 1, 3: 2, 5: 3}
+
+
+class DatumFormatError(Exception):
+    pass
+
+
+def readDatumShape(raw):
+    '''return (channels, height, width) of a serialized Datum.
+
+    raw may be a string or a buffer. Fields which are not set are 0.'''
+    return readDatumHeader(raw)[:3]
+
+
+def readDatumHeader(raw):
+    '''return (channels, height, width, label) of a serialized Datum.
+
+    raw may be a string or a buffer. Fields which are not set are 0.'''
+    header = [0, 0, 0, 0]
+    pos = 0
+    size = len(raw)
+    while pos < size:
+        tag, pos = _readVarint(raw, pos)
+        field = tag >> 3
+        wireType = tag & 7
+        if wireType == _VARINT:
+            value, pos = _readVarint(raw, pos)
+            if field in _HEADER_FIELDS:
+                # the fields are int32, negative values are sign extended to 64 bit
+                if value >= 1 << 63:
+                    value -= 1 << 64
+                header[_HEADER_FIELDS[field]] = value
+        elif wireType == _LENGTH_DELIMITED:
+            length, pos = _readVarint(raw, pos)
+            pos += length
+        elif wireType == _FIXED32:
+            pos += 4
+        elif wireType == _FIXED64:
+            pos += 8
+        else:
+            raise DatumFormatError('Unsupported wire type ' + str(wireType))
+    if pos > size:
+        raise DatumFormatError('Truncated record')
+    return tuple(header)
+
+
+def splitKeyRange(keys, total, count):
+    '''split the sorted keys into count ranges with the same number of records.
+
+    keys iterates over the total keys of the database. Return at most
+    count + 1 boundaries taken from the keys, the first boundary is None and
+    the last is None to include all keys.'''
+    positions = sorted(set(total * i // count for i in xrange(1, count)) - set([0]))
+    boundaries = [None]
+    if positions:
+        for position, key in enumerate(keys):
+            if position == positions[len(boundaries) - 1]:
+                # keys may be buffers which are only valid until the cursor moves
+                boundaries.append(str(key))
+                if len(boundaries) > len(positions):
+                    break
+    boundaries.append(None)
+    return boundaries
+
+
+def verifyLmdb(env, path, processes=None, progress=None, cancelled=None):
+    '''check if all records of a lmdb have the same channels, height and width.
+
+    env is the open environment of the database at path. processes may be a
+    multiprocessing pool, the key space is split into ranges which are
+    checked by its workers in this case, each opening the database
+    read-only. The pool is not created here, because forking a process with
+    Qt objects and threads can deadlock the workers, see
+    SessionPool.startProcesses. Without a pool the records are checked in
+    this process. progress is called with the number of checked records and
+    the total number of records, cancelled is polled and stops the check if
+    it returns True. Return True or False, or None if the check was
+    cancelled.'''
+    total = env.stat()['entries']
+    if total < 2:
+        return True
+    # buffers avoid copying the values out of the memory map
+    with env.begin(buffers=True) as txn:
+        cursor = txn.cursor()
+        if processes is None:
+            return verifyRecords(cursor, progress, cancelled, total)
+        cursor.first()
+        shape = readDatumShape(cursor.value())
+        # only the keys are walked, the values in the overflow pages are not
+        # touched. The ranges get the same number of records, however the
+        # keys are distributed.
+        workers = multiprocessing.cpu_count()
+        boundaries = splitKeyRange(cursor.iternext(keys=True, values=False), total,
+                                   workers * RANGES_PER_PROCESS)
+    tasks = iter([(path, boundaries[i], boundaries[i + 1], shape) for i in xrange(len(boundaries) - 1)])
+    # the pool is shared and can not be terminated, so only a few ranges are
+    # handed to it at a time and the rest is dropped if the check stops early
+    results = deque(processes.apply_async(_verifyLmdbRange, (task,)) for task in islice(tasks, workers))
+    checked = 0
+    while results:
+        count, consistent = results.popleft().get()
+        checked += count
+        if not consistent:
+            return False
+        if progress:
+            progress(checked, total)
+        if cancelled and cancelled():
+            return None
+        for task in islice(tasks, 1):
+            results.append(processes.apply_async(_verifyLmdbRange, (task,)))
+    return True
+
+
+def verifyRecords(records, progress=None, cancelled=None, total=None):
+    '''check if all serialized Datums of an iterable of (key, value) have
+    the same channels, height and width.
+
+    progress is called with the number of checked records and total every
+    PROGRESS_INTERVAL records. Return True or False, or None if cancelled.'''
+    shape = None
+    checked = 0
+    for key, value in records:
+        current = readDatumShape(value)
+        if shape is None:
+            shape = current
+        elif current != shape:
+            return False
+        checked += 1
+        if checked % PROGRESS_INTERVAL == 0:
+            if progress:
+                progress(checked, total)
+            if cancelled and cancelled():
+                return None
+    if progress:
+        progress(checked, total)
+    return True
+
+
+def _verifyLmdbRange(task):
+    '''check the records with start <= key < end, return the number of checked
+    records and whether they all have the given shape.'''
+    path, start, end, shape = task
+    env = lmdb.open(path, readonly=True, lock=False, max_dbs=2)
+    count = 0
+    try:
+        # buffers avoid copying the values out of the memory map
+        with env.begin(buffers=True) as txn:
+            cursor = txn.cursor()
+            if start is None:
+                positioned = cursor.first()
+            else:
+                positioned = cursor.set_range(start)
+            if not positioned:
+                return count, True
+            for key, value in cursor:
+                if end is not None and str(key) >= end:
+                    break
+                count += 1
+                if readDatumShape(value) != shape:
+                    return count, False
+        return count, True
+    finally:
+        env.close()
+
+
+def _readVarint(raw, pos):
+    result = 0
+    shift = 0
+    size = len(raw)
+    while True:
+        if pos >= size:
+            raise DatumFormatError('Truncated varint')
+        byte = ord(raw[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
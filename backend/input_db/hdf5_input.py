@@ -1,14 +1,98 @@
 import os.path
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
 
 import h5py as h5
-import numpy as np
 
 from backend.barista.utils.logger import Log
 
 
+# maximum number of HDF5 files that are open at the same time
+MAX_OPEN_FILES = 16
+
+
+class Hdf5FileCache:
+    '''LRU of HDF5 files opened read-only, the least recently used file is closed when too many are open.
+    The open inputs of a path are counted by acquire and release, its file is only closed for good when the last
+    one is released. A file is not closed while it is used within use, even if it drops out of the LRU.'''
+
+    def __init__(self, size=MAX_OPEN_FILES):
+        self._files = OrderedDict()
+        self._size = size
+        self._lock = Lock()
+        # path -> number of open inputs
+        self._refs = {}
+        # path -> number of running accesses
+        self._used = {}
+
+    def acquire(self, path):
+        '''count an input which is open on the file at path.'''
+        with self._lock:
+            self._refs[path] = self._refs.get(path, 0) + 1
+
+    def release(self, path):
+        '''uncount an input of the file at path, close the file if no other input is open on it.'''
+        with self._lock:
+            refs = self._refs.get(path, 0) - 1
+            if refs > 0:
+                self._refs[path] = refs
+                return
+            self._refs.pop(path, None)
+            if not self._used.get(path):
+                f = self._files.pop(path, None)
+                if f is not None:
+                    f.close()
+
+    def get(self, path):
+        '''return the open file at path, open it if necessary.'''
+        with self._lock:
+            f = self._files.pop(path, None)
+            if f is None:
+                f = h5.File(path, 'r')
+            self._files[path] = f
+            self._evict()
+            return f
+
+    @contextmanager
+    def use(self, path):
+        '''open the file at path and keep it open while the block runs.'''
+        with self._lock:
+            self._used[path] = self._used.get(path, 0) + 1
+        try:
+            yield self.get(path)
+        finally:
+            with self._lock:
+                used = self._used.pop(path) - 1
+                if used > 0:
+                    self._used[path] = used
+                elif path not in self._refs:
+                    f = self._files.pop(path, None)
+                    if f is not None:
+                        f.close()
+                else:
+                    self._evict()
+
+    def _evict(self):
+        '''close the least recently used files which are not in use until at most size files are open.'''
+        for path in list(self._files.keys()):
+            if len(self._files) <= self._size:
+                break
+            if not self._used.get(path):
+                self._files.pop(path).close()
+
+
+_fileCache = Hdf5FileCache()
+
+
 class Hdf5Input:
+    '''HDF5 file whose counts and dimensions are read from the dataset metadata.
+    The file is opened on the first access through a shared LRU of open files, so many inputs can be open without
+    holding a file handle each.'''
+
     def __init__(self, pathOfHdf5Txt=False):
-        self._db = None
+        self._isOpen = False
+        self._metadata = None
         self._path = None
         self._pathOfHdf5Txt = pathOfHdf5Txt  # HDF5TXT files can contain commentary lines that are no paths
         self._logid = Log.getCallerId('HDF5 Input')
@@ -25,64 +109,69 @@ class Hdf5Input:
         return self._path
 
     def open(self):
-        '''open the database from the set path.'''
-        if self._db:
+        '''open the database from the set path.
+        A file listed in a HDF5TXT is only checked for existence, it is validated on the first access.'''
+        if self._isOpen:
             self.close()
         if self._path:
             if os.path.exists(self._path):
-                try:
-                    self._db = h5.File(self._path, 'r')
-                except:
+                if self._pathOfHdf5Txt or h5.is_hdf5(self._path):
+                    _fileCache.acquire(self._path)
+                    self._isOpen = True
+                else:
                     Log.error("File not valid HDF5: " + self._path, self._logid)
-                    self._db = None
             elif not self._pathOfHdf5Txt:
                 Log.error("File does not exist: " + self._path, self._logid)
 
     def close(self):
-        if self._db:
-            self._db.close()
-        self._db = None
+        if self._isOpen:
+            _fileCache.release(self._path)
+        self._isOpen = False
+        self._metadata = None
+
+    def getFile(self):
+        '''get the open h5py file. It is closed when too many other files are opened, so do not keep it.'''
+        if self._isOpen:
+            return _fileCache.get(self._path)
 
     def getDataCount(self):
-        if self._db:
-            d = {}
-            for i in range(0, len(self._db.keys())):
-                d[self._db.keys()[i]] = len(self._db.values()[i])
-            return d
+        metadata = self._getMetadata()
+        if metadata is not None:
+            return {key: count for key, (count, shape) in metadata.items()}
 
     def getDimensions(self):
-        if self._db:
-            d = {}
-            for i in range(0, len(self._db.keys())):
-                ar = np.array(self._db.values()[i][0])
-                d[self._db.keys()[i]] = ar.shape
-            return d
+        metadata = self._getMetadata()
+        if metadata is not None:
+            return {key: shape[1:] for key, (count, shape) in metadata.items() if shape}
 
     def verifyConsistency(self):
-        if self._db:
-            for i in range(0, len(self._db.keys())):
-                ar = np.array(self._db.values()[i][0])
-                for j in range(0, len(self._db.values()[i])):
-                    ar2 = np.array(self._db.values()[i][j])
-                    if not self._dimCompare(ar.shape, ar2.shape):
-                        return False
+        '''all entries of a dataset have the shape of the dataset without the first axis, so the entries are
+        consistent if every member of the file is a dataset with at least one axis.'''
+        metadata = self._getMetadata()
+        if metadata is not None:
+            for count, shape in metadata.values():
+                if not shape:
+                    return False
             return True
 
     def isOpen(self):
-        if self._db:
+        if self._isOpen:
             return True
         return False
 
-    def _dimCompare(self, d1, d2):
-        if not d1 and not d2:  # both empty
-            return True
-        if d2 and not d1:  # d1 empty
-            return False
-        if d1 and not d2:  # d2 empty
-            return False
-        if len(d1) != len(d2):  # different dim count
-            return False
-        for i in range(0, len(d1)):  # dims not matching
-            if d1[i] != d2[i]:
-                return False
-        return True
+    def _getMetadata(self):
+        '''get the number of entries and the shape of every member of the file, shape is None for groups.'''
+        if self._isOpen and self._metadata is None:
+            try:
+                metadata = {}
+                with _fileCache.use(self._path) as f:
+                    for key, value in f.items():
+                        if isinstance(value, h5.Dataset):
+                            metadata[key] = (value.shape[0] if value.shape else 0, value.shape)
+                        else:
+                            metadata[key] = (len(value), None)
+                self._metadata = metadata
+            except:
+                Log.error("File not valid HDF5: " + self._path, self._logid)
+                self.close()
+        return self._metadata
@@ -18,6 +18,7 @@ class Hdf5TxtInput:
         self._path = os.path.normpath(path)
 
     def open(self):
+        '''open the listed HDF5 files lazily, they are only read when their counts or dimensions are needed.'''
         if self._db:
             self.close()
         if self._path is not None:
@@ -25,7 +26,7 @@ class Hdf5TxtInput:
                 lines = [line.rstrip('\n') for line in open(self._path)]
                 hdf5Count = 0
                 for line in lines:
-                    if line is not "":
+                    if line != "":
                         if line[:1] == '.':
                             line = self._makepath(line)
                         i = len(self._db)
@@ -49,23 +50,33 @@ class Hdf5TxtInput:
         if self._db:
             sum = {}
             for db in self._db:
-                sum = self._sumDataCount(sum, db.getDataCount())
+                count = db.getDataCount()
+                if count is not None:
+                    sum = self._sumDataCount(sum, count)
             return sum
 
     def getDimensions(self):
         if self._db:
             d = {}
             for db in self._db:
-                d = self._combineDim(d, db.getDimensions())
+                dim = db.getDimensions()
+                if dim is not None:
+                    d = self._combineDim(d, dim)
             return d
 
     def verifyConsistency(self):
+        '''check the dimensions of all files, only the metadata of the datasets is read.'''
         if self._db:
-            d = self._db[0].getDimensions()
+            d = None
             for db in self._db:
+                dim = db.getDimensions()
+                if dim is None:
+                    continue
                 if not db.verifyConsistency():
                     return False
-                if not self._compareDim(d, db.getDimensions()):
+                if d is None:
+                    d = dim
+                elif not self._compareDim(d, dim):
                     return False
             return True
 
@@ -1,13 +1,18 @@
 import leveldb  # pip install leveldb
 import os.path
+import threading
 
 from backend.barista.utils.logger import Log
+from backend.input_db.datum_check import verifyRecords, DatumFormatError
+from backend.input_db.leveldb_stats import LeveldbStats
 
 
 class LeveldbInput:
     def __init__(self):
         self._db = None
         self._path = None
+        self._openPath = None
+        self._stats = None
         self.logid = Log.getCallerId("LEVELDB Input")
 
     def __del__(self):
@@ -23,57 +28,65 @@ class LeveldbInput:
             self.close()
         if self._path:
             if os.path.exists(self._path + "CURRENT") or os.path.exists(self._path + "/CURRENT"):
-                self._db = leveldb.LevelDB(self._path)
+                self._openPath = self._path
+                self._db = _acquireDatabase(self._openPath)
+                self._stats = LeveldbStats(self._path)
+                self._stats.load()
             else:
                 Log.error("Dir is not valid LEVELDB: " + self._path, self.logid)
 
     def close(self):
         '''close and clean up the database.'''
+        if self._db:
+            _releaseDatabase(self._openPath)
         self._db = None
+        self._openPath = None
+        self._stats = None
 
     def getDataCount(self):
         '''get the number of entries in the database'''
-        if self._db:
-            iter = self._getIter()
-            if iter:
-                number = 0
-                for elem in iter:
-                    number = number + 1
-                return {"data": number}
+        stats = self.getStatistics()
+        if stats:
+            return {"data": stats["count"]}
 
     def getDimensions(self):
         '''get the dimensions of the first entry'''
-        datum = self._getFirstDatum()
-        if datum:
-            dim = (datum.channels, datum.height, datum.width)
-            return {"label": (), "data": dim}  # TODO dim of label
-
-    def verifyConsistency(self):
+        stats = self.getStatistics()
+        if stats and stats["dimensions"]:
+            return {"label": (), "data": tuple(stats["dimensions"])}  # TODO dim of label
+
+    def getStatistics(self):
+        '''get count, dimensions, label distribution and byte size of the database.
+        The statistics are read from the sidecar file of the database. If the database changed since they were
+        computed, the outdated statistics are returned and recomputed in the background. Without statistics they are
+        computed at once.'''
+        if self._db:
+            if self._stats.values is not None:
+                if not self._stats.isCurrent():
+                    path = self._openPath
+                    _acquireDatabase(path)
+                    if not self._stats.refresh(self._db, lambda: _releaseDatabase(path)):
+                        _releaseDatabase(path)
+                return self._stats.values
+            try:
+                self._stats.compute(self._db)
+            except DatumFormatError:
+                Log.error("LEVELDB does not contain valid data: " + self._path, self.logid)
+                return None
+            self._stats.save()
+            return self._stats.values
+
+    def verifyConsistency(self, progress=None, cancelled=None):
         '''check if all entries have the same channel number and size.
-        This may take a lot of time since every entry has to be checked.'''
-        from backend.caffe.path_loader import PathLoader
-        caffe = PathLoader().importCaffe()
-        if self.getDataCount() < 2:
-            return True
-        first = self._getFirstDatum()
-        if first:
-            channels = first.channels
-            width = first.width
-            height = first.height
-
-            iter = self._getIter()
-            if iter:
-                for key, value in iter:
-                    raw_datum = value
-                    datum = caffe.proto.caffe_pb2.Datum()
-
-                    datum.ParseFromString(raw_datum)
-
-                    if channels is not datum.channels \
-                            or width is not datum.width \
-                            or height is not datum.height:
-                        return False
-                return True
+        Only the header fields of every entry are decoded. A LevelDB can only be opened by one process, so the
+        entries are streamed in this process. See datum_check.verifyRecords for progress and cancelled.'''
+        iter = self._getIter()
+        if iter:
+            try:
+                return verifyRecords(iter, progress, cancelled)
+            except DatumFormatError:
+                Log.error("LEVELDB does not contain valid data: " + self._path, self.logid)
+                return False
 
     def isOpen(self):
         '''check if db is open.'''
@@ -85,18 +98,36 @@ class LeveldbInput:
         if self._db:
             return self._db.RangeIter()
 
-    def _getFirstDatum(self):
-        from backend.caffe.path_loader import PathLoader
-        caffe = PathLoader().importCaffe()
-        iter = self._getIter()
-        if iter:
-            for key, value in iter:
-                raw_datum = value
-                datum = caffe.proto.caffe_pb2.Datum()
-
-                try:
-                    datum.ParseFromString(raw_datum)
-                except:
-                    Log.error("LEVELDB does not contain valid data: " + self._path, self.logid)
-                    return None
-                return datum
+
+# a LevelDB can only be opened once per process, open databases are shared by path
+_databases = {}
+_databasesLock = threading.Lock()
+
+
+def _acquireDatabase(path):
+    '''open the database at path or return the already open one.'''
+    path = os.path.realpath(path)
+    _databasesLock.acquire()
+    try:
+        entry = _databases.get(path)
+        if entry is None:
+            entry = [leveldb.LevelDB(path), 0]
+            _databases[path] = entry
+        entry[1] += 1
+        return entry[0]
+    finally:
+        _databasesLock.release()
+
+
+def _releaseDatabase(path):
+    '''close the database at path when it is no longer used.'''
+    path = os.path.realpath(path)
+    _databasesLock.acquire()
+    try:
+        entry = _databases.get(path)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del _databases[path]
+    finally:
+        _databasesLock.release()
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+import threading
+
+from backend.barista.utils.logger import Log
+from backend.input_db.datum_check import readDatumHeader, DatumFormatError
+
+'''
+Statistics of a LevelDB of caffe Datum records, stored in a sidecar file next to the database.
+
+The statistics are computed once per version of the database. A version is identified by the names and sizes of the
+table and log files, so the statistics are valid until records are written or the tables are compacted.
+'''
+
+# files whose names and sizes identify the content of a LevelDB
+_DATA_FILE = re.compile(r'^\d+\.(ldb|sst|log)$')
+
+
+class LeveldbStats:
+    '''count, dimensions, label distribution and byte size of a LevelDB.'''
+
+    SUFFIX = ".stats.json"
+    VERSION = 1
+
+    def __init__(self, path):
+        self._path = os.path.normpath(path)
+        self._filename = self._path + LeveldbStats.SUFFIX
+        self.values = None
+        self.state = None
+
+    def load(self):
+        '''load the sidecar file. Return True if it belongs to the current version of the database.'''
+        self.values = None
+        self.state = None
+        if not os.path.isfile(self._filename):
+            return False
+        try:
+            with open(self._filename, "r") as f:
+                stats = json.load(f)
+        except (IOError, ValueError) as e:
+            Log.log("Could not read statistics " + self._filename + ": " + str(e))
+            return False
+        if stats.get("version") != LeveldbStats.VERSION:
+            return False
+        self.values = stats["stats"]
+        self.state = stats["state"]
+        return self.isCurrent()
+
+    def isCurrent(self):
+        '''check if the statistics belong to the current version of the database.'''
+        return self.values is not None and self.state == self.currentState()
+
+    def currentState(self):
+        '''return the state of the database files the statistics are keyed by.
+
+        Opening a LevelDB writes a new manifest, names it in CURRENT and starts a new log without changing the
+        records, so the state only consists of the names and sizes of the table files and the non-empty logs.'''
+        if not os.path.isfile(os.path.join(self._path, "CURRENT")):
+            return None
+        try:
+            files = []
+            for name in sorted(os.listdir(self._path)):
+                if _DATA_FILE.match(name):
+                    size = os.path.getsize(os.path.join(self._path, name))
+                    if size > 0 or not name.endswith(".log"):
+                        files.append([name, size])
+        except OSError:
+            return None
+        return files
+
+    def compute(self, db):
+        '''iterate all records of the open database db and compute the statistics.'''
+        state = self.currentState()
+        count = 0
+        size = 0
+        dimensions = None
+        labels = {}
+        for key, value in db.RangeIter():
+            channels, height, width, label = readDatumHeader(value)
+            if dimensions is None:
+                dimensions = [channels, height, width]
+            labels[str(label)] = labels.get(str(label), 0) + 1
+            size += len(value)
+            count += 1
+        self.values = {"count": count, "dimensions": dimensions, "labels": labels, "bytes": size}
+        self.state = state
+        return self.values
+
+    def save(self):
+        '''write the sidecar file.'''
+        tmp = self._filename + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": LeveldbStats.VERSION, "state": self.state, "stats": self.values}, f)
+            os.rename(tmp, self._filename)
+        except (IOError, OSError) as e:
+            Log.log("Could not write statistics " + self._filename + ": " + str(e))
+
+    def refresh(self, db, finished=None):
+        '''compute and save the statistics of the open database db in a background thread.
+
+        Only one refresh per database runs at a time. finished is called in the thread when it is done. Return False
+        if a refresh of the database is already running.'''
+        _refreshLock.acquire()
+        try:
+            if self._path in _refreshing:
+                return False
+            _refreshing.add(self._path)
+        finally:
+            _refreshLock.release()
+        thread = threading.Thread(target=self._refresh, args=(db, finished))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    # private methods
+
+    def _refresh(self, db, finished):
+        try:
+            self.compute(db)
+            self.save()
+        except DatumFormatError:
+            Log.error("LEVELDB does not contain valid data: " + self._path)
+        finally:
+            _refreshLock.acquire()
+            _refreshing.discard(self._path)
+            _refreshLock.release()
+            if finished:
+                finished()
+
+
+# paths of the databases whose statistics are refreshed in the background
+_refreshing = set()
+_refreshLock = threading.Lock()
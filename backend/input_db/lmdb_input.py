@@ -3,6 +3,7 @@ import os.path
 import lmdb  # pip install lmdb
 
 from backend.barista.utils.logger import Log
+from backend.input_db.datum_check import verifyLmdb, DatumFormatError
 
 
 class LmdbInput:
@@ -51,25 +52,16 @@ class LmdbInput:
                 dim = (datum.channels, datum.height, datum.width)
                 return {"label": (), "data": dim}  # TODO dim of label
 
-    def verifyConsistency(self):
+    def verifyConsistency(self, processes=None, progress=None, cancelled=None):
         '''check if all entries have the same channel number and size.
-        This may take a lot of time since every entrie has to be checked.'''
+        If processes is a multiprocessing pool, the key space is split into ranges which are checked by its workers,
+        only the header fields of every entry are decoded. See datum_check.verifyLmdb for progress and cancelled.'''
         if self._env:
-            if self.getDataCount() < 2:
-                return True
-            first = self._getFirstDatum()
-            if first:
-                channels = first.channels
-                width = first.width
-                height = first.height
-
-                while self._cursor.next():
-                    if channels is not self._getCurrentDatum().channels \
-                            or width is not self._getCurrentDatum().width \
-                            or height is not self._getCurrentDatum().height:
-                        return False
-
-                return True
+            try:
+                return verifyLmdb(self._env, self._path, processes, progress, cancelled)
+            except DatumFormatError:
+                Log.error("LMDB does not contain valid data: " + self._path, self.logid)
+                return False
 
     def isOpen(self):
         '''check if db is open:'''
@@ -4,9 +4,10 @@ import socket
 import sys
 import logging
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtNetwork import QTcpServer, QHostAddress
 
-from backend.caffe.check_hardware import checkHardware
+from backend.caffe.check_hardware import HardwareScan, loadCachedHardware, saveCachedHardware
 from backend.barista.session.session_utils import State
 from backend.networking.protocol import Protocol
 from backend.networking.server_session_manager import ServerSessionManager
@@ -18,6 +19,8 @@ class BaristaServer():
     MIN_PORT = 0
     MAX_PORT = 65535
     DEFAULT_PORT = 4200
+    # milliseconds between the checks for status changes to push to subscribers
+    STATUS_CHECK_INTERVAL = 250
 
     def __init__(self, application, ip, port, sessionPath):
         self.application = application
@@ -29,14 +32,27 @@ class BaristaServer():
 
         self.sessionPath = sessionPath
         self.configpath = os.path.join(self.sessionPath, "barista.conf") ####
+        self.hardwarepath = os.path.join(self.sessionPath, "hardware.cache")
         self.hardware = []
+        # the running scan and the transactions waiting for its result
+        self.hardwareScan = None
+        self.scanTransactions = []
         self.trainOnHW = 0
         self.transactionList = []
+        # the status is cached per project and rebuilt when the version changes
+        self.statusVersion = 0
+        self.pushedStatusVersion = 0
+        self.statusCache = {}
+        self.statusSubscribers = []
         self._loadConfig()
         self.checkHardware()
         state = self._checkConfig()
         self.start()
         self.sessionManager = ServerSessionManager(self, self.sessionPath)
+        self.statusTimer = QTimer()
+        self.statusTimer.setInterval(BaristaServer.STATUS_CHECK_INTERVAL)
+        self.statusTimer.timeout.connect(self._pushStatus)
+        self.statusTimer.start()
 
     def start(self):
         self.server = QTcpServer()
@@ -54,38 +70,78 @@ class BaristaServer():
             logging.error("Something went wrong. Server is not listening.")
             exit(1)
 
+    def invalidateStatus(self):
+        """ Mark the cached status as outdated.
+
+        The changes are pushed to the subscribers on the next status check. This
+        may be called from any thread.
+        """
+        self.statusVersion += 1
+
+    def subscribeStatus(self, transaction):
+        if transaction not in self.statusSubscribers:
+            self.statusSubscribers.append(transaction)
+
     def getBaristaStatus(self, pid=""):
+        """ Return the status of the server, including the sessions of project pid.
+
+        The returned dict is shared and must not be modified.
+        """
+        version = self.statusVersion
+        cached = self.statusCache.get(pid)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        statusdict = self._buildBaristaStatus(pid)
+        self.statusCache[pid] = (version, statusdict)
+        return statusdict
+
+    def _buildBaristaStatus(self, pid):
         hardware = [k["name"] for k in self.hardware]
 
         statusdict = {"trainOnHW": self.trainOnHW, "hardware": hardware}
         statusdict["connections"] = len(self.transactionList)
         statusdict["config"] = self._checkConfig(False)
-        statusdict["training"] = len(self.sessionManager.findSessionIDsWithState(State.RUNNING)) is 0
-        statusdict["sessioncount"] = len(self.sessionManager.sessions)
+        statusdict["training"] = self.sessionManager.countSessions(state=State.RUNNING) is 0
+        statusdict["sessioncount"] = self.sessionManager.countSessions()
         statusdict["sessionpath"] = self.sessionPath
+        statusdict["queued"] = self.sessionManager.scheduler.queueLength()
         if pid is not "":
+            count = self.sessionManager.countSessions
             pidses = {}
-            sessions = set(self.sessionManager.findSessionIDsByProjectId(pid))
             pidses["pid"] = pid
-            pidses["count"] = len(sessions)
-            pidses["running"] = len(set(self.sessionManager.findSessionIDsWithState(State.RUNNING)) & sessions)
-            pidses["running"] += len(set(self.sessionManager.findSessionIDsWithState(State.PAUSED)) & sessions)
-            pidses["waiting"] = len(set(self.sessionManager.findSessionIDsWithState(State.WAITING)) & sessions)
-            pidses["finished"] = len(set(self.sessionManager.findSessionIDsWithState(State.FINISHED)) & sessions)
+            pidses["count"] = count(pid=pid)
+            pidses["running"] = count(pid=pid, state=State.RUNNING)
+            pidses["running"] += count(pid=pid, state=State.PAUSED)
+            pidses["waiting"] = count(pid=pid, state=State.WAITING)
+            pidses["finished"] = count(pid=pid, state=State.FINISHED)
 
             statusdict["projectsessions"] = pidses
 
         return statusdict
+
+    def _pushStatus(self):
+        """ Send the status changes to all subscribers if the status changed.
+        """
+        version = self.statusVersion
+        if version == self.pushedStatusVersion:
+            return
+        self.pushedStatusVersion = version
+        for transaction in list(self.statusSubscribers):
+            transaction.sendBaristaStatus(keepAlive=False)
  
     def _newConnection(self):
         transaction = ServerTransaction(self)
         self.transactionList.append(transaction)
         transaction.socketClosed.connect(lambda item=transaction: self._deleteConnection(item))
         transaction.acceptClient(self.server.nextPendingConnection())
+        self.invalidateStatus()
 
     def _deleteConnection(self, transaction):
         index = self.transactionList.index(transaction)
         del self.transactionList[index]
+        if transaction in self.statusSubscribers:
+            self.statusSubscribers.remove(transaction)
+        self.invalidateStatus()
 
     def _saveConfig(self):
         #Save train on hardware
@@ -115,17 +171,17 @@ class BaristaServer():
             if verbose:
                 sys.stderr.write("Warning: There is no Caffeversion set. Use the Versionmanager inside Barista to set the Path.\n")
                 logging.warning("There is no Caffeversion set. Use the Versionmanager inside Barista to set the Path.")
-        if self.trainOnHW >= len(self.hardware):
-            self.trainOnHW = 0
-            if verbose:
-                sys.stderr.write("Warning: Currently selected Hardware could not be matched against detected Hardware."
-                                    " Set to CPU mode!\n")
-                logging.warning("Currently selected Hardware could not be matched against detected Hardware."
-                                " Set to CPU mode!")
+        self._checkHardwareSelection(verbose)
 
         return state
 
-    def checkHardware(self, verbose=True, transaction=None):
+    def checkHardware(self, verbose=True, transaction=None, rescan=False):
+        """ Update the list of devices without blocking the server.
+
+        The devices found with the current caffe binary are taken from the
+        cache unless rescan is True. Otherwise the devices are scanned in a
+        worker thread and the transaction receives the progress and result.
+        """
         caffe_versions.loadVersions(self.sessionPath)
         if caffe_versions.versionCount() == 0:      
             if verbose:
@@ -135,28 +191,85 @@ class BaristaServer():
                 msg = {"key": Protocol.SCANHARDWARE, "status": False, "error": "Can't check hardware without Caffeversions"}
                 transaction.send(msg)
             return
-        try:
-            binary = caffe_versions.getDefaultVersion().getBinarypath()
-            self.hardware = checkHardware(binary, not verbose, transaction)
-            if verbose:
-                sys.stdout.write("Finished scanning Hardware. " + str(len(self.hardware)) + " devices found.\n")
-                logging.info("Finished scanning Hardware. %s devices found.", str(len(self.hardware)))
-            if transaction:
-                msg = {"key": Protocol.SCANHARDWARE, "status": True, "finished": True, "hardware": self.hardware,
-                       "current": self.trainOnHW}
-                transaction.send(msg)
-        except:
+        binary = caffe_versions.getDefaultVersion().getBinarypath()
+        if not rescan and self.hardwareScan is None:
+            hardware = loadCachedHardware(self.hardwarepath, binary)
+            if hardware is not None:
+                self._setHardwareList(hardware, verbose)
+                if transaction:
+                    msg = {"key": Protocol.SCANHARDWARE, "status": True, "finished": True, "hardware": self.hardware,
+                           "current": self.trainOnHW}
+                    transaction.send(msg)
+                return
+        if transaction:
+            self.scanTransactions.append(transaction)
+        if self.hardwareScan is None:
+            self.hardwareScan = HardwareScan(binary, not verbose, self._hardwareFound,
+                                             lambda hardware: self._hardwareScanned(binary, hardware, verbose),
+                                             lambda error: self._hardwareScanFailed(error, verbose))
+            self.hardwareScan.start()
+
+    def _hardwareFound(self, name, gid):
+        msg = {"key": Protocol.SCANHARDWARE, "status": True, "finished": False, "name": name}
+        if gid >= 0:
+            msg["id"] = gid
+        self._sendToScanTransactions(msg, False)
+
+    def _hardwareScanned(self, binary, hardware, verbose):
+        self.hardwareScan = None
+        saveCachedHardware(self.hardwarepath, binary, hardware)
+        self._setHardwareList(hardware, verbose)
+        if verbose:
+            sys.stdout.write("Finished scanning Hardware. " + str(len(self.hardware)) + " devices found.\n")
+            logging.info("Finished scanning Hardware. %s devices found.", str(len(self.hardware)))
+        msg = {"key": Protocol.SCANHARDWARE, "status": True, "finished": True, "hardware": self.hardware,
+               "current": self.trainOnHW}
+        self._sendToScanTransactions(msg, True)
+
+    def _hardwareScanFailed(self, error, verbose):
+        self.hardwareScan = None
+        if verbose:
+            sys.stderr.write("Error: Failed to check hardware!\n")
+            logging.error("Failed to check hardware: %s", error)
+        msg = {"key": Protocol.SCANHARDWARE, "status": False, "error": "Failed to check hardware!"}
+        self._sendToScanTransactions(msg, True)
+        self._scanFinished()
+
+    def _setHardwareList(self, hardware, verbose):
+        self.hardware = hardware
+        self._checkHardwareSelection(verbose)
+        self.invalidateStatus()
+        self._scanFinished()
+
+    def _scanFinished(self):
+        # queued trainings wait for the scan
+        if hasattr(self, "sessionManager"):
+            self.sessionManager.scheduler.wakeUp()
+
+    def _sendToScanTransactions(self, msg, last):
+        for transaction in self.scanTransactions:
+            if transaction.isConnected():
+                transaction.send(dict(msg))
+        if last:
+            self.scanTransactions = []
+
+    def _checkHardwareSelection(self, verbose):
+        # the selection is checked once the devices are known
+        if self.hardwareScan is not None:
+            return
+        if self.trainOnHW >= len(self.hardware):
+            self.trainOnHW = 0
             if verbose:
-                sys.stderr.write("Error: Failed to check hardware!\n")
-                logging.error("Failed to check hardware!")
-            if transaction:
-                msg = {"key": Protocol.SCANHARDWARE, "status": False, "error": "Failed to check hardware!"}
-                transaction.send(msg)
+                sys.stderr.write("Warning: Currently selected Hardware could not be matched against detected Hardware."
+                                    " Set to CPU mode!\n")
+                logging.warning("Currently selected Hardware could not be matched against detected Hardware."
+                                " Set to CPU mode!")
 
     def setHardware(self, hid):
         if hid >= len(self.hardware):
             return False
         self.trainOnHW = hid
         self._saveConfig()
+        self.invalidateStatus()
         return True
 
@@ -0,0 +1,120 @@
+import time
+from threading import Lock
+
+from backend.networking.client_transaction import ClientTransaction
+from backend.networking.protocol import Protocol
+
+
+class ConnectionPool(object):
+    """ Keep connected client transactions per (host, port) for reuse.
+
+    A transaction is acquired for a request and released afterwards, so
+    following requests to the same host do not pay for a new connection.
+    Idle transactions are closed after IDLE_TIMEOUT seconds, transactions
+    which lost their connection are dropped when they are acquired.
+    A transaction which was idle for more than PING_AFTER seconds is pinged
+    before it is reused, so a half-open connection costs PING_TIMEOUT instead
+    of the timeout of the request.
+    """
+
+    # seconds an unused transaction stays open
+    IDLE_TIMEOUT = 60
+    # maximum number of idle transactions per host
+    MAX_IDLE = 4
+    # seconds of idling after which a transaction is pinged on acquire
+    PING_AFTER = 5
+    # milliseconds to wait for the answer to a ping
+    PING_TIMEOUT = 1000
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = Lock()
+
+    def acquire(self, host, port):
+        """ Return a connected transaction to the host or None if the
+        connection failed.
+
+        The second value is True if the transaction was reused from the pool.
+        """
+        key = (host, port)
+        while True:
+            self.lock.acquire()
+            try:
+                self._evict()
+                transactions = self.idle.get(key, [])
+                if not transactions:
+                    break
+                transaction, lastUsed = transactions.pop()
+            finally:
+                self.lock.release()
+            # the ping waits for the answer, so it is sent without the lock
+            if self._isHealthy(transaction) and (time.time() - lastUsed < ConnectionPool.PING_AFTER or
+                                                 self._ping(transaction)):
+                return transaction, True
+            transaction.close()
+        transaction = ClientTransaction()
+        transaction.connect(host, port)
+        transaction.waitForConnection()
+        if transaction.isConnected():
+            return transaction, False
+        return None, False
+
+    def release(self, transaction, host, port):
+        """ Return a transaction to the pool.
+
+        Messages the transaction received without a request are discarded.
+        """
+        if not self._isHealthy(transaction):
+            transaction.close()
+            return
+        transaction.lock.acquire()
+        del transaction.messageOutput[:]
+        transaction.lock.release()
+        self.lock.acquire()
+        try:
+            transactions = self.idle.setdefault((host, port), [])
+            if len(transactions) < ConnectionPool.MAX_IDLE:
+                transactions.append((transaction, time.time()))
+                transaction = None
+        finally:
+            self.lock.release()
+        if transaction is not None:
+            transaction.close()
+
+    def clear(self):
+        """ Close all idle transactions.
+        """
+        self.lock.acquire()
+        try:
+            for transactions in self.idle.values():
+                for transaction, _ in transactions:
+                    transaction.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+    # private methods
+
+    def _evict(self):
+        """ Close the transactions which are idle for too long.
+        """
+        deadline = time.time() - ConnectionPool.IDLE_TIMEOUT
+        for key in list(self.idle.keys()):
+            keep = []
+            for transaction, lastUsed in self.idle[key]:
+                if lastUsed < deadline:
+                    transaction.close()
+                else:
+                    keep.append((transaction, lastUsed))
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+
+    def _isHealthy(self, transaction):
+        return transaction.isConnected() and not transaction._hasError
+
+    def _ping(self, transaction):
+        """ Return True if the host answers an echo over the transaction.
+        """
+        return transaction.request({"key": Protocol.ECHO}, ConnectionPool.PING_TIMEOUT) is not None
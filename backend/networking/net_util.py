@@ -1,26 +1,38 @@
 from backend.barista.utils.logger import *
-from backend.networking.client_transaction import ClientTransaction
+from backend.networking.connection_pool import ConnectionPool
+
+pool = ConnectionPool()
 
 
 def sendMsgToHost(host, port, msg):
-    ct = ClientTransaction()
-    ct.connect(host, port)
-    ct.waitForConnection()
-    if ct.isConnected():
-        ct.send(msg)
-        ret = ct.asyncRead()
-        ct.close()
-        if ret:
-            return ret
-        else:
-            Log.error("No answer from " + host + ":" + str(port), Log.getCallerId("Network Connection"))
-    else:
-        Log.error("Failed to connect to " + host + ":" + str(port), Log.getCallerId("Network Connection"))
+    """ Send the message to the host and return the response.
+
+    The connection is taken from the pool and returned to it afterwards. If a
+    pooled connection turns out to be dead, the message is sent again over a
+    new connection.
+    """
+    ct, reused = pool.acquire(host, port)
+    if ct is not None:
+        ret = ct.request(msg)
+        if ret is None and reused and not ct.isConnected():
+            ct.close()
+            ct, _ = pool.acquire(host, port)
+            if ct is not None:
+                ret = ct.request(msg)
+        if ct is not None:
+            pool.release(ct, host, port)
+            if ret:
+                return ret
+            else:
+                Log.error("No answer from " + host + ":" + str(port), Log.getCallerId("Network Connection"))
+            return
+    Log.error("Failed to connect to " + host + ":" + str(port), Log.getCallerId("Network Connection"))
 
 
 def buildTransaction(host, port):
-    ct = ClientTransaction()
-    ct.connect(host, port)
-    ct.waitForConnection()
-    if ct.isConnected():
-        return ct
+    """ Return a connected transaction for exclusive use by the caller.
+
+    An idle connection of the pool is handed over if available.
+    """
+    ct, _ = pool.acquire(host, port)
+    return ct
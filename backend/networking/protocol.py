@@ -66,6 +66,7 @@ class SessionProtocol:
     ADDSNAPSHOT = 34
     PARSEHANDLE = 35
     FETCHPARSERDATA = 36
+    UPDATEPARSER_BATCH = 37
 
     START = 40
     PAUSE = 41
@@ -76,6 +77,8 @@ class SessionProtocol:
     LOADDEPLOYEDNET = 51
     LOADNETPARAMETER = 52
     LOADCAFFEMODEL = 53
+    LOADFILECHUNK = 54
+    LOADLAYERBLOBS = 55
 
     RESET = 98
     DELETE = 99
@@ -9,7 +9,10 @@ import logging
 from backend.barista.session.server_session import ServerSession
 from backend.barista.session.session_pool import SessionPool
 from backend.barista.session.session_utils import Paths, State
+from backend.barista.session.training_scheduler import TrainingScheduler
 from backend.caffe import loader
+from backend.networking.session_manifest import SessionManifest
+from backend.networking.session_registry import SessionRegistry
 
 from backend.caffe.proto_info import resetCaffeProtoModulesvar
 from PyQt5.QtCore import pyqtSignal
@@ -29,7 +32,9 @@ class ServerSessionManager(QObject):
         self.parent = parent
         self.sessionPath = sessionPath
         # TODO CaffeMetaInfo (use caffe/protopath)
-        self.sessions = []
+        self.sessions = SessionRegistry()
+        self.manifest = SessionManifest(sessionPath)
+        self.scheduler = TrainingScheduler(parent)
         self.loadSessions()
 
     def connectToSession(self, transaction):
@@ -173,9 +178,9 @@ class ServerSessionManager(QObject):
         if "uid" in msg:
             session = self.findSessionBySessionUid(msg["uid"])
             if session:
-                for sess in self.sessions:
-                    if sess["uid"] == msg["uid"]:
-                        self.sessions.remove(sess)
+                self.sessions.remove(msg["uid"])
+                self.scheduler.cancel(session)
+                self.parent.invalidateStatus()
                 session.delete()
                 del session
                 msg["status"] = True
@@ -202,12 +207,13 @@ class ServerSessionManager(QObject):
             ret = []
             uids = self.findSessionIDsByProjectId(msg["pid"])
             for uid in uids:
-                session = self.findSessionBySessionUid(uid)
-                name = session.directory
-                name = os.path.basename(name)
-                if session.isConnected:
+                # sessions which are not loaded yet are listed from the index
+                sessiondict = self.sessions.get(uid)
+                session = sessiondict["session"]
+                name = os.path.basename(sessiondict["directory"])
+                if session is not None and session.isConnected:
                     name = "(connected) " + name
-                state = session.state
+                state = self.sessions.getState(uid)
                 if state is State.FINISHED:
                     name += " [FINISHED]"
                 if state is State.WAITING:
@@ -229,45 +235,50 @@ class ServerSessionManager(QObject):
             logging.error("Sessions not found. No PID provided.")
         transaction.send(msg)
 
-    def findSessionBySessionUid(self, uid):
-        """find a single session with UID"""
-        for sessiondict in self.sessions:
-            if sessiondict["uid"] == uid:
-                logging.debug("Found session for UID '%s'", uid)
-                return sessiondict["session"]
-        logging.debug("No sessions found for UID '%s'", uid)
-        return None
+    def findSessionBySessionUid(self, uid, load=True):
+        """find a single session with UID, the session is loaded unless load is False"""
+        sessiondict = self.sessions.get(uid)
+        if sessiondict is None:
+            logging.debug("No sessions found for UID '%s'", uid)
+            return None
+        if sessiondict["session"] is None and load:
+            self._loadSession(sessiondict)
+        return sessiondict["session"]
 
     def findSessionIDsByProjectId(self, pid):
         """list all sessionids with PID"""
-        uids = []
-        for sessiondict in self.sessions:
-            if sessiondict["pid"] == pid:
-                uids.append(sessiondict["uid"])
-        logging.info("Found %s session/s for PID '%s'", str(len(uids)), pid)
-        return uids
-
-    def findSessionIDsWithState(self, state):
-        """find all session UIDs with state"""
-        sessions = []
-        for sessiondict in self.sessions:
-            if sessiondict["session"].state == state:
-                sessions.append(sessiondict["uid"])
-        logging.debug("There are %i session/s with state %i", len(sessions), state)
-        return sessions
+        return self.sessions.getUids(pid=pid)
+
+    def findSessionIDsWithState(self, state, pid=None):
+        """find all session UIDs with state, optionally only of the project with PID"""
+        return self.sessions.getUids(pid=pid, state=state)
+
+    def countSessions(self, pid=None, state=None):
+        """count the sessions with PID and/or state"""
+        return self.sessions.count(pid=pid, state=state)
+
+    def sessionStateChanged(self, session):
+        """update the state index after the state of the session was set"""
+        self.sessions.stateChanged(session.uid, session.state)
+        self.scheduler.sessionStateChanged(session)
+        self.parent.invalidateStatus()
 
     def _createSession(self, pid, dir):
         """Create a new session with PID in directory"""
         # TODO
         session = ServerSession(self, dir, pid=pid)
         uid = session.uid
-        self.sessions.append({"pid": pid, "uid": uid, "session": session})
+        self.sessions.add({"pid": pid, "uid": uid, "directory": dir, "session": session}, session.state)
+        self.parent.invalidateStatus()
         return uid
 
-    def _loadSession(self, dir):
-        """load a session from directory"""
-        session = ServerSession(self, dir, parse_old=True)
-        return {"pid": session.pid, "uid": session.uid, "session": session}
+    def _loadSession(self, sessiondict):
+        """load the session of a session dict and queue it for parsing"""
+        session = ServerSession(self, sessiondict["directory"], parse_old=True)
+        sessiondict["session"] = session
+        self.sessions.stateChanged(sessiondict["uid"], session.state)
+        SessionPool().addSession(session)
+        logging.debug("Loaded session with UID '%s'", sessiondict["uid"])
 
     def _createDirName(self, sid):
         """create a directory for session with SID"""
@@ -291,46 +302,60 @@ class ServerSessionManager(QObject):
         return date_string
 
     def loadSessions(self):
-        """load all session from sessionpath and add them to the pool"""
-        pool = SessionPool()
+        """register all sessions from sessionpath, the sessions are loaded on first use"""
+        self.manifest.load()
+        entries = self.manifest.update(self._readSessionEntry, ignore=("barista.conf", "caffeVersions"))
+        self.manifest.save()
         count = 0
-        for entry in os.listdir(self.sessionPath):
-            if entry == "barista.conf" or entry == "caffeVersions":
+        for entry in sorted(entries):
+            info = entries[entry]
+            if self.sessions.get(info["uid"]) is not None:
+                logging.error("Session at %s has the UID '%s' of another session.", entry, info["uid"])
                 continue
-            sdir = os.path.join(self.sessionPath, entry)
-            if self._isSession(sdir):
-                sessiondict = self._loadSession(sdir)
-                if sessiondict is not None:
-                    self.sessions.append(sessiondict)
-                    pool.addSession(sessiondict["session"])
-                    count += 1
+            sessiondict = {"pid": info["pid"], "uid": info["uid"],
+                           "directory": os.path.join(self.sessionPath, entry), "session": None}
+            self.sessions.add(sessiondict, info["state"])
+            count += 1
+        pool = SessionPool()
         self.poolEmptyJob.connect(self.emptyJob)
-        pool.activate(lambda: self.poolEmptyJob.emit("All jobs finished. SessionPool Queue empty."))
-        logging.info("Loaded %s session/s", str(count))
+        pool.activate(lambda: self.poolEmptyJob.emit("All jobs finished. SessionPool Queue empty."), processes=True)
+        logging.info("Registered %s session/s", str(count))
         return count
 
     def emptyJob(self, msg):
         logging.info("All jobs finished. SessionPool Queue empty.")
         print msg
 
-    def _isSession(self, dir):
-        """Check if directory contains a valid session."""
+    def _readSessionEntry(self, dir):
+        """Return the manifest entry of the session in directory or None if it is invalid."""
+        settings = self._readSessionState(dir)
+        if settings is None:
+            return None
+        state = settings["SessionState"]
+        if state == State.RUNNING:
+            # a session can not be running after a restart of the server
+            state = State.PAUSED
+        return {"uid": settings["UID"], "pid": settings["ProjectID"], "sid": settings["SID"],
+                "state": state, "iteration": settings["Iteration"]}
+
+    def _readSessionState(self, dir):
+        """Return the parsed session json of directory or None if it is not a valid session."""
         session_json = os.path.join(dir,Paths.FILE_NAME_SESSION_JSON)
         if os.path.isdir(dir) is False:
             sys.stderr.write("Session directory " + dir + " is invalid! No directory!\n")
             logging.error("Session directory %s is invalid. No directory", dir)
-            return False
+            return None
         if not os.path.exists(session_json):
             sys.stderr.write("Session directory " + os.path.basename(os.path.normpath(dir)) + " is invalid!\n    File 'sessionstate.json' does not exist!\n")
             logging.error("Session directory %s is invalid. 'sessionstate.json' does not exist!", dir)
-            return False
+            return None
         with open(session_json,"r") as file:
             try:
                 dict = json.load(file)
             except ValueError:
                 sys.stderr.write("Session file " + session_json + " is invalid!\n    File 'sessionstate.json' could not be parsed!\n")
                 logging.error("Session file %s is invalid. 'sessionstate.json' could not be parsed!", session_json)
-                return False
+                return None
             
         for key in self.jsonKeys:
             if key not in dict:
@@ -338,7 +363,7 @@ class ServerSessionManager(QObject):
                                  + os.path.basename(os.path.normpath(dir))+" is invalid!\n    Key '"
                                  +key +"' is missing in sessionstate!\n")
                 logging.error("Session at %s is invalid. Key %s in 'sessionstate.json' is missing.",dir,key)
-                return False
+                return None
         if "LastSnapshot" in dict:
             if dict["LastSnapshot"]:
                 if not os.path.exists(os.path.join(dir,dict["LastSnapshot"])):
@@ -346,9 +371,9 @@ class ServerSessionManager(QObject):
                                      + os.path.basename(os.path.normpath(dir)) + " is invalid!\n    Snapshot "
                                                                                  "was set but not found in directory\n")
                     logging.error("Session at %s is invalid. Snapshot was set but not found.", dir)
-                    return False
+                    return None
         logging.debug("Session directory %s is valid!", dir)
-        return True
+        return dict
 
     def _parseSnapshotPrefixFromFile(self, filename):
         """ Return the snapshot prefix of the solver.
@@ -363,4 +388,4 @@ class ServerSessionManager(QObject):
 
     def isTraining(self):
         """check if there is already a session running on this server"""
-        return len(self.findSessionIDsWithState(State.RUNNING)) > 0
+        return self.countSessions(state=State.RUNNING) > 0
@@ -78,8 +78,8 @@ class ServerTransaction(Transaction):
             sessionsUIDs = self.parent.sessionManager.findSessionIDsByProjectId(msg["pid"])
             success = True
             for uid in sessionsUIDs:
-                session = self.parent.sessionManager.findSessionBySessionUid(uid)
-                if session.isConnected:
+                session = self.parent.sessionManager.findSessionBySessionUid(uid, load=False)
+                if session is not None and session.isConnected:
                     if not session.save():
                         success = False
             if success is False:
@@ -162,7 +162,7 @@ class ServerTransaction(Transaction):
         return str(size) + " " + unit
 
     def _getBaristaStatus(self):
-        """start the Timer for Heartbeat"""
+        """subscribe to the server status and start the Timer for the keep-alive"""
         msg = self.asyncRead()
         if "projectid" in msg.keys():
             self.projectID = msg["projectid"]
@@ -170,25 +170,40 @@ class ServerTransaction(Transaction):
             self.timer = QTimer()
             self.timer.setInterval(5000)
             self.timer.setSingleShot(True)
-            self.timer.timeout.connect(self._sendBaristaStatus)
+            self.timer.timeout.connect(self.sendBaristaStatus)
             self.socketClosed.connect(lambda : self.timer.stop())
+            self.parent.subscribeStatus(self)
             logging.debug("start heartbeat timer")
-        self._sendBaristaStatus()
+        # a new request is answered with the full status
+        self.lastStatus = None
+        self.sendBaristaStatus()
 
+    def sendBaristaStatus(self, keepAlive=True):
+        """send the changes of the server status since the last message
 
-    def _sendBaristaStatus(self):
-        """return the server status"""
+        Without changes an empty message is sent as keep-alive, unless keepAlive is False.
+        """
         if hasattr(self, "timer"):
             self.timer.stop()
             if self.isConnected():
                 self.timer.start()
-        msg = {"key": Protocol.GETSTATUS}
         if hasattr(self, "projectID"):
             state = self.parent.getBaristaStatus(self.projectID)
         else:
             state = self.parent.getBaristaStatus()
-        msg["data"] = state
-        logging.debug("got state")
+        if self.lastStatus is None:
+            delta = state
+        else:
+            delta = {}
+            for key, value in state.iteritems():
+                if key not in self.lastStatus or self.lastStatus[key] != value:
+                    delta[key] = value
+            if not delta and not keepAlive:
+                return
+        msg = {"key": Protocol.GETSTATUS}
+        msg["data"] = delta
+        msg["delta"] = self.lastStatus is not None
+        self.lastStatus = state
         self.send(msg)
 
     def _getDBStatus(self):
@@ -274,6 +289,7 @@ class ServerTransaction(Transaction):
 
     """
     Computes and sends the hashValue of a db file, if this file exists.
+    With "mode" set to db_util.HASH_FINGERPRINT a fast fingerprint is sent instead of the full hash.
 
     @author : j_stru18
     """
@@ -287,7 +303,7 @@ class ServerTransaction(Transaction):
             if path is not None and type is not None:
                 if os.path.exists(path):
                     dbPaths = db_util.getDBPathsByType(path, type)
-                    hashValue = db_util.getMultipleHash(dbPaths)
+                    hashValue = db_util.getMultipleHash(dbPaths, msg.get("mode", db_util.HASH_FULL))
                     msg["status"] = True
                 else:
                     logging.warning("File does not exist: %s", path)
@@ -306,8 +322,9 @@ class ServerTransaction(Transaction):
         self.send(msg)
 
     def _scanHardware(self):
-        """launch a hardware scan"""
-        self.parent.checkHardware(True, self)
+        """launch a hardware scan, the result is sent when the scan is finished"""
+        msg = self.asyncRead()
+        self.parent.checkHardware(True, self, msg.get("rescan", True))
 
     def _setHardware(self):
         msg = self.asyncRead()
@@ -360,6 +377,7 @@ class ServerTransaction(Transaction):
         versionReceived = msg["version"]
         version = caffeVersions.caffeVersion(versionReceived["name"], versionReceived["root"], versionReceived["binary"], versionReceived["python"], versionReceived["proto"])
         caffeVersions.addVersion(version, self.parent.sessionPath)
+        self.parent.invalidateStatus()
         msg["status"] = True
         self.send(msg)
 
@@ -368,6 +386,7 @@ class ServerTransaction(Transaction):
         versionNameReceived = msg["versionname"]
         caffeVersions.setDefaultVersion(versionNameReceived, self.parent.sessionPath)
         caffeVersions.restart = True
+        self.parent.invalidateStatus()
         msg["status"] = True
         self.send(msg)
 
@@ -376,6 +395,7 @@ class ServerTransaction(Transaction):
         versionNameReceived = msg["versionname"]
         version = caffeVersions.getVersionByName(versionNameReceived)
         caffeVersions.removeVersion(version, self.parent.sessionPath)
+        self.parent.invalidateStatus()
         msg["status"] = True
         self.send(msg)
 
@@ -397,7 +417,10 @@ class ServerTransaction(Transaction):
     def _getFileHash(self):
         msg = self.asyncRead()
         path = msg["path"]
-        hash = Hash.hashFile(path)
+        if msg.get("mode") == db_util.HASH_FINGERPRINT:
+            hash = Hash.fingerprintFile(path)
+        else:
+            hash = Hash.hashFile(path)
         msg["status"] = True
         msg["hash"] = hash
         self.send(msg)
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+
+from backend.barista.session.session_utils import Paths
+
+
+class SessionManifest(object):
+    """ Summary of all sessions in the session path, stored in one file.
+
+    For every session directory the manifest stores uid, pid, sid, state,
+    iteration and the mtime of the session json file. On startup only the
+    sessions whose json file changed since the manifest was written have to
+    be read again.
+    """
+
+    FILE_NAME = "sessions.manifest"
+    VERSION = 1
+
+    def __init__(self, sessionPath):
+        self.sessionPath = sessionPath
+        self.filename = os.path.join(sessionPath, SessionManifest.FILE_NAME)
+        # session directory name -> entry
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        """ Load the manifest file if it exists and has the current version.
+        """
+        self.entries = {}
+        self.dirty = True
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as f:
+                manifest = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warning("Could not read session manifest %s: %s", self.filename, str(e))
+            return
+        if manifest.get("Version") == SessionManifest.VERSION:
+            self.entries = manifest["Sessions"]
+            self.dirty = False
+
+    def update(self, readSession, ignore=()):
+        """ Bring the entries up to date with the session directories.
+
+        readSession(directory) is called for new and changed sessions and has
+        to return the entry of the session or None if it is invalid. Entries in
+        ignore are skipped. Return the entries.
+        """
+        names = set()
+        for name in os.listdir(self.sessionPath):
+            if name == SessionManifest.FILE_NAME or name in ignore:
+                continue
+            directory = os.path.join(self.sessionPath, name)
+            try:
+                mtime = os.path.getmtime(os.path.join(directory, Paths.FILE_NAME_SESSION_JSON))
+            except OSError:
+                mtime = None
+            entry = self.entries.get(name)
+            if entry is None or mtime is None or entry["mtime"] != mtime:
+                entry = readSession(directory)
+                if entry is None:
+                    continue
+                entry["mtime"] = mtime
+                self.entries[name] = entry
+                self.dirty = True
+            names.add(name)
+        for name in list(self.entries.keys()):
+            if name not in names:
+                del self.entries[name]
+                self.dirty = True
+        return self.entries
+
+    def save(self):
+        """ Write the manifest if it changed.
+        """
+        if not self.dirty:
+            return
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"Version": SessionManifest.VERSION, "Sessions": self.entries}, f)
+            os.rename(tmp, self.filename)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            logging.warning("Could not write session manifest %s: %s", self.filename, str(e))
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class SessionRegistry(object):
+    """ Hold the session dicts of the server indexed by UID, PID and state.
+
+    Iterating the registry yields the session dicts in the order they were
+    added. The session of a dict is None until it is loaded. The state index
+    is kept up to date by stateChanged, which the manager calls whenever the
+    state of a session is set.
+    """
+
+    def __init__(self):
+        self.byUid = OrderedDict()
+        self.byPid = {}
+        self.byState = {}
+        self.byPidState = {}
+        # state each session is indexed under
+        self.states = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.byUid)
+
+    def __iter__(self):
+        return iter(self.byUid.values())
+
+    def add(self, sessiondict, state):
+        """ Add a session dict with the keys pid, uid, directory and session.
+        """
+        uid = sessiondict["uid"]
+        pid = sessiondict["pid"]
+        self.lock.acquire()
+        try:
+            self.byUid[uid] = sessiondict
+            self.byPid.setdefault(pid, OrderedDict())[uid] = None
+            self._index(uid, pid, state)
+        finally:
+            self.lock.release()
+
+    def remove(self, uid):
+        """ Remove the session with the UID and return its session dict.
+        """
+        self.lock.acquire()
+        try:
+            sessiondict = self.byUid.pop(uid, None)
+            if sessiondict is not None:
+                pid = sessiondict["pid"]
+                self._unindex(uid, pid)
+                uids = self.byPid[pid]
+                del uids[uid]
+                if not uids:
+                    del self.byPid[pid]
+            return sessiondict
+        finally:
+            self.lock.release()
+
+    def stateChanged(self, uid, state):
+        """ Move a session to the bucket of its new state.
+        """
+        self.lock.acquire()
+        try:
+            sessiondict = self.byUid.get(uid)
+            if sessiondict is not None:
+                pid = sessiondict["pid"]
+                self._unindex(uid, pid)
+                self._index(uid, pid, state)
+        finally:
+            self.lock.release()
+
+    def get(self, uid):
+        """ Return the session dict with the UID or None.
+        """
+        return self.byUid.get(uid)
+
+    def getState(self, uid):
+        """ Return the state the session with the UID is indexed under.
+        """
+        return self.states.get(uid)
+
+    def getUids(self, pid=None, state=None):
+        """ Return the UIDs of all sessions with the PID and/or state.
+        """
+        self.lock.acquire()
+        try:
+            if pid is None and state is None:
+                return list(self.byUid.keys())
+            if state is None:
+                return list(self.byPid.get(pid, ()))
+            if pid is None:
+                return list(self.byState.get(state, ()))
+            return list(self.byPidState.get((pid, state), ()))
+        finally:
+            self.lock.release()
+
+    def count(self, pid=None, state=None):
+        """ Return the number of sessions with the PID and/or state.
+        """
+        if pid is None and state is None:
+            return len(self.byUid)
+        if state is None:
+            return len(self.byPid.get(pid, ()))
+        if pid is None:
+            return len(self.byState.get(state, ()))
+        return len(self.byPidState.get((pid, state), ()))
+
+    # private methods
+
+    def _index(self, uid, pid, state):
+        self.states[uid] = state
+        self.byState.setdefault(state, set()).add(uid)
+        self.byPidState.setdefault((pid, state), set()).add(uid)
+
+    def _unindex(self, uid, pid):
+        state = self.states.pop(uid)
+        for index, key in ((self.byState, state), (self.byPidState, (pid, state))):
+            uids = index[key]
+            uids.discard(uid)
+            if not uids:
+                del index[key]
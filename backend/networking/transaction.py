@@ -1,16 +1,26 @@
-import pickle
 import sys
+import time
 from abc import abstractmethod
 from threading import Lock
 import logging
-import zlib
 
-from PyQt5.QtCore import QByteArray, QDataStream, QIODevice, QObject, pyqtSignal
+from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtNetwork import QTcpSocket, QAbstractSocket
 from PyQt5.QtTest import QSignalSpy
 from PyQt5.QtWidgets import qApp
 
+from backend.networking import wire
+
+# compress frames with the best codec supported by both sides
 COMPRESS = True
+# key of the request id, which the other side returns with the response
+REQUEST_ID = "requestId"
+# frames up to this size are read into a reused buffer, larger frames get a
+# buffer of their own, which is released with the decoded message
+RECEIVE_BUFFER_SIZE = 64 * 1024
+# send() only blocks while more bytes than this wait in the socket buffer,
+# below it the event loop writes the frames in the background
+MAX_PENDING_BYTES = 64 * 1024 * 1024
 
 class Transaction(QObject):
     """Use parent class for server and client transactions. Abstracts TCPSocket-Access"""
@@ -37,16 +47,26 @@ class Transaction(QObject):
     socketClosed = pyqtSignal()
     _stopWaiting = pyqtSignal()
     _staging = pyqtSignal()
+    _responseReady = pyqtSignal()
 
     def __init__(self):
         # QObject.__init__(self)
         super(Transaction, self).__init__()
         self.tcpsocket = None  # type: QTcpSocket
-        self.messageBuffer = QByteArray()
-        self.recieveBuffer = QByteArray()
+        # the payload of small frames is read into this reused buffer
+        self.recieveBuffer = bytearray(RECEIVE_BUFFER_SIZE)
+        # the buffer of the current frame
+        self.frameBuffer = None
         self.messageOutput = list()
-        self.messageSize = 0
-        self.isRecieving = False
+        self.frameHeader = None
+        self.frameRead = 0
+        self.control = None
+        self.blobs = []
+        self.codec = wire.NONE
+        # responses of the requests in flight by request id, None until the
+        # response arrived
+        self.pending = {}
+        self.requestCount = 0
         self.bufferReady.connect(self.processMessage)
         self._isConnected = False
         self._hasError = False
@@ -98,6 +118,7 @@ class Transaction(QObject):
         logging.debug("Socket connected.")
         self._isConnected = True
         self._hasError = False
+        self._sendHello()
 
     def acceptClient(self, socket):
         """set external socket"""
@@ -107,45 +128,46 @@ class Transaction(QObject):
         self._hasError = False
         self.tcpsocket.error.connect(self.processError)
         self.tcpsocket.readyRead.connect(self.receive)
+        self._sendHello()
 
     def receive(self):
-        """On recieve packet load message into buffer. But first get message length"""
-        logging.debug("Receiving message")
+        """On recieve read the available bytes into the current frame. But first get the frame header"""
         while self.tcpsocket.bytesAvailable() > 0:
-            # while some unread bytes available
-            stream = QDataStream(self.tcpsocket)
-            stream.setVersion(QDataStream.Qt_5_3)
-
-            if not self.isRecieving:  # For a new Message get the Message Size
-                if self.tcpsocket.bytesAvailable >= 4:  # since reading UInt32
-                    self.messageSize = stream.readUInt32()
-                    logging.debug("Start of new message of size %i", self.messageSize)
-                    self.isRecieving = True
-                else:
+            if self.frameHeader is None:  # For a new frame get the header
+                if self.tcpsocket.bytesAvailable() < wire.HEADER.size:
                     break
-
-            else:  # For a continued message keep reding until whole message is in buffer
-                s = min(self.tcpsocket.bytesAvailable(), self.messageSize - len(self.messageBuffer))
-                self.messageBuffer.append(stream.readRawData(s))
-                if len(self.messageBuffer) == self.messageSize:
-                    logging.debug("Finished receiving message of size %i", self.messageSize)
-                    self._processBuffer()
+                try:
+                    self.frameHeader = wire.decodeHeader(self.tcpsocket.read(wire.HEADER.size))
+                except wire.WireError as e:
+                    sys.stderr.write("Transaction Error: " + str(e) + "\n")
+                    self.close()
+                    return
+                self.frameRead = 0
+                size = self.frameHeader[2]
+                if size <= len(self.recieveBuffer):
+                    self.frameBuffer = self.recieveBuffer
+                else:
+                    self.frameBuffer = bytearray(size)
+                logging.debug("Start of new frame of size %i", size)
+            else:  # For a continued frame keep reading until the whole payload is in the buffer
+                size = self.frameHeader[2]
+                s = min(self.tcpsocket.bytesAvailable(), size - self.frameRead)
+                data = self.tcpsocket.read(s)
+                self.frameBuffer[self.frameRead:self.frameRead + len(data)] = data
+                self.frameRead += len(data)
+            if self.frameHeader is not None and self.frameRead == self.frameHeader[2]:
+                self._processFrame()
 
     def send(self, msg):
-        """Send first the message size, then the message in Pickle"""
+        """Send the message as a control frame followed by its blob frames"""
         if self.isConnected():
-            pmsg = pickle.dumps(msg)
-            if COMPRESS:
-                pmsg = zlib.compress(pmsg)
-            buffer = QByteArray()
-            stream = QDataStream(buffer, QIODevice.WriteOnly)
-            stream.setVersion(QDataStream.Qt_5_3)
-            stream.writeUInt32(len(pmsg))
-            stream.writeRawData(pmsg)
-            bytesWritten = self.tcpsocket.write(buffer)
-            self.tcpsocket.flush()
-            self.tcpsocket.waitForBytesWritten()
-            # qApp.processEvents()  # send data immediately and don't wait for next mainloop
+            codec = self.codec if COMPRESS else wire.NONE
+            bytesWritten = self._writeFrames(wire.encodeMessage(msg, codec))
+            # the frames are written by the event loop, only wait if the peer
+            # does not keep up, so the buffer does not grow without bound
+            while self.tcpsocket.bytesToWrite() > MAX_PENDING_BYTES and self.isConnected():
+                if not self.tcpsocket.waitForBytesWritten(5000):
+                    break
             logging.debug("Bytes written: %i", bytesWritten)
             if bytesWritten > 0:
                 return True
@@ -165,21 +187,79 @@ class Transaction(QObject):
             self.tcpsocket.close()
             # self.tcpsocket = None
             self.socketClosed.emit()
+            # wake up the waiting requests
+            self._responseReady.emit()
+
+    def _sendHello(self):
+        """Announce the codecs this side can decode"""
+        self._writeFrames(wire.encodeHello())
+
+    def _writeFrames(self, frames):
+        """Write the frames to the socket, return the number of bytes written"""
+        bytesWritten = 0
+        for data in frames:
+            written = self.tcpsocket.write(data)
+            if written < 0:
+                return written
+            bytesWritten += written
+        self.tcpsocket.flush()
+        return bytesWritten
+
+    def _processFrame(self):
+        """If a frame is complete: decode it and move complete messages to the output buffer"""
+        ftype, codec, size = self.frameHeader
+        self.frameHeader = None
+        frameBuffer = self.frameBuffer
+        self.frameBuffer = None
+        try:
+            if frameBuffer is self.recieveBuffer:
+                payload = wire.decodePayload(codec, buffer(frameBuffer, 0, size))
+                if codec == wire.NONE:
+                    # the next frame overwrites the reused buffer
+                    payload = str(payload)
+            else:
+                # the frame owns its buffer, arrays are built on it without a copy
+                payload = wire.decodePayload(codec, frameBuffer)
+            if ftype == wire.HELLO:
+                self.codec = wire.chooseCodec(wire.decodeHello(payload))
+                logging.debug("Peer codecs received, using codec %i", self.codec)
+                return
+            if ftype == wire.CONTROL:
+                self.control = payload
+                self.blobs = []
+            elif ftype == wire.BLOB and self.control is not None:
+                self.blobs.append(payload)
+            else:
+                raise wire.WireError("Unexpected frame type " + str(ftype) + ".")
+            if len(self.blobs) < wire.blobCount(self.control):
+                return
+            msg = wire.decodeMessage(self.control, self.blobs)
+        except wire.WireError as e:
+            sys.stderr.write("Transaction Error: Failed to decode message: " + str(e) + "\n")
+            self.control = None
+            self.blobs = []
+            return
+        # reset state
+        self.control = None
+        self.blobs = []
+        self._deliverMessage(msg)
 
-    def _processBuffer(self):
-        """If message is complete: read Pickle and move to output buffer"""
-        pmsg = str(self.messageBuffer)
-        if COMPRESS:
-            pmsg = zlib.decompress(pmsg)
-        msg = pickle.loads(pmsg)
+    def _deliverMessage(self, msg):
+        """Route a response to its request, move other messages to the output buffer"""
         logging.debug("Message received: %s", str(msg))
 
         self.lock.acquire()
+        requestId = msg.get(REQUEST_ID)
+        if requestId is not None and requestId <= self.requestCount:
+            # the response to a request of this side, route it to the request
+            # or drop it if the request was cancelled
+            if requestId in self.pending:
+                self.pending[requestId] = msg
+            self.lock.release()
+            self._responseReady.emit()
+            return
         self.messageOutput.append(msg)
         self.lock.release()
-        # reset state
-        self.isRecieving = False
-        self.messageBuffer.clear()
         self._stopWaiting.emit()
         self.bufferReady.emit()
 
@@ -188,6 +268,66 @@ class Transaction(QObject):
         """implement in server/client"""
         pass
 
+    def request(self, msg, timeout=5000):
+        """Send a request and wait for its response.
+
+        Return the response or None if sending failed or no response arrived
+        within timeout milliseconds.
+        """
+        requestId = self.sendRequest(msg)
+        if requestId is None:
+            return None
+        return self.waitForResponse(requestId, timeout)
+
+    def sendRequest(self, msg):
+        """Send a request without waiting for the response.
+
+        The message gets a request id, which the other side returns with the
+        response. Responses are routed to their request by this id and do not
+        enter the message buffer, so any number of requests can be in flight.
+        Return the request id for waitForResponse() or None if sending failed.
+        """
+        self.lock.acquire()
+        self.requestCount += 1
+        requestId = self.requestCount
+        self.pending[requestId] = None
+        self.lock.release()
+        msg[REQUEST_ID] = requestId
+        if not self.send(msg):
+            self.cancelRequest(requestId)
+            return None
+        return requestId
+
+    def waitForResponse(self, requestId, timeout=5000):
+        """Wait for the response to a request sent by sendRequest().
+
+        Return the response or None on timeout or if the connection is lost.
+        """
+        deadline = time.time() + timeout / 1000.0
+        try:
+            while self.pending.get(requestId) is None:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.isConnected() or self._hasError:
+                    logging.debug("No response for request %i", requestId)
+                    return None
+                spy = QSignalSpy(self._responseReady)
+                spy.wait(int(remaining * 1000) + 1)  # Asynchronous wait
+            result = self.pending[requestId]
+        finally:
+            self.cancelRequest(requestId)
+        del result[REQUEST_ID]
+        if "error" not in result:
+            result["error"] = []
+        if "status" not in result:
+            result["status"] = True
+        return result
+
+    def cancelRequest(self, requestId):
+        """Forget a request, its response is dropped when it arrives."""
+        self.lock.acquire()
+        self.pending.pop(requestId, None)
+        self.lock.release()
+
     def asyncRead(self, timeout=5000, staging=False, attr=None):
         """For direct reading access, pop the first message in buffer
         Explanation:
@@ -308,7 +448,7 @@ class Transaction(QObject):
         found = False
         for msg in self.messageOutput:
             if attr[0] in msg:
-                if msg[attr[0]] is attr[1]:
+                if msg[attr[0]] == attr[1]:
                     found = True
                     break
         self.lock.release()
@@ -0,0 +1,351 @@
+"""Binary framing of the messages exchanged by transactions.
+
+Every frame starts with a header:
+
+    magic (2 bytes) | version (1) | frame type (1) | codec (1) | size (4)
+
+followed by size bytes of payload, compressed with the given codec.
+
+A message is sent as one CONTROL frame followed by its BLOB frames. The
+control frame contains the number of blobs and the message encoded with a
+compact typed encoding. Large strings and numpy arrays are not copied into
+the control frame but sent as raw BLOB frames and referenced by index.
+A HELLO frame is sent after connecting. Its payload lists the codecs the
+sender can decode, so each side only compresses with codecs of its peer.
+"""
+
+import cPickle
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+MAGIC = 'BW'
+VERSION = 1
+HEADER = struct.Struct('>2sBBBI')
+
+# frame types
+HELLO = 0
+CONTROL = 1
+BLOB = 2
+
+# codecs
+NONE = 0
+ZLIB_FAST = 1
+ZLIB = 2
+LZ4 = 3
+
+# payloads smaller than this are never compressed
+COMPRESS_THRESHOLD = 1024
+# strings and arrays of at least this size are sent as blob frames
+BLOB_THRESHOLD = 64 * 1024
+# frames with a larger payload are rejected, so a corrupt header does not
+# make the receiver allocate up to 4 GB
+MAX_FRAME_SIZE = 1024 * 1024 * 1024
+
+_LENGTH = struct.Struct('>I')
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+_DATETIME = struct.Struct('>HBBBBBI')
+
+
+class WireError(Exception):
+    """ Raised for frames which can not be decoded.
+    """
+    pass
+
+
+def supportedCodecs():
+    """ Return the codecs this side can decode, the preferred one first.
+    """
+    codecs = []
+    if lz4frame is not None:
+        codecs.append(LZ4)
+    codecs.extend([ZLIB_FAST, ZLIB, NONE])
+    return codecs
+
+
+def chooseCodec(peerCodecs):
+    """ Return the preferred codec which is supported by both sides.
+    """
+    for codec in supportedCodecs():
+        if codec in peerCodecs:
+            return codec
+    return NONE
+
+
+def encodeHello():
+    """ Return the frame announcing the supported codecs.
+    """
+    payload = ''.join(chr(codec) for codec in supportedCodecs())
+    return [HEADER.pack(MAGIC, VERSION, HELLO, NONE, len(payload)), payload]
+
+
+def decodeHello(payload):
+    """ Return the codecs listed in a HELLO frame.
+    """
+    return list(bytearray(payload))
+
+
+def encodeMessage(msg, codec=NONE):
+    """ Return the frames of a message as list of strings.
+
+    Header and payload of a frame are separate strings, so large payloads are
+    not copied to prepend the header.
+    """
+    parts = []
+    blobs = []
+    _encode(msg, parts, blobs)
+    parts.insert(0, _LENGTH.pack(len(blobs)))
+    frames = _frame(CONTROL, ''.join(parts), codec)
+    for blob in blobs:
+        frames.extend(_frame(BLOB, blob, codec))
+    return frames
+
+
+def decodeHeader(data):
+    """ Return (frame type, codec, size) of a frame header.
+    """
+    try:
+        magic, version, ftype, codec, size = HEADER.unpack(data)
+    except struct.error:
+        raise WireError('Truncated frame header.')
+    if magic != MAGIC:
+        raise WireError('Invalid frame.')
+    if version != VERSION:
+        raise WireError('Unsupported protocol version ' + str(version) + '.')
+    if size > MAX_FRAME_SIZE:
+        raise WireError('Frame of ' + str(size) + ' bytes exceeds the maximum frame size.')
+    return ftype, codec, size
+
+
+def decodePayload(codec, data):
+    """ Return the uncompressed payload of a frame.
+
+    data may be any object supporting the buffer interface. Uncompressed
+    payloads are returned as they are without a copy, so data must not be
+    reused until the message is decoded.
+    """
+    if codec == NONE:
+        return data
+    try:
+        if codec == ZLIB_FAST or codec == ZLIB:
+            # zlib only takes strings and read only buffers
+            return zlib.decompress(buffer(data))
+        if codec == LZ4 and lz4frame is not None:
+            return lz4frame.decompress(str(data))
+    except (zlib.error, RuntimeError, ValueError) as e:
+        raise WireError('Corrupt payload: ' + str(e))
+    raise WireError('Unsupported codec ' + str(codec) + '.')
+
+
+def blobCount(control):
+    """ Return the number of blob frames following the control frame.
+    """
+    try:
+        return _LENGTH.unpack_from(control, 0)[0]
+    except struct.error:
+        raise WireError('Truncated control frame.')
+
+
+def decodeMessage(control, blobs):
+    """ Return the message of a control frame and its blobs.
+
+    The frames may be strings or buffers. Arrays sent in a blob which is a
+    bytearray are built on it without a copy. Raise WireError if the control
+    frame is truncated or does not match the blobs.
+    """
+    decoder = _Decoder(control, blobs)
+    decoder.pos = _LENGTH.size
+    try:
+        msg = decoder.decode()
+    except (struct.error, IndexError, ValueError, TypeError) as e:
+        raise WireError('Truncated or corrupt control frame: ' + str(e))
+    if decoder.pos != len(control):
+        raise WireError('Unexpected data after the message.')
+    return msg
+
+
+# private methods
+
+def _frame(ftype, payload, codec):
+    if codec != NONE and len(payload) >= COMPRESS_THRESHOLD:
+        payload = _compress(codec, payload)
+    else:
+        codec = NONE
+    return [HEADER.pack(MAGIC, VERSION, ftype, codec, len(payload)), payload]
+
+
+def _compress(codec, payload):
+    if codec == ZLIB_FAST:
+        return zlib.compress(payload, 1)
+    if codec == ZLIB:
+        return zlib.compress(payload, 6)
+    if codec == LZ4:
+        return lz4frame.compress(payload)
+    raise WireError('Unsupported codec ' + str(codec) + '.')
+
+
+def _encodeBytes(value, parts, blobs):
+    if len(value) >= BLOB_THRESHOLD:
+        parts.append('b')
+        parts.append(_LENGTH.pack(len(blobs)))
+        blobs.append(value)
+    else:
+        parts.append('s')
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+
+
+def _encode(value, parts, blobs):
+    t = type(value)
+    if value is None:
+        parts.append('N')
+    elif t is bool:
+        parts.append('T' if value else 'F')
+    elif t is int:
+        parts.append('i')
+        parts.append(_INT.pack(value))
+    elif t is float:
+        parts.append('d')
+        parts.append(_FLOAT.pack(value))
+    elif t is str:
+        _encodeBytes(value, parts, blobs)
+    elif t is unicode:
+        value = value.encode('utf-8')
+        parts.append('u')
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+    elif t is list or t is tuple:
+        parts.append('l' if t is list else 't')
+        parts.append(_LENGTH.pack(len(value)))
+        for item in value:
+            _encode(item, parts, blobs)
+    elif t is dict or t is OrderedDict:
+        parts.append('m' if t is dict else 'o')
+        parts.append(_LENGTH.pack(len(value)))
+        for key, item in value.iteritems():
+            _encode(key, parts, blobs)
+            _encode(item, parts, blobs)
+    elif t is datetime and value.tzinfo is None:
+        parts.append('D')
+        parts.append(_DATETIME.pack(value.year, value.month, value.day, value.hour,
+                                    value.minute, value.second, value.microsecond))
+    elif t is np.ndarray and not value.dtype.hasobject:
+        dtype = value.dtype.str
+        parts.append('a')
+        parts.append(chr(len(dtype)))
+        parts.append(dtype)
+        parts.append(chr(value.ndim))
+        for dim in value.shape:
+            parts.append(_LENGTH.pack(dim))
+        _encodeBytes(np.ascontiguousarray(value).tobytes(), parts, blobs)
+    else:
+        # everything else, e.g. longs, sets and custom classes
+        value = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        parts.append('p')
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+
+
+class _Decoder(object):
+    """ Decode the typed encoding of a control frame.
+    """
+
+    def __init__(self, data, blobs):
+        if not isinstance(data, str):
+            # indexing and slicing a buffer return strings like a str does
+            data = buffer(data)
+        self.data = data
+        self.blobs = blobs
+        self.pos = 0
+
+    def decode(self):
+        data = self.data
+        tag = data[self.pos]
+        self.pos += 1
+        if tag == 'N':
+            return None
+        if tag == 'T':
+            return True
+        if tag == 'F':
+            return False
+        if tag == 'i':
+            value = _INT.unpack_from(data, self.pos)[0]
+            self.pos += _INT.size
+            return value
+        if tag == 'd':
+            value = _FLOAT.unpack_from(data, self.pos)[0]
+            self.pos += _FLOAT.size
+            return value
+        if tag == 's' or tag == 'b':
+            return self._bytes(tag)
+        if tag == 'u':
+            return self._string().decode('utf-8')
+        if tag == 'l' or tag == 't':
+            count = self._length()
+            items = [self.decode() for _ in xrange(count)]
+            return items if tag == 'l' else tuple(items)
+        if tag == 'm' or tag == 'o':
+            count = self._length()
+            value = {} if tag == 'm' else OrderedDict()
+            for _ in xrange(count):
+                key = self.decode()
+                value[key] = self.decode()
+            return value
+        if tag == 'D':
+            fields = _DATETIME.unpack_from(data, self.pos)
+            self.pos += _DATETIME.size
+            return datetime(*fields)
+        if tag == 'a':
+            size = ord(data[self.pos])
+            dtype = data[self.pos + 1:self.pos + 1 + size]
+            self.pos += 1 + size
+            ndim = ord(data[self.pos])
+            self.pos += 1
+            shape = []
+            for _ in xrange(ndim):
+                shape.append(self._length())
+            tag = data[self.pos]
+            self.pos += 1
+            raw = self._raw(tag)
+            if type(raw) is not bytearray:
+                # arrays on a str or buffer would be read only
+                raw = bytearray(raw)
+            return np.frombuffer(raw, dtype=np.dtype(dtype)).reshape(shape)
+        if tag == 'p':
+            return cPickle.loads(self._string())
+        raise WireError('Unknown type tag ' + repr(tag) + '.')
+
+    def _length(self):
+        value = _LENGTH.unpack_from(self.data, self.pos)[0]
+        self.pos += _LENGTH.size
+        return value
+
+    def _string(self):
+        size = self._length()
+        if self.pos + size > len(self.data):
+            raise WireError('Truncated control frame.')
+        value = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return value
+
+    def _bytes(self, tag):
+        value = self._raw(tag)
+        if type(value) is not str:
+            value = str(value)
+        return value
+
+    def _raw(self, tag):
+        """ Return the blob or the inline string as it is stored.
+        """
+        if tag == 'b':
+            return self.blobs[self._length()]
+        return self._string()
@@ -11,7 +11,6 @@ import re
 from backend.parser.parser_listener import ParserListener
 
 from backend.barista.utils.logger import Log
-from backend.parser.parser import Parser
 
 
 class Concatenator:
@@ -19,32 +18,30 @@ class Concatenator:
     Concatenates multiple logfiles (with same snapshot-file) to one iterator
     '''
 
-    def __init__(self, listOfLogfiles):
+    def __init__(self, listOfLogfiles, processes=None):
         '''
         Initializes the concatinator with a list of Logfiles
         to get a list of iterators concerning to the merged logs
         call concate()
+        processes may be a multiprocessing pool, the logfiles are
+        scanned in parallel by its worker processes in this case
         '''
 
         self.__listeners = []
-        events = {
-            Concatenator.finish: re.compile('Optimization Done.'),
-            Concatenator.interrupt: re.compile(
-                "((?:Snapshotting solver state to (?:binary proto|HDF5) file ).*)"),
-            Concatenator.resume: re.compile("((?<= Resuming from ).*)"),
-            }
-
-        for logFile in listOfLogfiles:
-            log_iter = self.__createIterFromFile(logFile)
-            parser = Parser(log_iter, events)
-            listener = Concatenator.SnapshotListener(logFile)
-            parser.addListener(listener)
-            try:
-                parser.parseLog()
-                self.__listeners.append(listener)
-            except:
+        if processes is not None and len(listOfLogfiles) > 1:
+            states = processes.map(scanLogFile, listOfLogfiles)
+        else:
+            states = [scanLogFile(logFile) for logFile in listOfLogfiles]
+
+        # the results keep the order of the logfiles
+        for logFile, state in zip(listOfLogfiles, states):
+            if state is None:
                 callerId = Log.getCallerId("Error Parsing Log File:" + str(logFile))
                 Log.error("", callerId)
+                continue
+            listener = Concatenator.SnapshotListener(logFile)
+            listener.__dict__.update(state)
+            self.__listeners.append(listener)
 
     def createSingleLogfile(self, filePath, logfileName, stream=None):
         '''
@@ -82,22 +79,10 @@ class Concatenator:
         if(len(self.__listeners) == 1):
             return [self.__listeners[0].filePath]
 
-        listenerRange = range(0, len(self.__listeners))
-        for i in listenerRange:
-            for j in listenerRange:  # TODO can start from i ... length
-                if(i != j and (self.__listeners[i].groupId == -1 or self.__listeners[j].groupId == -1 ) and
-                   self.__fromSameTraining(i, j)):
-                    self.__setGroupId(i, j)
-        for i in listenerRange:
-            if(self.__listeners[i].groupId == -1):
-                self.__setGroupId(i, i)
-
+        self.__buildChains()
         listenerGroups = self.__groupListeners()
         return self.__createAndConcateIters(listenerGroups)
 
-    # Training Interrupted, snapshot is made
-    __groupIdCounter = 0
-
     # ------EVENT CONSTANTS-----
     # Training Completet (Caffe exited)
     finish = 'Finished'
@@ -106,6 +91,15 @@ class Concatenator:
     # Training Interrupted, snapshot is made
     interrupt = 'Interrupted'
 
+    # events marking the start and end of a training,
+    # the first group of interrupt and resume is the snapshot file
+    events = {
+        finish: re.compile('Optimization Done.'),
+        interrupt: re.compile(
+            "Snapshotting solver state to (?:binary proto|HDF5) file (.*)"),
+        resume: re.compile("((?<= Resuming from ).*)"),
+        }
+
     class SnapshotListener(ParserListener):
         '''
         Listener for Logfile-Parser, looks for properties
@@ -166,55 +160,51 @@ class Concatenator:
 
     # ----------Private Methods-------------
 
-    def __fromSameTraining(self, i, j):
+    def __buildChains(self):
         '''
-        returns boolean indicating whether index i and j
-        are from the same training
+        sets the same group id for all listeners of one training
+        a log is chained to the log which wrote the snapshot
+        it resumed from, the snapshots are looked up by filename
+        the group id is the index of the first log of a training
         '''
-        iListener = self.__listeners[i]
-        jListener = self.__listeners[j]
-
-        # Merge every log
-        if(False):
-            return True
-
-        # have snapshots?
-        if not(iListener.hasSnapshot and
-               jListener.hasSnapshot):
-            return False
-
-        # Same snapshotname?
-        if(iListener.snapshotName != jListener.snapshotResumeName and
-           jListener.snapshotName != iListener.snapshotResumeName):
-            return False
-
-        range1 = range(iListener.iterationMin,
-                       iListener.iterationMax)
-        range2 = range(jListener.iterationMin,
-                       jListener.iterationMax)
-
-        # Iterations doesnt have intersect
-        if(len(set(range1).intersection(range2)) > 1):
-            return False
-
-        return True
-
-    def __setGroupId(self, i, j):
+        parents = list(range(0, len(self.__listeners)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        snapshots = {}
+        for i, listener in enumerate(self.__listeners):
+            if listener.snapshotName:
+                snapshots.setdefault(snapshotKey(listener.snapshotName), i)
+        for j, listener in enumerate(self.__listeners):
+            if not listener.snapshotResumeName:
+                continue
+            i = snapshots.get(snapshotKey(listener.snapshotResumeName))
+            if i is None or i == j or self.__overlap(i, j):
+                continue
+            rootI = find(i)
+            rootJ = find(j)
+            # keep the smaller index as root
+            if rootI < rootJ:
+                parents[rootJ] = rootI
+            else:
+                parents[rootI] = rootJ
+        for i, listener in enumerate(self.__listeners):
+            listener.groupId = find(i)
+
+    def __overlap(self, i, j):
         '''
-        Sets the same group id for index i,j in
-        self.__listeners
+        returns boolean indicating whether the iterations
+        of index i and j overlap by more than one iteration
         '''
-        if self.__listeners[i].groupId != -1:
-            self.__listeners[j].groupId = self.__listeners[i].groupId
-            return
-
-        if self.__listeners[i].groupId != -1:
-            self.__listeners[j].groupId = self.__listeners[i].groupId
-            return
-
-        Concatenator.__groupIdCounter += 1
-        self.__listeners[j].groupId = Concatenator.__groupIdCounter
-        self.__listeners[j].groupId = Concatenator.__groupIdCounter
+        iListener = self.__listeners[i]
+        jListener = self.__listeners[j]
+        start = max(iListener.iterationMin, jListener.iterationMin)
+        end = min(iListener.iterationMax, jListener.iterationMax)
+        return end - start > 1
 
     def __groupListeners(self):
         '''
@@ -248,9 +238,110 @@ class Concatenator:
 
         return iterators
 
-    def __createIterFromFile(self, filePath):
-        '''
-        creates an iterator for a logfile
-        for a given path
-        '''
-        return (open(filePath))
+
+
+# bytes read at once while scanning a logfile
+SCAN_BLOCK_SIZE = 16 * 1024
+# overlap of two blocks, a marker is found if its line is shorter
+SCAN_MARGIN = 1024
+# bytes at the end of a logfile searched for the last snapshot, logs which
+# wrote no snapshot are not read completely
+TAIL_SCAN_SIZE = 4 * 1024 * 1024
+
+regex_iteration = re.compile('Iteration (\d+)')
+
+
+def snapshotKey(snapshotName):
+    '''
+    returns the key identifying a snapshot file
+    (the filename, the path in the log depends on the working directory)
+    '''
+    return os.path.basename(snapshotName.strip())
+
+
+def scanLogFile(logFile):
+    '''
+    scans a logfile for the properties the concatenator needs
+    returns the attributes of its SnapshotListener as dict
+    or None if the file could not be read
+    (module level, so worker processes can execute it)
+
+    caffe writes the resume marker before the first iteration and
+    snapshots while training, so usually only the first and the
+    last blocks of the file are read. The last iteration and snapshot
+    are only searched in the last TAIL_SCAN_SIZE bytes
+    '''
+    listener = Concatenator.SnapshotListener(logFile)
+    events = Concatenator.events
+    try:
+        with open(logFile, 'rb') as f:
+            # head: resume marker and first iteration
+            start = 0
+            text = ''
+            while True:
+                block = f.read(SCAN_BLOCK_SIZE)
+                if not block:
+                    break
+                text = text[-SCAN_MARGIN:] + block
+                eof = len(block) < SCAN_BLOCK_SIZE
+                if not listener.snapshotResumeName:
+                    match = _firstMatch(events[Concatenator.resume], text, eof)
+                    if match:
+                        listener.snapshotResumeName = match.group(1).strip()
+                match = _firstMatch(regex_iteration, text, eof)
+                if match:
+                    listener.iterationMin = int(match.group(1))
+                    start = f.tell() - len(text) + match.start()
+                    break
+            # tail: finish marker, last snapshot and last iteration
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            end = size
+            first = True
+            tailStart = max(start, size - TAIL_SCAN_SIZE)
+            while end > tailStart:
+                blockStart = max(tailStart, end - SCAN_BLOCK_SIZE)
+                f.seek(blockStart)
+                text = f.read(end - blockStart + SCAN_MARGIN)
+                eof = blockStart + len(text) == size
+                if first and events[Concatenator.finish].search(text):
+                    listener.finish = True
+                first = False
+                if listener.iterationMax == -1:
+                    match = _lastMatch(regex_iteration, text, eof)
+                    if match:
+                        listener.iterationMax = int(match.group(1))
+                if not listener.snapshotName:
+                    match = _lastMatch(events[Concatenator.interrupt], text, eof)
+                    if match:
+                        listener.snapshotName = match.group(1).strip()
+                if listener.iterationMax != -1 and listener.snapshotName:
+                    break
+                end = blockStart
+    except (IOError, OSError):
+        return None
+    listener.hasSnapshot = bool(listener.snapshotName or listener.snapshotResumeName)
+    return listener.__dict__
+
+
+def _firstMatch(regex, text, eof):
+    '''
+    returns the first complete match of the regex in text or None
+    a match at the end of the text may be cut off unless
+    the text ends with the file
+    '''
+    for match in regex.finditer(text):
+        if eof or match.end() < len(text):
+            return match
+    return None
+
+
+def _lastMatch(regex, text, eof):
+    '''
+    returns the last complete match of the regex in text or None
+    '''
+    last = None
+    for match in regex.finditer(text):
+        if eof or match.end() < len(text):
+            last = match
+    return last
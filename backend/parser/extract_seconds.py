@@ -47,7 +47,7 @@ license and copyright terms herein.
 
 import re
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def extractDatetimeFromLine(line, year):
@@ -71,6 +71,38 @@ def extractDatetimeFromLine(line, year):
     return dt
 
 
+class TimestampParser(object):
+    """Fast timestamp extraction for the lines of one log file.
+
+    Lines starting with the glog prefix are sliced at fixed positions and the
+    date of the current day is cached, other lines fall back to
+    extractDatetimeFromLine().
+    """
+
+    def __init__(self, year):
+        self.year = year
+        self.day = None
+        self.day_start = None
+
+    def extract(self, line):
+        # Expected format:
+        # I0210 13:39:22.381027 2521 solver.cpp:204]
+        if (len(line) > 21 and line[5] == ' ' and line[8] == ':' and
+                line[11] == ':' and line[14] == '.' and line[21] in ' \t'):
+            try:
+                day = line[1:5]
+                if day != self.day:
+                    self.day_start = datetime(self.year, int(day[:2]),
+                                              int(day[2:]))
+                    self.day = day
+                return self.day_start + timedelta(
+                    hours=int(line[6:8]), minutes=int(line[9:11]),
+                    seconds=int(line[12:14]), microseconds=int(line[15:21]))
+            except ValueError:
+                pass
+        return extractDatetimeFromLine(line, self.year)
+
+
 def getLogCreatedYear(input_file):
     """Get year from log file start time.
 
@@ -0,0 +1,362 @@
+import json
+import os
+import struct
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+
+from backend.parser.parser_common import ParserCommon
+
+
+class MetricStore(object):
+    """ Append-only columnar storage for parsed metric rows.
+
+    Every key of a phase is stored as one column of float64 values. A store
+    with a directory keeps each column in its own file and reads them memory
+    mapped, a store without a directory keeps growable arrays in memory.
+    Values missing in a row are stored as NaN, so all columns of a phase have
+    the same length.
+    """
+
+    DIRECTORY = 'metrics'
+    INDEX = 'index.json'
+    VERSION = 1
+    # columns every parser row starts with
+    FIXED_KEYS = ('NumIters', 'Seconds', 'LearningRate', 'DateTime')
+    # write the index after this many appended rows
+    FLUSH_ROWS = 1000
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = Lock()
+        self.counts = {}
+        self.columns = {}
+        self.unflushed = 0
+        for phase in (ParserCommon.TRAIN, ParserCommon.TEST):
+            self.counts[phase] = 0
+            self.columns[phase] = OrderedDict()
+        if self.directory is not None:
+            self._open()
+
+    @staticmethod
+    def forSession(directory):
+        """ Return the persistent store of the session in the given directory.
+        """
+        return MetricStore(os.path.join(directory, MetricStore.DIRECTORY))
+
+    @staticmethod
+    def fromColumns(columns):
+        """ Create an in-memory store from the result of getColumns().
+        """
+        store = MetricStore()
+        for phase, phaseColumns in columns.items():
+            count = 0
+            for key, values in phaseColumns.items():
+                column = store._createColumn(phase, key, 0)
+                column.extend(values)
+                count = len(values)
+            store.counts[phase] = count
+        return store
+
+    def append(self, phase, row):
+        """ Append a parser row to the columns of the phase.
+        """
+        with self.lock:
+            count = self.counts[phase]
+            columns = self.columns[phase]
+            for key in row:
+                if key not in columns:
+                    self._createColumn(phase, key, count)
+            for key, column in columns.items():
+                value = row.get(key)
+                if key == 'DateTime' and value is not None:
+                    value = _fromDatetime(value)
+                column.append(float('NaN') if value is None else value)
+            self.counts[phase] = count + 1
+            self.unflushed += 1
+            if self.unflushed >= MetricStore.FLUSH_ROWS:
+                self._flush()
+
+    def flush(self):
+        """ Write all appended rows and the index to disk.
+        """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """ Flush the store and close all open column files.
+        """
+        with self.lock:
+            self._flush()
+            for phase in self.columns:
+                for column in self.columns[phase].values():
+                    column.close()
+
+    def reload(self):
+        """ Discard the loaded state and read the store from disk again.
+
+        Used after another process has appended to the store.
+        """
+        if self.directory is None:
+            return
+        with self.lock:
+            for phase in self.columns:
+                for column in self.columns[phase].values():
+                    column.close()
+                self.columns[phase] = OrderedDict()
+                self.counts[phase] = 0
+            self.unflushed = 0
+            self._open()
+
+    def getRowCount(self, phase):
+        return self.counts[phase]
+
+    def getKeys(self, phase):
+        """ Return the keys of all columns of the phase.
+        """
+        return list(self.columns[phase].keys())
+
+    def getColumn(self, phase, key, count=None):
+        """ Return the first count values of a column as numpy array.
+
+        Columns of a persistent store are memory mapped. Unknown keys result
+        in a column of NaNs.
+        """
+        with self.lock:
+            if count is None:
+                count = self.counts[phase]
+            count = min(count, self.counts[phase])
+            if key not in self.columns[phase]:
+                return np.full(count, np.nan)
+            return self.columns[phase][key].values(count)
+
+    def getColumns(self, counts=None):
+        """ Return all columns as {phase: {key: array}}.
+
+        counts may limit the number of rows per phase.
+        """
+        columns = {}
+        for phase in self.columns:
+            count = None
+            if counts is not None:
+                count = counts.get(phase)
+            columns[phase] = OrderedDict()
+            for key in self.getKeys(phase):
+                columns[phase][key] = np.array(self.getColumn(phase, key, count))
+        return columns
+
+    def iterRows(self, phase, start=0, stop=None):
+        """ Yield the rows of the phase as OrderedDicts like the parser does.
+        """
+        keys = self.getKeys(phase)
+        if stop is None:
+            stop = self.counts[phase]
+        values = [self.getColumn(phase, key, stop) for key in keys]
+        for i in range(start, min(stop, self.counts[phase])):
+            row = OrderedDict()
+            for key, column in zip(keys, values):
+                value = float(column[i])
+                if key in MetricStore.FIXED_KEYS:
+                    if key == 'DateTime':
+                        value = _toDatetime(value)
+                elif value != value:
+                    # skip NaN placeholders of missing values
+                    continue
+                row[key] = value
+            yield row
+
+    def truncate(self, phase, count):
+        """ Drop all rows of the phase behind the first count rows.
+        """
+        with self.lock:
+            if count >= self.counts[phase]:
+                return
+            for column in self.columns[phase].values():
+                column.truncate(count)
+            self.counts[phase] = count
+            self._flush()
+
+    def clear(self):
+        """ Remove all rows and columns.
+        """
+        with self.lock:
+            for phase in self.columns:
+                for column in self.columns[phase].values():
+                    column.remove()
+                self.columns[phase] = OrderedDict()
+                self.counts[phase] = 0
+            self._flush()
+
+    # private methods
+
+    def _createColumn(self, phase, key, count):
+        """ Create a new column which is filled with count NaNs.
+        """
+        if self.directory is None:
+            column = _MemoryColumn()
+        else:
+            index = len(self.columns[phase])
+            path = os.path.join(self.directory, phase + '.' + str(index) + '.f8')
+            column = _FileColumn(path)
+            column.truncate(0)
+        if count > 0:
+            column.extend(np.full(count, np.nan))
+        self.columns[phase][key] = column
+        return column
+
+    def _open(self):
+        """ Load the index and cut off rows which were written after the last
+        flush.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        filename = os.path.join(self.directory, MetricStore.INDEX)
+        if not os.path.isfile(filename):
+            return
+        try:
+            with open(filename, 'r') as f:
+                res = json.load(f)
+            if res.get('Version') != MetricStore.VERSION:
+                return
+            for phase in self.columns:
+                count = res['Counts'][phase]
+                for index, key in enumerate(res['Keys'][phase]):
+                    path = os.path.join(self.directory, phase + '.' + str(index) + '.f8')
+                    column = _FileColumn(path)
+                    count = min(count, column.length())
+                    self.columns[phase][key] = column
+                for column in self.columns[phase].values():
+                    column.truncate(count)
+                self.counts[phase] = count
+        except (IOError, OSError, ValueError, KeyError):
+            for phase in self.columns:
+                self.columns[phase] = OrderedDict()
+                self.counts[phase] = 0
+
+    def _flush(self):
+        self.unflushed = 0
+        if self.directory is None:
+            return
+        for phase in self.columns:
+            for column in self.columns[phase].values():
+                column.flush()
+        toSave = {'Version': MetricStore.VERSION, 'Counts': self.counts, 'Keys': {}}
+        for phase in self.columns:
+            toSave['Keys'][phase] = list(self.columns[phase].keys())
+        filename = os.path.join(self.directory, MetricStore.INDEX)
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(toSave, f)
+        os.rename(tmp, filename)
+
+
+class _MemoryColumn(object):
+    """ A growable float64 array.
+    """
+
+    def __init__(self):
+        self.data = np.empty(64)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self._reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self._reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def values(self, count):
+        return self.data[:min(count, self.size)]
+
+    def truncate(self, count):
+        self.size = min(count, self.size)
+
+    def remove(self):
+        self.size = 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _reserve(self, capacity):
+        if capacity > len(self.data):
+            data = np.empty(max(capacity, 2 * len(self.data)))
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+
+class _FileColumn(object):
+    """ A column of little-endian float64 values in a file.
+
+    Values are appended through a buffered file handle and read memory mapped.
+    """
+
+    ITEM_SIZE = 8
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def append(self, value):
+        self._file().write(struct.pack('<d', value))
+
+    def extend(self, values):
+        self._file().write(np.asarray(values, dtype='<f8').tobytes())
+
+    def values(self, count):
+        self.flush()
+        count = min(count, self.length())
+        if count <= 0:
+            return np.empty(0)
+        return np.memmap(self.path, dtype='<f8', mode='r', shape=(count,))
+
+    def length(self):
+        if not os.path.isfile(self.path):
+            return 0
+        return os.path.getsize(self.path) // _FileColumn.ITEM_SIZE
+
+    def truncate(self, count):
+        self.close()
+        mode = 'r+b' if os.path.isfile(self.path) else 'wb'
+        with open(self.path, mode) as f:
+            f.truncate(count * _FileColumn.ITEM_SIZE)
+
+    def remove(self):
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _file(self):
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        return self.file
+
+
+def _fromDatetime(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def _toDatetime(value):
+    if value != value:
+        return None
+    return datetime.fromtimestamp(value)
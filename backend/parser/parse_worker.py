@@ -0,0 +1,45 @@
+from backend.parser.concatenator import Concatenator
+from backend.parser.metric_store import MetricStore
+from backend.parser.parser import Parser
+from backend.parser.parser_listener import ParserListener
+
+
+class EventRecorder(ParserListener):
+    """ Collect the events of a parser, so they can be replayed in another
+    process.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def handle(self, event, message, groups):
+        self.events.append((event, message, groups))
+
+
+def parseLogFiles(log_files, events, store_directory):
+    """ Parse the log files of a session into its metric store.
+
+    This is the job of a worker process. The log files are ordered by their
+    run id, they are concatenated and parsed one after another with
+    checkpoints enabled, so the process owning the session resumes at the
+    end of the parsed data after reloading the store.
+
+    Return a dict with the concatenated log files and the parsed events. The
+    log lines are not sent back, the session prints them when it restores the
+    checkpoints written here.
+    """
+    logs = Concatenator(log_files).concate()
+    store = MetricStore(store_directory)
+    recorder = EventRecorder()
+    try:
+        parser = Parser(None, events)
+        parser.setMetricStore(store)
+        parser.setCheckpointing(True)
+        parser.addListener(recorder)
+        parser.restoreCheckpoints(logs)
+        for log in logs:
+            parser.addLogStream(log)
+        parser.parseLog()
+    finally:
+        store.close()
+    return {'Logs': logs, 'Events': recorder.events, 'Lines': recorder.lines}
@@ -45,6 +45,7 @@ or otherwise, the contributor releases their content to the
 license and copyright terms herein.
 """
 
+import os
 import re
 import sys
 if sys.version_info[0] == 2:
@@ -56,11 +57,74 @@ from threading import Lock
 
 from backend.parser import extract_seconds as exs
 from backend.barista.utils.logger import Log
+from backend.parser.parser_checkpoint import ParserCheckpoint
 from backend.parser.parser_common import ParserCommon
 
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.Qt import QObject
 
+# One regex classifies the lines of interest. The named groups tell which
+# kind of line was found:
+#   iteration: "Iteration 100, ..."
+#   train, train_value: "Train net output #0: loss = 0.1"
+#   test, test_value: "Test net output #0: accuracy = 0.9"
+#   lr: "lr = 0.01"
+# Every alternative starts with a literal, which lets the regex engine skip
+# quickly to the candidate positions.
+regex_line = re.compile(
+    'Iteration (?P<iteration>\d+)'
+    '|Train net output #\d+: (?P<train>\S+) = (?P<train_value>[\.\deE+-]+)'
+    '|Test net output #\d+: (?P<test>\S+) = (?P<test_value>[\.\deE+-]+)'
+    '|lr = (?P<lr>[-+]?[0-9]*\.?[0-9]+(?:[eE]?[-+]?[0-9]+)?)')
+regex_thread_id = re.compile(
+    '[IWEF][\d]{4} [\d]{2}:[\d]{2}:[\d]{2}\.[\d]{6}[\s]+([\d]+)')
+
+
+def literalPrefix(pattern):
+    """ Return the literal text every match of the regex pattern starts with.
+
+    Return None if the pattern does not start with a literal or contains a top
+    level alternation.
+    """
+    prefix = ''
+    depth = 0
+    escaped = False
+    literal = True
+    for i, c in enumerate(pattern):
+        if escaped:
+            escaped = False
+            continue
+        if c == '\\':
+            escaped = True
+            literal = False
+        elif c == '[':
+            literal = False
+            # skip to the end of the character class
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                return None
+        elif c == '(':
+            depth += 1
+            literal = False
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return None
+        elif literal:
+            if c in '.^$':
+                literal = False
+            elif c in '*?{':
+                # the last character is optional
+                prefix = prefix[:-1]
+                literal = False
+            elif c == '+':
+                literal = False
+            else:
+                prefix += c
+    if len(prefix) < 3:
+        return None
+    return prefix
+
 
 class Parser(QObject, ParserCommon):
     """ Log File Parser.
@@ -72,6 +136,12 @@ class Parser(QObject, ParserCommon):
 
     printLogSignl = pyqtSignal(str, bool)
 
+    # number of lines before the checkpoints which are printed again when
+    # parsing resumes, see restoreCheckpoints
+    HISTORY_LINES = 10000
+    # size of the blocks in which the history is read backwards
+    HISTORY_BLOCK_SIZE = 64 * 1024
+
     def __init__(self, log_stream, events, log_id=None):
         super(Parser, self).__init__()
         self.train_dict_list = []
@@ -81,6 +151,9 @@ class Parser(QObject, ParserCommon):
         self.start_time = None
         self.log_id = log_id
         self.logging = False
+        self.checkpointing = False
+        self.metric_store = None
+        self.last_log_file = None
         self.streams = Queue()
         self.lock = Lock()
         if self.log_stream:
@@ -88,6 +161,23 @@ class Parser(QObject, ParserCommon):
         self.events = events
         if self.events is None:
             self.events = {}
+        # (event, regex, literal) triples, the cheap substring test with the
+        # literal prefix of a regex skips most of the regex searches
+        self.event_regexes = [(event, regex, literalPrefix(regex.pattern))
+                              for event, regex in self.events.iteritems()]
+        self.timestamps = None
+        # state of the current parsing run
+        self.iteration = -1
+        self.learning_rate = float('NaN')
+        self.rows = {Parser.TRAIN: None, Parser.TEST: None}
+        # the first row of a phase is published once the second row is
+        # complete, its width defines when following rows are complete
+        self.first_rows = {Parser.TRAIN: None, Parser.TEST: None}
+        self.row_counts = {Parser.TRAIN: 0, Parser.TEST: 0}
+        self.row_widths = {Parser.TRAIN: None, Parser.TEST: None}
+        # event -> (line, groups) of its last occurrence, kept in the
+        # checkpoints for the parts of the logs which are not read again
+        self.last_events = OrderedDict()
 
     def printLog(self, log, error=False):
         if self.log_id is not None:
@@ -100,10 +190,14 @@ class Parser(QObject, ParserCommon):
 
     def getTestEvents(self):
         """Return the list of parsed test records."""
+        if self.metric_store is not None:
+            return list(self.metric_store.iterRows(Parser.TEST))
         return self.test_dict_list
 
     def getTrainEvents(self):
         """Return the list of parsed training records."""
+        if self.metric_store is not None:
+            return list(self.metric_store.iterRows(Parser.TRAIN))
         return self.train_dict_list
 
     def getThreadID(self):
@@ -120,6 +214,69 @@ class Parser(QObject, ParserCommon):
     def setLogging(self, log):
         self.logging = log
 
+    def setCheckpointing(self, checkpointing):
+        """ Enable or disable checkpoints for log files.
+
+        If enabled, the parsing state of every log stream given as a file path
+        is saved next to the file. The next time the file is parsed, parsing
+        resumes at the saved byte offset and only the new tail is read.
+        """
+        self.checkpointing = checkpointing
+
+    def setMetricStore(self, metric_store):
+        """ Store the parsed records in the given MetricStore.
+
+        The parser does not keep the records in memory in this case, they are
+        appended to the store before the listeners are notified.
+        """
+        self.metric_store = metric_store
+
+    def getMetricStore(self):
+        return self.metric_store
+
+    def restoreCheckpoints(self, log_files):
+        """ Prepare resuming the parsing of the ordered list of log files.
+
+        Checkpoints are only valid as long as all checkpoints of the previous
+        log files are valid. The metric store is reset to the state of the
+        last valid checkpoint, all checkpoints behind it are removed, so the
+        following log files are parsed from the beginning.
+
+        Return the (event, line, groups) tuples of the last occurrence of
+        every event in the part of the logs covered by the checkpoints. The
+        listeners are not notified about these events again while parsing,
+        so the caller has to replay them to restore the state derived from
+        events, e.g. the last snapshot or the maximum iteration.
+        If logging is enabled, the last HISTORY_LINES lines covered by the
+        checkpoints are printed, because they are not parsed again.
+        """
+        valid = None
+        predecessor = None
+        covered = []
+        for log_file in log_files:
+            checkpoint = ParserCheckpoint(log_file)
+            if valid is not False:
+                if checkpoint.load() and checkpoint.predecessor == predecessor:
+                    valid = checkpoint
+                    covered.append((log_file, checkpoint.offset))
+                else:
+                    valid = False
+            if valid is False:
+                checkpoint.remove()
+            predecessor = os.path.basename(log_file)
+        if self.metric_store is not None:
+            for phase in (Parser.TRAIN, Parser.TEST):
+                count = 0
+                if valid:
+                    count = valid.store_counts[phase]
+                self.metric_store.truncate(phase, count)
+        if not valid:
+            return []
+        if self.logging:
+            for line in self._readHistory(covered):
+                self.printLog(line)
+        return [(event, line, groups) for event, line, groups in valid.events]
+
     def parseLog(self):
         """Parse log file.
 
@@ -131,98 +288,106 @@ class Parser(QObject, ParserCommon):
         if locked is False:
             return self.train_dict_list, self.test_dict_list
 
-        regex_iteration = re.compile('Iteration (\d+)')
-        regex_train_output = re.compile(
-            'Train net output #(\d+): (\S+) = ([\.\deE+-]+)')
-        regex_test_output = re.compile(
-            'Test net output #(\d+): (\S+) = ([\.\deE+-]+)')
-        regex_learning_rate = re.compile(
-            'lr = ([-+]?[0-9]*\.?[0-9]+([eE]?[-+]?[0-9]+)?)')
-
         # Pick out lines of interest
-        iteration = -1
-        learning_rate = float('NaN')
-        train_dict_list = self.train_dict_list
-        test_dict_list = self.test_dict_list
-        train_row = None
-        test_row = None
+        self.iteration = -1
+        self.learning_rate = float('NaN')
+        self.rows = {Parser.TRAIN: None, Parser.TEST: None}
         try:
             while self.streams.empty() is False:
                 head = self.streams.get()
-                log_file = None
-                ht = type(head)
-                if ht is unicode or ht is str:
-                    # open file
-                    log_file = open(head, 'r')
-                    log_stream = log_file.readlines()
-                else:
-                    log_stream = head
                 try:
-                    logfile_year = exs.getLogCreatedYear(log_stream)
-                    for line in log_stream:
-                        line = line.strip()
-                        if self.logging:
-                            self.printLog(line)
-                        if self.thread_id is None:
-                            self.extractThreadID(line)
-                        if self.start_time is None:
-                            self.start_time = exs.getStartTime(line,
-                                                               logfile_year)
-                        self.parseEvent(line)
-
-
-                        iteration_match = regex_iteration.search(line)
-                        if iteration_match:
-                            iteration = float(iteration_match.group(1))
-                        if iteration == -1:
-                            # Only start parsing for other stuff if we've
-                            # found the first iteration
-                            continue
-                        if exs.isLogFormat(line) is False:
-                            continue
-
-                        if self.start_time is None:
-                            self.start_time = exs.extractDatetimeFromLine(line,
-                                                          logfile_year)
-                        time = exs.extractDatetimeFromLine(line,
-                                                          logfile_year)
-                        seconds = (time - self.start_time).total_seconds()
-
-                        lr_match = regex_learning_rate.search(line)
-                        if lr_match:
-                            self.checkKey(Parser.TRAIN, 'LearningRate')
-                            learning_rate = float(lr_match.group(1))
-
-                        train_dict_list, train_row = self.parseLine(
-                            regex_train_output, train_row, train_dict_list,
-                            line, iteration, seconds, learning_rate, time,
-                            Parser.TRAIN
-                        )
-                        test_dict_list, test_row = self.parseLine(
-                            regex_test_output, test_row, test_dict_list,
-                            line, iteration, seconds, learning_rate, time,
-                            Parser.TEST
-                        )
+                    ht = type(head)
+                    if ht is unicode or ht is str:
+                        self._parseLogFile(head)
+                    else:
+                        logfile_year = exs.getLogCreatedYear(head)
+                        for line in head:
+                            self.parseLogLine(line, logfile_year)
                 except Exception as e:
                     self.printLog('Parser error: '+str(e))
-                finally:
-                    if log_file:
-                        log_file.close()
         except Exception as e:
             if self.log_id:
                 self.printLog('Failed to parse log '+str(e), True)
             else:
                 print('Failed to parse log '+str(e))
         finally:
+            if self.metric_store is not None:
+                self.metric_store.flush()
             if locked:
                 self.lock.release()
         for lis in self.listener:
             lis.parsingFinished()
-        return train_dict_list, test_dict_list
+        return self.train_dict_list, self.test_dict_list
+
+    def parseLogLine(self, line, logfile_year):
+        """Parse a single line of the log.
+
+        Updates the state of the current parsing run and notifies the listener
+        about new rows, keys and events.
+        Cheap substring checks and a single classifying regex sort out the
+        lines of interest, timestamps are only parsed for new records.
+        """
+        line = line.strip()
+        if self.logging:
+            self.printLog(line)
+        if self.thread_id is None:
+            self.extractThreadID(line)
+        if self.timestamps is None or self.timestamps.year != logfile_year:
+            self.timestamps = exs.TimestampParser(logfile_year)
+        if self.start_time is None and 'Solving' in line:
+            self.start_time = self.timestamps.extract(line)
+        self.parseEvent(line)
+
+        match = None
+        if 'Iteration' in line or 'output #' in line or 'lr = ' in line:
+            match = regex_line.search(line)
+        if match is not None and match.group('iteration') is not None:
+            self.iteration = float(match.group('iteration'))
+            # the learning rate is reported on the iteration line
+            end = match.end()
+            match = None
+            if 'lr = ' in line:
+                match = regex_line.search(line, end)
+        if self.iteration == -1:
+            # Only start parsing for other stuff if we've
+            # found the first iteration
+            return
+        if self.start_time is None:
+            if not exs.isLogFormat(line):
+                return
+            self.start_time = self.timestamps.extract(line)
+        if match is None:
+            return
+
+        if match.group('iteration') is not None:
+            return
+        if exs.isLogFormat(line) is False:
+            return
+
+        learning_rate = match.group('lr')
+        if learning_rate is not None:
+            self.checkKey(Parser.TRAIN, 'LearningRate')
+            self.learning_rate = float(learning_rate)
+            return
+
+        time = self.timestamps.extract(line)
+        seconds = (time - self.start_time).total_seconds()
+        if match.group('train') is not None:
+            self.train_dict_list, self.rows[Parser.TRAIN] = self.parseLine(
+                match.group('train'), match.group('train_value'),
+                self.rows[Parser.TRAIN], self.train_dict_list, self.iteration,
+                seconds, self.learning_rate, time, Parser.TRAIN
+            )
+        else:
+            self.test_dict_list, self.rows[Parser.TEST] = self.parseLine(
+                match.group('test'), match.group('test_value'),
+                self.rows[Parser.TEST], self.test_dict_list, self.iteration,
+                seconds, self.learning_rate, time, Parser.TEST
+            )
 
-    def parseLine(self, regex_obj, row, row_dict_list, line, iteration,
-                  seconds, learning_rate, time, phase):
-        """Parse a single line for training or test output.
+    def parseLine(self, output_name, output_val, row, row_dict_list,
+                  iteration, seconds, learning_rate, time, phase):
+        """Add a parsed training or test output to the current row.
 
         Returns a a tuple with (row_dict_list, row)
         row: may be either a new row or an augmented version of the current row
@@ -230,45 +395,40 @@ class Parser(QObject, ParserCommon):
         version of the current row_dict_list
         """
 
-        output_match = regex_obj.search(line)
-        if output_match:
-            if not row or row['NumIters'] != iteration:
-                # Push the last row and start a new one
-                if row:
-                    # If we're on a new iteration, push the last row
-                    # This will probably only happen for the first row;
-                    # otherwisethe full row checking logic below will push and
-                    # clear full rows
-                    row_dict_list.append(row)
-
-                row = OrderedDict([
-                    ('NumIters', iteration),
-                    ('Seconds', seconds),
-                    ('LearningRate', learning_rate),
-                    ('DateTime', time)
-                ])
-
-            # output_num is not used; may be used in the future
-            # output_num = output_match.group(1)
-            output_name = output_match.group(2)
-            output_val = output_match.group(3)
-            row[output_name] = float(output_val)
-            self.checkKey(phase, output_name)
+        if not row or row['NumIters'] != iteration:
+            # Push the last row and start a new one
+            if row:
+                # If we're on a new iteration, push the last row
+                # This will probably only happen for the first row;
+                # otherwisethe full row checking logic below will push and
+                # clear full rows
+                self._pushRow(phase, row, row_dict_list)
+
+            # item assignment is considerably faster than passing a list of
+            # pairs to the (pure python) OrderedDict constructor
+            row = OrderedDict()
+            row['NumIters'] = iteration
+            row['Seconds'] = seconds
+            row['LearningRate'] = learning_rate
+            row['DateTime'] = time
+
+        row[output_name] = float(output_val)
+        self.checkKey(phase, output_name)
         # append a new row to the dict
         if (row and
-                len(row_dict_list) >= 1 and
-                len(row) == len(row_dict_list[0])):
+                self.row_counts[phase] >= 1 and
+                len(row) == self.row_widths[phase]):
             # fix the learning rate of the first row
-            if len(row_dict_list) == 1:
-                row_dict_list[0]['LearningRate'] = row['LearningRate']
-                for lis in self.listener:
-                    lis.update(phase, row_dict_list[0])
+            if self.row_counts[phase] == 1:
+                first_row = self.first_rows[phase]
+                first_row['LearningRate'] = row['LearningRate']
+                self._publishRow(phase, first_row)
+                self.first_rows[phase] = None
             # The row is full, based on the fact that it has the same number of
             # columns as the first row; append it to the list
-            row_dict_list.append(row)
+            self._pushRow(phase, row, row_dict_list)
             # notify the listener about the new row
-            for lis in self.listener:
-                lis.update(phase, row)
+            self._publishRow(phase, row)
             row = None
 
         return row_dict_list, row
@@ -278,21 +438,23 @@ class Parser(QObject, ParserCommon):
 
         Notifies the listener about every event found.
         """
-        for event, regex in self.events.iteritems():
+        for event, regex, literal in self.event_regexes:
+            if literal is not None and literal not in line:
+                continue
             event_match = regex.search(line)
             if event_match:
                 size = len(event_match.groups())
                 groups = []
                 for i in range(0, size):
                     groups.append(event_match.group(i+1))
+                self.last_events.pop(event, None)
+                self.last_events[event] = (line, groups)
                 for lis in self.listener:
                     lis.handle(event, line, groups)
 
     def extractThreadID(self, line):
         """ Extract the thread id from the file.
         """
-        regex_thread_id = re.compile(
-            '[IWEF][\d]{4} [\d]{2}:[\d]{2}:[\d]{2}\.[\d]{6}[\s]+([\d]+)')
         line = line.strip()
         thread_id_match = regex_thread_id.search(line)
         if thread_id_match:
@@ -313,3 +475,139 @@ class Parser(QObject, ParserCommon):
         """ Return true if the key was registered for the phase.
         """
         return key in self.getKeys(phase)
+
+    # private methods
+
+    def _readHistory(self, covered):
+        """ Return the last HISTORY_LINES lines of the (log file, offset) pairs.
+
+        Every log file is read backwards from its offset, only the blocks
+        holding the returned lines are read.
+        """
+        lines = []
+        for log_file, offset in reversed(covered):
+            count = Parser.HISTORY_LINES - len(lines)
+            if count <= 0:
+                break
+            try:
+                lines = self._readLastLines(log_file, offset, count) + lines
+            except IOError as e:
+                self.printLog('Failed to read log file ' + str(log_file) + ': ' + str(e), True)
+                break
+        return lines
+
+    def _readLastLines(self, path, end, count):
+        """ Return the last count lines before the byte offset end of a file.
+        """
+        blocks = []
+        newlines = 0
+        pos = end
+        with open(path, 'rb') as log_file:
+            # one more line break is needed to know that the first line is complete
+            while pos > 0 and newlines <= count:
+                size = min(Parser.HISTORY_BLOCK_SIZE, pos)
+                pos -= size
+                log_file.seek(pos)
+                block = log_file.read(size)
+                newlines += block.count('\n')
+                blocks.append(block)
+        lines = ''.join(reversed(blocks)).splitlines()
+        if pos > 0:
+            lines = lines[1:]
+        return [line.strip() for line in lines[-count:]]
+
+    def _parseLogFile(self, path):
+        """ Parse the log file with the given path.
+
+        If checkpointing is enabled, parsing resumes at the checkpoint of the
+        file and the checkpoint is updated afterwards. An incomplete last line
+        is left for the next run in this case.
+        """
+        checkpoint = None
+        if self.checkpointing:
+            checkpoint = ParserCheckpoint(path)
+            if checkpoint.load():
+                self._restoreCheckpoint(checkpoint)
+        with open(path, 'r') as log_file:
+            if checkpoint is not None and checkpoint.year is not None:
+                logfile_year = checkpoint.year
+            else:
+                logfile_year = exs.getLogCreatedYear(log_file)
+            offset = 0
+            if checkpoint is not None:
+                offset = checkpoint.offset
+            log_file.seek(offset)
+            try:
+                for line in iter(log_file.readline, ''):
+                    if checkpoint is not None and not line.endswith('\n'):
+                        break
+                    offset += len(line)
+                    self.parseLogLine(line, logfile_year)
+            finally:
+                if checkpoint is not None:
+                    checkpoint.offset = offset
+                    checkpoint.year = logfile_year
+                    self._saveCheckpoint(checkpoint)
+        self.last_log_file = os.path.basename(path)
+
+    def _pushRow(self, phase, row, row_dict_list):
+        """ Append the row to the list of rows of the phase.
+        """
+        if self.row_counts[phase] == 0:
+            self.first_rows[phase] = row
+            self.row_widths[phase] = len(row)
+        self.row_counts[phase] += 1
+        if self.metric_store is None:
+            row_dict_list.append(row)
+
+    def _publishRow(self, phase, row):
+        """ Store the completed row and notify the listener about it.
+        """
+        if self.metric_store is not None:
+            self.metric_store.append(phase, row)
+        for lis in self.listener:
+            lis.update(phase, row)
+
+    def _restoreCheckpoint(self, checkpoint):
+        """ Restore the parsing state from the checkpoint.
+        """
+        self.iteration = checkpoint.iteration
+        self.learning_rate = checkpoint.learning_rate
+        if checkpoint.start_time is not None:
+            self.start_time = checkpoint.start_time
+        if checkpoint.thread_id is not None:
+            self.thread_id = checkpoint.thread_id
+        for phase in (Parser.TRAIN, Parser.TEST):
+            self.rows[phase] = checkpoint.rows[phase]
+            self.first_rows[phase] = checkpoint.first_rows[phase]
+            self.row_counts[phase] = checkpoint.row_counts[phase]
+            self.row_widths[phase] = checkpoint.row_widths[phase]
+            for key in checkpoint.keys[phase]:
+                self.checkKey(phase, key)
+        self.last_events = OrderedDict()
+        for event, line, groups in checkpoint.events:
+            self.last_events[event] = (line, groups)
+
+    def _saveCheckpoint(self, checkpoint):
+        """ Store the current parsing state in the checkpoint.
+        """
+        checkpoint.iteration = self.iteration
+        checkpoint.learning_rate = self.learning_rate
+        checkpoint.start_time = self.start_time
+        checkpoint.thread_id = self.thread_id
+        checkpoint.predecessor = self.last_log_file
+        checkpoint.events = [[event, line, groups] for event, (line, groups) in self.last_events.items()]
+        if self.metric_store is not None:
+            self.metric_store.flush()
+        for phase in (Parser.TRAIN, Parser.TEST):
+            checkpoint.rows[phase] = self.rows[phase]
+            checkpoint.first_rows[phase] = self.first_rows[phase]
+            checkpoint.row_counts[phase] = self.row_counts[phase]
+            checkpoint.row_widths[phase] = self.row_widths[phase]
+            checkpoint.keys[phase] = list(self.getKeys(phase))
+            if self.metric_store is not None:
+                checkpoint.store_counts[phase] = self.metric_store.getRowCount(phase)
+        try:
+            checkpoint.save()
+        except (IOError, OSError) as e:
+            self.printLog('Failed to save parser checkpoint: ' + str(e), True)
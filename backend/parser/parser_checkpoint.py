@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+from collections import OrderedDict
+from datetime import datetime
+
+from backend.parser.parser_common import ParserCommon
+
+
+class ParserCheckpoint(object):
+    """ Persisted parsing state of a single log file.
+
+    The checkpoint is stored next to the log file. It contains the byte offset
+    up to which the file was parsed and everything the parser needs to
+    continue at that offset: the current iteration and learning rate, the
+    partial train/test rows, the registered keys and the start time.
+    It also contains the last occurrence of every event found so far, because
+    the parser does not read the lines before the offset again. Consumers
+    have to replay these events to rebuild the values derived from them,
+    see Parser.restoreCheckpoints.
+    Checkpoints are cumulative, i.e. they describe the state after parsing all
+    log files up to and including this one. The name of the previous log file
+    and the row counts of the metric store are saved to detect whether the
+    checkpoint still fits to the parsed data.
+    """
+
+    SUFFIX = '.ckpt'
+    VERSION = 3
+    # number of bytes at the beginning of the log used to recognize the file
+    HEAD_SIZE = 256
+    DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.filename = log_file + ParserCheckpoint.SUFFIX
+        self.offset = 0
+        self.head = None
+        self.year = None
+        self.iteration = -1
+        self.learning_rate = float('NaN')
+        self.start_time = None
+        self.thread_id = None
+        self.predecessor = None
+        self.store_counts = {ParserCommon.TRAIN: 0, ParserCommon.TEST: 0}
+        self.rows = {ParserCommon.TRAIN: None, ParserCommon.TEST: None}
+        self.first_rows = {ParserCommon.TRAIN: None, ParserCommon.TEST: None}
+        self.row_counts = {ParserCommon.TRAIN: 0, ParserCommon.TEST: 0}
+        self.row_widths = {ParserCommon.TRAIN: None, ParserCommon.TEST: None}
+        self.keys = {ParserCommon.TRAIN: [], ParserCommon.TEST: []}
+        # [event, line, groups] of the last occurrence of every event, ordered
+        # by their occurrence
+        self.events = []
+
+    def load(self):
+        """ Load the checkpoint of the log file.
+
+        Return False if there is no checkpoint or if it does not belong to the
+        current content of the log file (e.g. the log was truncated or
+        replaced). The checkpoint is reset to the beginning of the file in
+        this case.
+        """
+        if not os.path.isfile(self.filename):
+            return False
+        try:
+            with open(self.filename, 'r') as f:
+                res = json.load(f)
+            if res.get('Version') != ParserCheckpoint.VERSION:
+                return False
+            offset = res['Offset']
+            if offset > os.path.getsize(self.log_file):
+                return False
+            if res['Head'] != self._hashHead(offset):
+                return False
+            self.offset = offset
+            self.head = res['Head']
+            self.year = res['Year']
+            self.iteration = res['Iteration']
+            self.learning_rate = res['LearningRate']
+            self.start_time = self._toDatetime(res['StartTime'])
+            self.thread_id = res['ThreadID']
+            self.predecessor = res['Predecessor']
+            self.events = res['Events']
+            for phase in (ParserCommon.TRAIN, ParserCommon.TEST):
+                self.rows[phase] = self._toRow(res['Rows'][phase])
+                self.first_rows[phase] = self._toRow(res['FirstRows'][phase])
+                self.row_counts[phase] = res['RowCounts'][phase]
+                self.row_widths[phase] = res['RowWidths'][phase]
+                self.keys[phase] = res['Keys'][phase]
+                self.store_counts[phase] = res['StoreCounts'][phase]
+            return True
+        except Exception:
+            self.__init__(self.log_file)
+            return False
+
+    def save(self):
+        """ Write the checkpoint atomically next to the log file.
+        """
+        self.head = self._hashHead(self.offset)
+        toSave = {
+            'Version': ParserCheckpoint.VERSION,
+            'Offset': self.offset,
+            'Head': self.head,
+            'Year': self.year,
+            'Iteration': self.iteration,
+            'LearningRate': self.learning_rate,
+            'StartTime': self._fromDatetime(self.start_time),
+            'ThreadID': self.thread_id,
+            'Predecessor': self.predecessor,
+            'StoreCounts': self.store_counts,
+            'Rows': {},
+            'FirstRows': {},
+            'RowCounts': self.row_counts,
+            'RowWidths': self.row_widths,
+            'Keys': self.keys,
+            'Events': self.events
+        }
+        for phase in (ParserCommon.TRAIN, ParserCommon.TEST):
+            toSave['Rows'][phase] = self._fromRow(self.rows[phase])
+            toSave['FirstRows'][phase] = self._fromRow(self.first_rows[phase])
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(toSave, f)
+        os.rename(tmp, self.filename)
+
+    def remove(self):
+        """ Delete the checkpoint file.
+        """
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    # private methods
+
+    def _hashHead(self, offset):
+        """ Return a fingerprint of the first bytes of the log file.
+        """
+        size = min(offset, ParserCheckpoint.HEAD_SIZE)
+        with open(self.log_file, 'rb') as f:
+            return hashlib.md5(f.read(size)).hexdigest()
+
+    def _fromDatetime(self, dt):
+        if dt is None:
+            return None
+        return dt.strftime(ParserCheckpoint.DATETIME_FORMAT)
+
+    def _toDatetime(self, value):
+        if value is None:
+            return None
+        return datetime.strptime(value, ParserCheckpoint.DATETIME_FORMAT)
+
+    def _fromRow(self, row):
+        """ Convert a parser row to a json serializable list of pairs.
+        """
+        if row is None:
+            return None
+        pairs = []
+        for key, value in row.items():
+            if key == 'DateTime':
+                value = self._fromDatetime(value)
+            pairs.append([key, value])
+        return pairs
+
+    def _toRow(self, pairs):
+        """ Restore a parser row from a list of pairs.
+        """
+        if pairs is None:
+            return None
+        row = OrderedDict()
+        for key, value in pairs:
+            if key == 'DateTime':
+                value = self._toDatetime(value)
+            row[key] = value
+        return row
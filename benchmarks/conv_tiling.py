@@ -0,0 +1,88 @@
+# Benchmark for tiling convolution filters in the weight visualization.
+#
+# Tiles random weights of typical convolution layer shapes with the vectorized
+# tileFilters and with the former implementation, which copied every pixel in
+# four nested loops, and checks that both images are equal. Run from the
+# repository root:
+#
+#   python2 -m benchmarks.conv_tiling -r 5
+
+import argparse
+import time
+
+import numpy as np
+
+from gui.main_window.docks.weight_visualization.weights import tileFilters, NORMALIZE_GLOBAL, NORMALIZE_FILTER, \
+    NORMALIZE_OUTPUT
+
+# (name, shape) of the weights of typical layers
+SHAPES = [
+    ('alexnet conv1', (96, 3, 11, 11)),
+    ('alexnet conv2', (256, 48, 5, 5)),
+    ('resnet conv1', (64, 3, 7, 7)),
+    ('vgg conv3', (256, 256, 3, 3)),
+    ('vgg conv5', (512, 512, 3, 3)),
+    ('inception 1x7', (192, 160, 1, 7)),
+]
+
+
+def loopTiling(data, padding=2):
+    """ The former implementation, only supports square kernels.
+    """
+    N = data.shape[0] * data.shape[1]
+    filters_per_row = int(np.ceil(np.sqrt(N)))
+    filter_size = data.shape[2]
+    result_size = filters_per_row * (filter_size + padding) - padding
+    result = np.zeros((result_size, result_size))
+    filter_x = 0
+    filter_y = 0
+    for n in range(data.shape[0]):
+        for c in range(data.shape[1]):
+            if filter_x == filters_per_row:
+                filter_y += 1
+                filter_x = 0
+            for i in range(filter_size):
+                for j in range(filter_size):
+                    x = filter_y * (filter_size + padding) + i
+                    y = filter_x * (filter_size + padding) + j
+                    result[x, y] = data[n, c, i, j]
+            filter_x += 1
+    min = result.min()
+    max = result.max()
+    return (result - min) / (max - min)
+
+
+def measure(function, repeat, *args):
+    """ Return the result and the best time of repeat calls.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function(*args)
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return result, best
+
+
+if __name__ == '__main__':
+    # Parse command line arguments.
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-r', '--repeat', help='number of runs per measurement', type=int, default=3)
+    argparser.add_argument('--skip-loop', help='do not run the former implementation', action='store_true')
+    args = argparser.parse_args()
+    random = np.random.RandomState(0)
+    print('%-14s %-18s %10s %10s %10s %10s %9s' % ('layer', 'shape', 'loop', 'global', 'filter', 'output',
+                                                  'speedup'))
+    for name, shape in SHAPES:
+        data = random.randn(*shape).astype(np.float32)
+        tiled, fast = measure(tileFilters, args.repeat, data, 2, NORMALIZE_GLOBAL)
+        _, perFilter = measure(tileFilters, args.repeat, data, 2, NORMALIZE_FILTER)
+        _, perOutput = measure(tileFilters, args.repeat, data, 2, NORMALIZE_OUTPUT)
+        if args.skip_loop or shape[2] != shape[3]:
+            print('%-14s %-18s %10s %8.4f s %8.4f s %8.4f s %9s' % (name, shape, '-', fast, perFilter, perOutput, '-'))
+            continue
+        expected, slow = measure(loopTiling, 1, data)
+        assert np.allclose(tiled, expected), 'tiled images differ for ' + name
+        print('%-14s %-18s %8.4f s %8.4f s %8.4f s %8.4f s %8.1f x' % (name, shape, slow, fast, perFilter, perOutput,
+                                                                    slow / fast))
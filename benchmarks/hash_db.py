@@ -0,0 +1,59 @@
+# Benchmark for hashing input databases.
+#
+# Writes a synthetic database file and compares the full content hash of
+# db_util.getHash, the parallel tree hash and the sampled fingerprint. The
+# hash cache is bypassed, so every run hashes the file. Run from the
+# repository root:
+#
+#   python2 -m benchmarks.hash_db -s 4096
+#
+# The file was just written and is likely in the page cache. For cold reads,
+# pass an existing file with -f after dropping the caches.
+
+import argparse
+import os
+import tempfile
+import time
+
+from backend.barista.utils import db_util
+from backend.barista.utils.hash_cache import fingerprint, treeHash
+
+
+def writeDatabase(path, megabytes):
+    """ Write a file of the given size with pseudo random content.
+    """
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for i in xrange(megabytes):
+            f.write(block[i % 1024:] + block[:i % 1024])
+
+
+def measure(name, function, *args):
+    start = time.time()
+    function(*args)
+    duration = time.time() - start
+    print('%-12s %8.3f s' % (name, duration))
+    return duration
+
+
+if __name__ == '__main__':
+    # Parse command line arguments.
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-s', '--size', help='size of the generated file in MB', type=int, default=2048)
+    argparser.add_argument('-f', '--file', help='database file to use instead of a generated one', type=str)
+    args = argparser.parse_args()
+    path = args.file
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.mdb')
+        os.close(fd)
+        print('Writing %d MB to %s' % (args.size, path))
+        writeDatabase(path, args.size)
+    try:
+        full = measure('full', db_util._sha256, path)
+        tree = measure('tree', treeHash, path)
+        sampled = measure('fingerprint', fingerprint, path)
+        print('tree speedup         %8.2f x' % (full / tree))
+        print('fingerprint speedup  %8.2f x' % (full / sampled))
+    finally:
+        if args.file is None:
+            os.remove(path)
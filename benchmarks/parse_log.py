@@ -0,0 +1,161 @@
+# Benchmark for the caffe log parser.
+#
+# Writes a synthetic glog file and compares the parser against the former
+# per-line implementation, which ran every regex and parsed the timestamp of
+# every line. Run from the repository root:
+#
+#   python2 -m benchmarks.parse_log -n 10000000
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from collections import OrderedDict
+from backend.barista.session.session_utils import Events
+from backend.parser import extract_seconds as exs
+from backend.parser.parser import Parser
+from backend.parser.parser_listener import ParserListener
+
+
+class CountingListener(ParserListener):
+
+    def __init__(self):
+        self.rows = 0
+        self.events = 0
+
+    def update(self, phase, row):
+        self.rows += 1
+
+    def handle(self, event, message, groups):
+        self.events += 1
+
+
+def writeLog(path, lines):
+    """ Write a log with roughly the given number of lines.
+
+    Every iteration produces a solver line, a loss output, a learning rate
+    line and some noise. Every 50th iteration runs a test.
+    """
+    prefix = 'I0210 %02d:%02d:%02d.%06d  2521 '
+    written = 0
+    iteration = 0
+    with open(path, 'w') as f:
+        f.write('Log file created at: 2017/02/10 13:39:22\n')
+        f.write('I0210 13:39:22.381027  2521 solver.cpp:204] Solving LeNet\n')
+        f.write('I0210 13:39:22.381027  2521 solver.cpp:205] max_iter: 100000000\n')
+        while written < lines:
+            s = iteration % 86400
+            p = prefix % (s // 3600, s // 60 % 60, s % 60, iteration % 1000000)
+            f.write(p + 'solver.cpp:228] Iteration %d (1.2 iter/s, 0.8s/20 iters), loss = %f\n'
+                    % (iteration, 1.0 / (iteration + 1)))
+            f.write(p + 'solver.cpp:244]     Train net output #0: loss = %f (* 1 = %f loss)\n'
+                    % (1.0 / (iteration + 1), 1.0 / (iteration + 1)))
+            f.write(p + 'sgd_solver.cpp:106] Iteration %d, lr = 0.01\n' % iteration)
+            f.write(p + 'data_layer.cpp:73] Restarting data prefetching from start.\n')
+            written += 4
+            if iteration % 50 == 0:
+                f.write(p + 'solver.cpp:341] Iteration %d, Testing net (#0)\n' % iteration)
+                f.write(p + 'solver.cpp:409]     Test net output #0: accuracy = 0.9\n')
+                f.write(p + 'solver.cpp:409]     Test net output #1: loss = 0.3 (* 1 = 0.3 loss)\n')
+                written += 3
+            iteration += 1
+
+
+def legacyParse(path, events):
+    """ The former parsing loop: every regex and the timestamp for every line.
+    """
+    regex_iteration = re.compile('Iteration (\d+)')
+    regex_train_output = re.compile('Train net output #(\d+): (\S+) = ([\.\deE+-]+)')
+    regex_test_output = re.compile('Test net output #(\d+): (\S+) = ([\.\deE+-]+)')
+    regex_learning_rate = re.compile('lr = ([-+]?[0-9]*\.?[0-9]+([eE]?[-+]?[0-9]+)?)')
+    listener = CountingListener()
+    rows = {}
+    widths = {}
+
+    def parseLine(regex_obj, phase, line, iteration, seconds, learning_rate, time):
+        row = rows.get(phase)
+        output_match = regex_obj.search(line)
+        if output_match:
+            if not row or row['NumIters'] != iteration:
+                if row and phase not in widths:
+                    widths[phase] = len(row)
+                row = OrderedDict([
+                    ('NumIters', iteration),
+                    ('Seconds', seconds),
+                    ('LearningRate', learning_rate),
+                    ('DateTime', time)
+                ])
+            row[output_match.group(2)] = float(output_match.group(3))
+        if row and len(row) == widths.get(phase):
+            listener.update(phase, row)
+            row = None
+        rows[phase] = row
+
+    with open(path, 'r') as f:
+        log_stream = f.readlines()
+    year = exs.getLogCreatedYear(log_stream)
+    iteration = -1
+    learning_rate = float('NaN')
+    start_time = None
+    for line in log_stream:
+        line = line.strip()
+        re.compile('[IWEF][\d]{4} [\d]{2}:[\d]{2}:[\d]{2}\.[\d]{6}[\s]+([\d]+)').search(line)
+        if start_time is None:
+            start_time = exs.getStartTime(line, year)
+        for event, regex in events.items():
+            if regex.search(line):
+                listener.handle(event, line, [])
+        iteration_match = regex_iteration.search(line)
+        if iteration_match:
+            iteration = float(iteration_match.group(1))
+        if iteration == -1 or not exs.isLogFormat(line):
+            continue
+        if start_time is None:
+            start_time = exs.extractDatetimeFromLine(line, year)
+        time = exs.extractDatetimeFromLine(line, year)
+        seconds = (time - start_time).total_seconds()
+        lr_match = regex_learning_rate.search(line)
+        if lr_match:
+            learning_rate = float(lr_match.group(1))
+        parseLine(regex_train_output, 'TRAIN', line, iteration, seconds, learning_rate, time)
+        parseLine(regex_test_output, 'TEST', line, iteration, seconds, learning_rate, time)
+    return listener.rows
+
+
+def parse(path, events):
+    parser = Parser(path, events)
+    listener = CountingListener()
+    parser.addListener(listener)
+    parser.parseLog()
+    return listener.rows
+
+
+def measure(name, function, *args):
+    start = time.time()
+    function(*args)
+    duration = time.time() - start
+    print('%-8s %8.2f s' % (name, duration))
+    return duration
+
+
+if __name__ == '__main__':
+    # Parse command line arguments.
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-n', '--lines', help='number of log lines', type=int, default=10000000)
+    argparser.add_argument('-f', '--file', help='log file to use instead of a generated one', type=str)
+    args = argparser.parse_args()
+    path = args.file
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        print('Writing %d lines to %s' % (args.lines, path))
+        writeLog(path, args.lines)
+    try:
+        legacy = measure('legacy', legacyParse, path, Events.events)
+        current = measure('parser', parse, path, Events.events)
+        print('speedup  %8.2f x' % (legacy / current))
+    finally:
+        if args.file is None:
+            os.remove(path)
@@ -812,6 +812,8 @@ class Host(QObject):
         self.id = None
 
         self.transaction = None
+        # last status of the server, updated with the changes the server sends
+        self.status = {}
         self.timer = QTimer()
         self.timer.setSingleShot(True)
         self.timer.setInterval(15000)
@@ -863,14 +865,21 @@ class Host(QObject):
                 if "data" in ret.keys():
                     self.timer.stop()
                     self.timer.start()
-                    self.widget.parseData(ret["data"])
+                    if ret.get("delta", False):
+                        # an empty update is the keep-alive of the server
+                        if ret["data"]:
+                            self.status.update(ret["data"])
+                            self.widget.parseData(self.status)
+                    else:
+                        self.status = ret["data"]
+                        self.widget.parseData(self.status)
 
                     if hasattr(self.manager.parent, "viewManager"):
                         if hasattr(self.manager.parent.viewManager, "project"):
                             pid = self.manager.parent.viewManager.project.projectId
-                            if "projectsessions" in ret["data"].keys():
-                                if "pid" in ret["data"]["projectsessions"].keys():
-                                    if not ret["data"]["projectsessions"]["pid"] == pid:
+                            if "projectsessions" in self.status.keys():
+                                if "pid" in self.status["projectsessions"].keys():
+                                    if not self.status["projectsessions"]["pid"] == pid:
                                         self.updateNetwork()
                                 else:
                                     # broken protocol
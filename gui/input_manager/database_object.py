@@ -1,6 +1,7 @@
 from backend.input_db.lmdb_input import *
 from backend.input_db.leveldb_input import *
 from backend.input_db.hdf5_txt_input import *
+from backend.barista.session.session_pool import SessionPool
 
 
 class DatabaseObject:
@@ -70,10 +71,17 @@ class DatabaseObject:
         if self._db is not None:
             return self._db.getDimensions()
 
-    def verifyConsistency(self):
+    def verifyConsistency(self, progress=None, cancelled=None):
         '''check if all entries have the same channel number and size.
-        This may take a lot of time since every entry has to be checked.'''
+        This may take a lot of time since every entry has to be checked.
+        progress(checked, total) is called during the check of LMDB and LEVELDB databases and cancelled() stops it
+        if it returns True, the result is then None.'''
         if self._db is not None:
+            if self._openDBType == "LMDB":
+                # the process pool is forked at startup, see SessionPool.startProcesses
+                return self._db.verifyConsistency(SessionPool().getProcessPool(), progress, cancelled)
+            if self._openDBType == "LEVELDB":
+                return self._db.verifyConsistency(progress=progress, cancelled=cancelled)
             return self._db.verifyConsistency()
 
     def getPath(self):
@@ -1,26 +1,99 @@
 # -*- coding: utf-8 -*-
-import traceback
+from bisect import bisect_left
+from collections import deque
 
 import PyQt5.QtGui as QtGui
-from PyQt5.Qt import QTextCursor
-from PyQt5.QtWidgets import QWidget, QTextEdit, QLabel, QComboBox, QVBoxLayout, QHBoxLayout
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+from PyQt5.QtWidgets import QWidget, QLabel, QComboBox, QVBoxLayout, QHBoxLayout, QListView, QAbstractItemView, \
+    QShortcut, QApplication
 
 from backend.barista.utils.logger import Log, Logger
 from gui.main_window.docks.dock import DockElement
 
 
+class LogLineModel(QAbstractListModel):
+    '''
+    List model of log lines in the LogStore, identified by their sequence
+    numbers. Only the rows in the visible area of the view are ever read.
+    '''
+
+    def __init__(self, store):
+        QAbstractListModel.__init__(self)
+        self.__store = store
+        self.__seqs = []
+        self.showPrefix = True
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.__seqs)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.__seqs):
+            return None
+        logline = self.__store.get(self.__seqs[index.row()])
+        if logline is None:
+            return None
+        if role == Qt.DisplayRole:
+            if self.showPrefix:
+                return "[" + logline.time + ", " + logline.caller.description + "]" + logline.line
+            return logline.line
+        if role == Qt.ForegroundRole:
+            color = logline.caller.color
+            if logline.msgType == Logger.ERROR:
+                color = logline.msgType.color
+            return QtGui.QBrush(QtGui.QColor(color))
+        return None
+
+    def setSeqs(self, seqs):
+        '''
+        replaces all rows
+        '''
+        self.beginResetModel()
+        self.__seqs = list(seqs)
+        self.endResetModel()
+
+    def appendSeqs(self, seqs):
+        '''
+        appends rows for the sequence numbers, which have to be larger than
+        the ones already in the model
+        '''
+        if not seqs:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.__seqs), len(self.__seqs) + len(seqs) - 1)
+        self.__seqs.extend(seqs)
+        self.endInsertRows()
+
+    def removeBefore(self, seq):
+        '''
+        removes the rows of lines older than seq, which were dropped by the store
+        '''
+        count = bisect_left(self.__seqs, seq)
+        if count == 0:
+            return
+        self.beginRemoveRows(QModelIndex(), 0, count - 1)
+        del self.__seqs[:count]
+        self.endRemoveRows()
+
+
 class DockElementConsole(DockElement):
 
+    # interval in ms in which new log lines are added to the view
+    FRAME_INTERVAL = 100
+    # maximum number of lines added to the view per frame
+    LINES_PER_FRAME = 500
+
     def __init__(self, mainWindow, title):
         DockElement.__init__(self, mainWindow, 'Console')
         self.name = title
         self.resize(700, 500)
         self.widget = QWidget()
 
-        Log.newLine.connect(self.appendLineToConsole)
         Log.sigRefreshGui.connect(self.appendLinesToConsole)
         Log.sigRefreshCallers.connect(self.fillCallerComboBox)
 
+        self.__store = Log.getStore()
+
         self.__callersCopy = []
 
         self.__currentCallerFilter = -1
@@ -28,118 +101,106 @@ class DockElementConsole(DockElement):
 
         self.__msgTypes = [Logger.ALL, Logger.ERROR, Logger.TEXT]
 
+        # sequence numbers of filtered lines which are not in the view yet
+        self.__pending = deque()
+        # lines from this sequence number on were not checked by the filter yet
+        self.__nextSeq = 0
+
         self.__logOutput = None
+        self.__model = LogLineModel(self.__store)
         self.__callerComboBox = None
 
-        self.__scrollDown = True
-
         self.__setupGui()
+        self.appendLinesToConsole(self.__store)
+
+        self.__frameTimer = QTimer(self)
+        self.__frameTimer.timeout.connect(self.__drawFrame)
+        self.__frameTimer.start(DockElementConsole.FRAME_INTERVAL)
 
     def clearLog(self):
         '''
-        clears all input in the edittext field
+        clears all lines of the console, lines logged afterwards are still shown
         '''
-        self.__logOutput.clear()
+        self.__pending.clear()
+        self.__nextSeq = self.__store.nextSeq()
+        self.__model.setSeqs([])
 
-    def appendLineToConsole(self, logline):
+    def appendLinesToConsole(self, store):
         '''
-        adds a line of input the the console
-        with prefix if it is not filtered
+        shows all lines of the LogStore which pass the filters
         '''
-        if(self.__shouldDisplayLogLine(logline)):
-
-            try:
-                self.__setupFont(logline.caller, logline.msgType)
-
-                sb = self.__logOutput.verticalScrollBar()
-                if sb.value() >= sb.maximum():
-                    self.__scrollDown = True
-                else:
-                    self.__scrollDown = False
-
-                # self.__writePrefix(logline.caller) not used because there is no append..
-                logText = logline.line
-                self.__logOutput.append(self.__getPrefix(logline.caller, logline.time) + logText)
-            except:
-                errMsg = traceback.format_exc()
-                self.__logOutput.append("Error during printing a log line: {}".format(
-                    errMsg
-                ))
-
-    def __writePrefix(self, caller):
+        self.__store = store
+        callerId, typeId = self.__getFilterIds()
+        end = store.nextSeq()
+        seqs = store.getSeqs(callerId, typeId, 0, end)
+        self.__pending.clear()
+        self.__nextSeq = end
+        self.__model.showPrefix = self.__currentCallerFilter == -1
+        self.__model.setSeqs(seqs)
+        self.__logOutput.scrollToBottom()
+
+    def __getFilterIds(self):
         '''
-        NOT USED because of no appen of plain text
-        and self.__setCursorToEnd() leads to lag of gui
-
-        writes the prefix to the log
-        without line feed
+        returns the callerId and typeId to filter on, None for ALL
         '''
-        font = self.__logOutput.font()
-        font.setBold(True)
-        self.__logOutput.setCurrentFont(font)
-
-        self.__logOutput.insertPlainText(self.__getPrefix(caller))
-
-        font = self.__logOutput.font()
-        font.setBold(False)
-        self.__logOutput.setCurrentFont(font)
-
-    def __getPrefix(self, caller, time):
-        '''
-        the prefix that have to be added
+        callerId = None
+        typeId = None
+        if 0 <= self.__currentCallerFilter < len(self.__callersCopy):
+            callerId = self.__callersCopy[self.__currentCallerFilter].callerId
+        if self.__currentTypeFilter != -1:
+            typeId = self.__currentTypeFilter
+        return callerId, typeId
+
+    def __drawFrame(self):
         '''
-        prefix = ""
-        if self.__currentCallerFilter == -1:
-            prefix = "[" + time + ", " + caller.description + "]"
-        return prefix
-
-    def __shouldDisplayLogLine(self, logline):
-        '''
-        returns whether this line should be displayed. Filtered on Caller
-        and MessageType
+        adds at most LINES_PER_FRAME new lines to the view and removes the
+        lines which were dropped by the store
         '''
-        if(self.__currentCallerFilter == -1):
-            if(self.__currentTypeFilter != -1):
-                return (logline.msgType.typeId == self.__currentTypeFilter)
-            return True
-        elif(logline.caller.callerId == self.__callersCopy[self.__currentCallerFilter].callerId):
-            if(self.__currentTypeFilter == -1):
-                return True
-            else:
-                return logline.msgType.typeId == self.__currentTypeFilter
-        return False
+        end = self.__store.nextSeq()
+        if end > self.__nextSeq:
+            callerId, typeId = self.__getFilterIds()
+            self.__pending.extend(self.__store.getSeqs(callerId, typeId, self.__nextSeq, end))
+            self.__nextSeq = end
+
+        first = self.__store.firstSeq()
+        while self.__pending and self.__pending[0] < first:
+            self.__pending.popleft()
+        self.__model.removeBefore(first)
+
+        if not self.__pending:
+            return
+        sb = self.__logOutput.verticalScrollBar()
+        scrollDown = sb.value() >= sb.maximum()
+        count = min(len(self.__pending), DockElementConsole.LINES_PER_FRAME)
+        self.__model.appendSeqs([self.__pending.popleft() for i in range(count)])
+        if scrollDown:
+            self.__logOutput.scrollToBottom()
 
-    def appendLinesToConsole(self, loglines):
+    def __copySelection(self):
         '''
-        adds multiple lines to the console
+        copies the text of the selected lines to the clipboard
         '''
-        for logline in loglines:
-            self.appendLineToConsole(logline)
+        rows = sorted(index.row() for index in self.__logOutput.selectionModel().selectedRows())
+        lines = [self.__model.data(self.__model.index(row)) for row in rows]
+        QApplication.clipboard().setText("\n".join(line for line in lines if line is not None))
 
-    def __setupFont(self, caller, msgType):
+    def __setupGui(self):
         '''
-        setup the font
+        adds the wigets to the gui
         '''
+        self.__logOutput = QListView(self.widget)
+        self.__logOutput.setModel(self.__model)
+        # all rows have the height of one line, so only the visible rows are laid out
+        self.__logOutput.setUniformItemSizes(True)
+        self.__logOutput.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.__logOutput.setEditTriggers(QAbstractItemView.NoEditTriggers)
         font = self.__logOutput.font()
-        font.setBold(False)
-        color = caller.color
-
-        if(msgType == Logger.ERROR):
-            color = msgType.color
-
         font.setFamily("Courier")
         font.setPointSize(10)
-        self.__logOutput.setCurrentFont(font)
-        self.__logOutput.setTextColor(color)
-
-    def __setupGui(self):
-        '''
-        adds the wigets to the gui
-        '''
-        self.__logOutput = QTextEdit(self.widget)
-        self.__logOutput.setReadOnly(True)
-        self.__logOutput.setLineWrapMode(QTextEdit.NoWrap)
-        self.__logOutput.verticalScrollBar().rangeChanged.connect(self.handleSroll)
+        self.__logOutput.setFont(font)
+        copyShortcut = QShortcut(QtGui.QKeySequence.Copy, self.__logOutput)
+        copyShortcut.setContext(Qt.WidgetShortcut)
+        copyShortcut.activated.connect(self.__copySelection)
 
         labelCallers = QLabel("Show output generated by ")
         self.__callerComboBox = QComboBox()
@@ -169,13 +230,6 @@ class DockElementConsole(DockElement):
         self.widget.resize(700, 500)
         self.setWidget(self.widget)
 
-    def __setCursorToEnd(self):
-        '''
-        used to not insert new lines at the users
-        selection
-        '''
-        self.__logOutput.moveCursor(QTextCursor.End)
-
     def fillCallerComboBox(self, callers):
         '''
         inserts the data for the filter caller combo box
@@ -197,15 +251,6 @@ class DockElementConsole(DockElement):
             item.setForeground(caller.color)
             model.appendRow(item)
 
-    def handleSroll(self):
-        '''
-        cares about whether the scrollbar has to be on bottom of
-        the console or not
-        '''
-        sb = self.__logOutput.verticalScrollBar()
-        if(self.__scrollDown):
-            sb.setValue(sb.maximum())
-
     def __filterCallers(self, i):
         if(i == -1):
             return; # invalid filter, empty box or resetet
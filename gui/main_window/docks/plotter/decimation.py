@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class MinMaxPyramid(object):
+    """
+    Min/max decimation pyramid of a series of points.
+
+    Level k splits the series into buckets of FACTOR ** (k + 1) points and
+    keeps the indices of the minimum and the maximum of every complete bucket.
+    Drawing the minimum and maximum of each bucket keeps the envelope of the
+    curve, so a series of any length can be drawn with a few points per pixel
+    without losing its peaks.
+    """
+
+    # number of buckets of a level that form one bucket of the next level
+    FACTOR = 4
+    # no further levels are built once a level has less buckets
+    MIN_BUCKETS = 64
+    # points drawn per pixel of the axes width
+    POINTS_PER_PIXEL = 2
+
+    def __init__(self):
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.ascending = True
+        # level -> (indices of the minima, indices of the maxima)
+        self.levels = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def setData(self, xValues, yValues, append=False):
+        """
+        Set the series. If append is True the old series is a prefix of the
+        new one and only the new buckets are computed.
+        """
+        xValues = np.asarray(xValues, dtype=float)
+        yValues = np.asarray(yValues, dtype=float)
+        count = len(self.x)
+        if not append or len(xValues) < count:
+            self.levels = []
+            self.ascending = True
+            count = 0
+        with np.errstate(invalid='ignore'):
+            self.ascending = self.ascending and bool(np.all(np.diff(xValues[max(0, count - 1):]) >= 0))
+        self.x = xValues
+        self.y = yValues
+        self._build()
+
+    def points(self, xMin=None, xMax=None, pixels=1000):
+        """
+        Return the x and y values to draw the series between xMin and xMax on
+        an axes that is the given number of pixels wide. Between
+        POINTS_PER_PIXEL and FACTOR times as many points are drawn per pixel,
+        unless the range has less points or the levels end.
+        """
+        start = 0
+        stop = len(self.x)
+        if xMin is not None and xMax is not None and self.ascending:
+            # keep one point outside of the range on each side, so the line reaches the border
+            start = max(0, np.searchsorted(self.x, xMin, 'left') - 1)
+            stop = min(stop, np.searchsorted(self.x, xMax, 'right') + 1)
+        limit = max(1, pixels) * MinMaxPyramid.POINTS_PER_PIXEL
+        # use the coarsest level which still draws at least limit points
+        level = -1
+        size = MinMaxPyramid.FACTOR
+        while level + 1 < len(self.levels) and 2 * (stop - start) // size >= limit:
+            level += 1
+            size *= MinMaxPyramid.FACTOR
+        indices = self._indices(level, start, stop)
+        return self.x[indices], self.y[indices]
+
+    # private methods
+
+    def _build(self):
+        """
+        Compute the buckets which are missing in the levels.
+        """
+        factor = MinMaxPyramid.FACTOR
+        level = 0
+        candidates = None
+        while True:
+            if candidates is None:
+                # the first level is built from the series itself
+                total = len(self.y) // factor
+            else:
+                total = len(candidates[0]) // factor
+            if level < len(self.levels):
+                minima, maxima = self.levels[level]
+            else:
+                if total < MinMaxPyramid.MIN_BUCKETS:
+                    return
+                minima = maxima = np.empty(0, dtype=np.intp)
+            done = len(minima)
+            if total > done:
+                if candidates is None:
+                    indices = np.arange(done * factor, total * factor).reshape(-1, factor)
+                    newMinima = self._pick(indices, np.argmin, np.inf)
+                    newMaxima = self._pick(indices, np.argmax, -np.inf)
+                else:
+                    newMinima = self._pick(candidates[0][done * factor:total * factor].reshape(-1, factor),
+                                           np.argmin, np.inf)
+                    newMaxima = self._pick(candidates[1][done * factor:total * factor].reshape(-1, factor),
+                                           np.argmax, -np.inf)
+                minima = np.concatenate((minima, newMinima))
+                maxima = np.concatenate((maxima, newMaxima))
+                if level < len(self.levels):
+                    self.levels[level] = (minima, maxima)
+                else:
+                    self.levels.append((minima, maxima))
+            candidates = (minima, maxima)
+            level += 1
+
+    def _pick(self, indices, select, fill):
+        """
+        Return the index of the extreme value of every row of indices. NaNs
+        are only picked if a bucket contains nothing else.
+        """
+        values = self.y[indices]
+        values = np.where(np.isnan(values), fill, values)
+        return indices[np.arange(len(indices)), select(values, axis=1)]
+
+    def _indices(self, level, start, stop):
+        """
+        Return the indices of the points of the level between start and stop
+        in ascending order. The incomplete buckets at the end are taken from
+        the levels below.
+        """
+        if level < 0:
+            return np.arange(start, stop)
+        size = MinMaxPyramid.FACTOR ** (level + 1)
+        minima, maxima = self.levels[level]
+        first = start // size
+        last = min(len(minima), -(-stop // size))
+        if first >= last:
+            return self._indices(level - 1, start, stop)
+        indices = np.sort(np.column_stack((minima[first:last], maxima[first:last])), axis=1).ravel()
+        end = last * size
+        if end < stop:
+            indices = np.concatenate((indices, self._indices(level - 1, end, stop)))
+        return indices
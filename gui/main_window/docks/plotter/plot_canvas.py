@@ -1,26 +1,22 @@
-
+import numpy as np
 from PyQt5.QtWidgets import QSizePolicy
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from gui.main_window.docks.plotter.decimation import MinMaxPyramid
+
 def handleNonPositives(yValues):
-    allNonPositive = []
-    for i in range(0,len(yValues)):
-        for j in range(0,len(yValues[i])):
-            if len(allNonPositive) < j + 1:
-                allNonPositive.append(True)
-            if yValues[i][j] > 0:
-                allNonPositive[j] = False
-    for i in range(0,len(yValues)):
-        yValues[i] = [yValues[i][j] for j in range(0,len(allNonPositive)) if not allNonPositive[j]]
+    """Hide the metrics (columns) without any positive value, so that every column keeps its line."""
+    yValues = np.array(yValues, dtype=float)
+    if yValues.ndim != 2:
+        return yValues
+    with np.errstate(invalid='ignore'):
+        yValues[:, ~(yValues > 0).any(axis=0)] = np.nan
     return yValues
 
 def allNonNegative(yValues):
-    for ys in yValues:
-        for y in ys:
-            if y > 0:
-                return False
-    return True
+    with np.errstate(invalid='ignore'):
+        return not (np.asarray(yValues, dtype=float) > 0).any()
 
 class PlotCanvas(FigureCanvas):
     """
@@ -40,23 +36,140 @@ class PlotCanvas(FigureCanvas):
                                    QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
 
+        # lines which are drawn on top of the cached background of the axes
+        self.animatedLines = []
+        self.background = None
+        self.mpl_connect('draw_event', self._onDraw)
+
+        # every line only gets the points of its decimation pyramid which are visible at the current zoom
+        # Line2D -> MinMaxPyramid
+        self.pyramids = {}
+        self.mpl_connect('resize_event', self._onResize)
+        self._connectAxes()
+
     def plotDictList(self, xValues, yValues, logarithmic):
         """
-        Plot a multiple charts on the axes.
+        Plot a multiple charts on the axes, one per column of yValues.
 
         Return the Line2D docks.
         """
         self.axes.grid(True)
+        yValues = np.asarray(yValues, dtype=float)
+        if yValues.ndim == 1:
+            yValues = yValues.reshape(-1, 1)
         if logarithmic and not allNonNegative(yValues):
+            yValues = handleNonPositives(yValues)
             try:
-                return self.axes.semilogy(xValues, handleNonPositives(yValues))
+                self.axes.set_yscale('log')
             except:
                 pass
-        return self.axes.plot(xValues, yValues)
+        lines = []
+        for column in yValues.T:
+            pyramid = MinMaxPyramid()
+            pyramid.setData(xValues, column)
+            line, = self.axes.plot(*pyramid.points(pixels=self._pixelWidth()))
+            self.pyramids[line] = pyramid
+            lines.append(line)
+        return lines
+
+    def setLineData(self, line, xValues, yValues, append=False):
+        """
+        Replace the values of a line. If append is True the old values are a
+        prefix of the new ones and only the new points are decimated.
+        """
+        pyramid = self.pyramids[line]
+        pyramid.setData(xValues, yValues, append)
+        xMin, xMax = sorted(self.axes.get_xlim())
+        line.set_data(*pyramid.points(xMin, xMax, self._pixelWidth()))
 
     def legend(self, lines, labels):
         self.axes.legend(lines, labels, loc = 0, fontsize=10)
 
+    def animate(self, lines):
+        """
+        Draw the lines on top of the cached background, so that drawLines can
+        update them without drawing the whole figure.
+        """
+        for line in lines:
+            line.set_animated(True)
+        self.animatedLines = list(lines)
+
+    def isInView(self, xValues, yValues):
+        """
+        Check if all finite points lie within the current limits of the axes.
+        """
+        xValues = np.asarray(xValues, dtype=float)
+        yValues = np.asarray(yValues, dtype=float)
+        with np.errstate(invalid='ignore'):
+            finite = np.isfinite(xValues) & np.isfinite(yValues)
+            if self.axes.get_yscale() == 'log':
+                finite &= yValues > 0
+        if not finite.any():
+            return True
+        xMin, xMax = sorted(self.axes.get_xlim())
+        yMin, yMax = sorted(self.axes.get_ylim())
+        xValues = xValues[finite]
+        yValues = yValues[finite]
+        return xMin <= xValues.min() and xValues.max() <= xMax and yMin <= yValues.min() and yValues.max() <= yMax
+
+    def drawLines(self):
+        """
+        Redraw only the animated lines by blitting them onto the cached background.
+        """
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        for line in self.animatedLines:
+            self.axes.draw_artist(line)
+        self.blit(self.axes.bbox)
+
+    def rescale(self):
+        """
+        Fit the limits of the axes to the data and draw the whole figure.
+        """
+        # the limits have to cover all points, not only the visible ones
+        for line, pyramid in self.pyramids.items():
+            line.set_data(*pyramid.points(pixels=self._pixelWidth()))
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self._refine()
+        self.draw()
+
     def clear(self):
         self.axes.clear()
         self.axes.grid(True)
+        self.animatedLines = []
+        self.background = None
+        self.pyramids = {}
+        # clearing the axes drops their callbacks
+        self._connectAxes()
+
+    def _connectAxes(self):
+        self.axes.callbacks.connect('xlim_changed', self._onXlimChanged)
+
+    def _pixelWidth(self):
+        width = int(self.axes.bbox.width)
+        return width if width > 0 else 1000
+
+    def _refine(self):
+        """
+        Give every line the points of its pyramid that match the current x
+        range and width of the axes.
+        """
+        xMin, xMax = sorted(self.axes.get_xlim())
+        pixels = self._pixelWidth()
+        for line, pyramid in self.pyramids.items():
+            line.set_data(*pyramid.points(xMin, xMax, pixels))
+
+    def _onXlimChanged(self, axes):
+        self._refine()
+
+    def _onResize(self, event):
+        self._refine()
+
+    def _onDraw(self, event):
+        # the figure was drawn without the animated lines, keep it as background
+        self.background = self.copy_from_bbox(self.axes.bbox)
+        for line in self.animatedLines:
+            self.axes.draw_artist(line)
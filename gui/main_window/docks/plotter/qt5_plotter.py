@@ -1,12 +1,16 @@
 import csv
 import time
+import numpy as np
 import seaborn
 from collections import OrderedDict
+from threading import Lock
 
 from PyQt5 import QtCore
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QVBoxLayout, QWidget, QFrame
 from backend.parser.parser_listener import ParserListener
 
+from backend.parser.metric_store import MetricStore
 from backend.parser.parser import Parser
 from backend.parser.parser_dummy import ParserDummy
 from gui.main_window.docks.plotter.plot_canvas import PlotCanvas
@@ -43,11 +47,9 @@ class Qt5Plotter(QFrame):
     __testMetrics = OrderedDict()
     __trainMetrics = OrderedDict()
 
-    # Each parser (i.e. log) has a list of train and test data
-    # Each list entry is again a dictionary of the parsed key-value-pairs
-    # logId -> [key -> value]
-    __trainData = OrderedDict()
-    __testData = OrderedDict()
+    # Each parser (i.e. log) has a columnar store of train and test data
+    # logId -> MetricStore
+    __data = OrderedDict()
 
     # Logs can be plotted with an offset in time/iterations
     # This is a usefull parameter for concatenating logs
@@ -62,34 +64,34 @@ class Qt5Plotter(QFrame):
 
     __plotterGUI = None
 
+    # Minimum time between two frames of a live plot in milliseconds
+    FRAME_INTERVAL = 100
+
     class ParserConnection(ParserListener):
         """
         Implements the required methods for the ParserListener so that the
         parsed data can be added to the data that will be plotted.
         """
 
-        def __init__(self, logId, testData, trainData, plotter, plotOnUpdate=False):
+        def __init__(self, logId, data, plotter, plotOnUpdate=False):
             """
-            Register the test and train data lists of the plotter. Optionaly
+            Register the data store of the plotter. Optionaly
             set plotOnUpdate to True to replot the data every time the parser
             reads a new row and triggers an update.
             """
             self.logId = logId
             self.plotter = plotter
-            self.testData = testData
-            self.trainData = trainData
+            self.data = data
             self.plotOnUpdate = plotOnUpdate
 
         def update(self, phase, row):
             """
-            Pass the update signal to the plotter. Replot if that is wanted.
+            Pass the update signal to the plotter. Draw the new row with the
+            next frame if that is wanted.
             """
-            if phase == "TEST":
-                self.testData.append(row)
-            if phase == "TRAIN":
-                self.trainData.append(row)
+            self.data.append(phase, row)
             if self.plotOnUpdate:
-                self.plotter.plot(False, [self.logId])
+                self.plotter.plotUpdate(self.logId)
 
         def handle(self, event, message, groups):
             # Ignore event.
@@ -126,6 +128,24 @@ class Qt5Plotter(QFrame):
         layout.addWidget(self.canvas)
         self.setLayout(layout)
 
+        # The plotted lines of each log and phase as [(metric, Line2D)]
+        # (logId, phase) -> lines
+        self.__lines = OrderedDict()
+        # The number of rows each phase had when its lines were drawn
+        # (logId, phase) -> count
+        self.__drawnRows = {}
+        # Logs with new rows since the last frame
+        self.__updated = set()
+        self.__updatedLock = Lock()
+        # The selected metrics or axes changed since the last full plot
+        self.__rebuild = True
+
+        # Live updates are drawn at most once per frame
+        self.__frameTimer = QTimer(self)
+        self.__frameTimer.setInterval(Qt5Plotter.FRAME_INTERVAL)
+        self.__frameTimer.timeout.connect(self.__drawFrame)
+        self.__frameTimer.start()
+
     def resizeEvent(self, event):
         # This keeps the plot area as large as possible even after resizing the widget
         try:
@@ -157,20 +177,19 @@ class Qt5Plotter(QFrame):
         is still constistent.
         """
         if (isinstance(parser, Parser) | isinstance(parser, ParserDummy)) & isinstance(logId, str):
-            self.__testData[logId] = []
-            self.__trainData[logId] = []
+            self.__data[logId] = MetricStore()
             self.__testMetrics[logId] = []
             self.__trainMetrics[logId] = []
             self.__timeOffsets[logId] = timeOffset
             self.__iterationOffsets[logId] = iterationOffset
             self.__listener[logId] = self.ParserConnection(
                                logId,
-                               self.__testData[logId],
-                               self.__trainData[logId],
+                               self.__data[logId],
                                self,
                                plotOnUpdate)
             parser.addListener(self.__listener[logId])
             self.__parsers[logId] = [logName, parser]
+            self.__rebuild = True
 
     def removeLog(self, logId):
         """
@@ -181,6 +200,7 @@ class Qt5Plotter(QFrame):
                 if logId in self.__listener:
                     self.__parsers[logId][1].removeListener(self.__listener[logId])
                 self.__parsers.pop(logId)
+                self.__rebuild = True
 
     def showMetricTest(self, logId, metric, show=True):
         """
@@ -191,8 +211,10 @@ class Qt5Plotter(QFrame):
             return
         if show and metric not in self.__testMetrics[logId]:
             self.__testMetrics[logId].append(metric)
+            self.__rebuild = True
         elif not show and metric in self.__testMetrics[logId]:
             self.__testMetrics[logId].remove(metric)
+            self.__rebuild = True
 
     def isMetricTestShown(self, logId, metric):
         return metric in self.__testMetrics[logId]
@@ -206,23 +228,29 @@ class Qt5Plotter(QFrame):
             return
         if show and metric not in self.__trainMetrics[logId]:
             self.__trainMetrics[logId].append(metric)
+            self.__rebuild = True
         elif not show and metric in self.__trainMetrics[logId]:
             self.__trainMetrics[logId].remove(metric)
+            self.__rebuild = True
 
     def isMetricTrainShown(self, logId, metric):
         return metric in self.__trainMetrics[logId]
 
     def plotAgainstTime(self):
         self.__againstTime = True
+        self.__rebuild = True
 
     def plotAgainstIterations(self):
         self.__againstTime = False
+        self.__rebuild = True
 
     def plotLogarithmic(self):
         self.__logarithmic = True
+        self.__rebuild = True
 
     def plotLinear(self):
         self.__logarithmic = False
+        self.__rebuild = True
 
     #
     # Some helping methodes for the plotting # # # # # # # # # # # #
@@ -234,24 +262,23 @@ class Qt5Plotter(QFrame):
         else:
             return "Iterations"
 
-    def __xValues(self, dictList, logId, againstTime):
-        xValues = []
+    def __xValues(self, logId, phase, againstTime, count=None):
+        data = self.__data[logId]
         if againstTime:
-            for dict in dictList:
-                xValues.append(dict.get(TIME) + self.__timeOffsets[logId])
+            return data.getColumn(phase, TIME, count) + self.__timeOffsets[logId]
         else:
-            for dict in dictList:
-                xValues.append(dict.get(ITERATION) +
-                               self.__iterationOffsets[logId])
-        return xValues
-
-    def __yValues(self, dictList, showMetrics):
-        yValues = []
-        for record in dictList:
-            values = []
-            for metric in showMetrics:
-                values.append(record.get(metric))
-            yValues.append(values)
+            return data.getColumn(phase, ITERATION, count) + self.__iterationOffsets[logId]
+
+    def __yValues(self, logId, phase, showMetrics, count=None):
+        """
+        Return the values of the metrics as array with one column per metric.
+        """
+        data = self.__data[logId]
+        if count is None:
+            count = data.getRowCount(phase)
+        yValues = np.empty((count, len(showMetrics)))
+        for i, metric in enumerate(showMetrics):
+            yValues[:, i] = data.getColumn(phase, metric, count)
         return yValues
 
 
@@ -283,40 +310,89 @@ class Qt5Plotter(QFrame):
 
         # Begin plotting
         self.canvas.clear()
+        self.__lines = OrderedDict()
+        self.__drawnRows = {}
+        with self.__updatedLock:
+            self.__updated = set()
+        self.__rebuild = False
         lines = []
         labels = []
         for logId in self.__parsers:
-            if len(self.__trainMetrics[logId]) != 0:
-                xValues = self.__xValues(self.__trainData[logId], logId, self.__againstTime)
-                yValues = self.__yValues(self.__trainData[logId],
-                                         self.__trainMetrics[logId])
-                lines.extend(self.canvas.plotDictList(xValues, yValues, self.__logarithmic))
-                train = lambda s: self.__parsers[logId][0] + ".train." + s
-                labels.extend(map(train, self.__trainMetrics[logId]))
-            if len(self.__testMetrics[logId]) != 0:
-                xValues = self.__xValues(self.__testData[logId], logId, self.__againstTime)
-                yValues = self.__yValues(self.__testData[logId],
-                                         self.__testMetrics[logId])
-                lines.extend(self.canvas.plotDictList(xValues, yValues, self.__logarithmic))
-                test = lambda s: self.__parsers[logId][0] + ".test." + s
-                labels.extend(map(test, self.__testMetrics[logId]))
+            for phase, metrics, name in ((Parser.TRAIN, self.__trainMetrics[logId], ".train."),
+                                         (Parser.TEST, self.__testMetrics[logId], ".test.")):
+                if len(metrics) != 0:
+                    count = self.__data[logId].getRowCount(phase)
+                    xValues = self.__xValues(logId, phase, self.__againstTime, count)
+                    yValues = self.__yValues(logId, phase, metrics, count)
+                    phaseLines = self.canvas.plotDictList(xValues, yValues, self.__logarithmic)
+                    self.__lines[(logId, phase)] = zip(metrics, phaseLines)
+                    self.__drawnRows[(logId, phase)] = count
+                    lines.extend(phaseLines)
+                    labels.extend([self.__parsers[logId][0] + name + metric for metric in metrics])
+        # the legend copies the style of the lines, create it before they are animated
         self.canvas.legend(lines, labels)
+        self.canvas.animate(lines)
         try:
             self.canvas.draw()
         except:
             pass
 
+    def plotUpdate(self, logId):
+        """
+        Draw the rows the log got since the last frame. Can be called from
+        any thread, the drawing happens in the next frame.
+        """
+        with self.__updatedLock:
+            self.__updated.add(logId)
+
     def getLastTimeValue(self, logId, ofTestData=False):
-        if ofTestData:
-            return self.__testData[logId][-1][TIME]
-        else:
-            return self.__trainData[logId][-1][TIME]
+        phase = Parser.TEST if ofTestData else Parser.TRAIN
+        return self.__data[logId].getColumn(phase, TIME)[-1]
 
     def getLastIterationValue(self, logId, ofTestData=False):
-        if ofTestData:
-            return self.__testData[logId][-1][ITERATION]
-        else:
-            return self.__trainData[logId][-1][ITERATION]
+        phase = Parser.TEST if ofTestData else Parser.TRAIN
+        return self.__data[logId].getColumn(phase, ITERATION)[-1]
+
+    def __drawFrame(self):
+        """
+        Draw the new rows of the updated logs. The existing lines get the new
+        points and are blitted onto the plot, the whole figure is only drawn
+        if the new points lie outside of the axes.
+        """
+        with self.__updatedLock:
+            updated = self.__updated
+            self.__updated = set()
+        if not updated:
+            return
+        if self.__rebuild:
+            self.plot(False, list(updated))
+            return
+        changed = False
+        inView = True
+        for (logId, phase), lines in self.__lines.items():
+            if logId not in updated or logId not in self.__data:
+                continue
+            data = self.__data[logId]
+            count = data.getRowCount(phase)
+            drawn = self.__drawnRows[(logId, phase)]
+            if count <= drawn:
+                continue
+            xValues = self.__xValues(logId, phase, self.__againstTime, count)
+            for metric, line in lines:
+                yValues = data.getColumn(phase, metric, count)
+                self.canvas.setLineData(line, xValues, yValues, True)
+                if inView:
+                    inView = self.canvas.isInView(xValues[drawn:], yValues[drawn:])
+            self.__drawnRows[(logId, phase)] = count
+            changed = True
+        if changed:
+            try:
+                if inView:
+                    self.canvas.drawLines()
+                else:
+                    self.canvas.rescale()
+            except:
+                pass
 
     # Methods for CSV export # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -340,9 +416,9 @@ class Qt5Plotter(QFrame):
             for logId in self.__parsers:
                 names = []
                 if len(self.__trainMetrics[logId]) != 0:
-                    xIterValues = self.__xValues(self.__trainData[logId], logId, False)
-                    xTimeValues = self.__xValues(self.__trainData[logId], logId, True)
-                    yValues = self.__yValues(self.__trainData[logId],
+                    xIterValues = self.__xValues(logId, Parser.TRAIN, False)
+                    xTimeValues = self.__xValues(logId, Parser.TRAIN, True)
+                    yValues = self.__yValues(logId, Parser.TRAIN,
                                          self.__trainMetrics[logId])
                     train = lambda s: self.__parsers[logId][0] + ".train." + s
                     names = map(train, self.__trainMetrics[logId])
@@ -354,12 +430,12 @@ class Qt5Plotter(QFrame):
                     spamwriter.writerow(row)
                     for i in range(0, len(xIterValues)):
                         row = [xIterValues[i], xTimeValues[i]]
-                        row.extend(yValues[i])
+                        row.extend(yValues[i].tolist())
                         spamwriter.writerow(row)
                 if len(self.__testMetrics[logId]) != 0:
-                    xIterValues = self.__xValues(self.__testData[logId], logId, False)
-                    xTimeValues = self.__xValues(self.__testData[logId], logId, True)
-                    yValues = self.__yValues(self.__testData[logId],
+                    xIterValues = self.__xValues(logId, Parser.TEST, False)
+                    xTimeValues = self.__xValues(logId, Parser.TEST, True)
+                    yValues = self.__yValues(logId, Parser.TEST,
                                          self.__testMetrics[logId])
                     test = lambda s: self.__parsers[logId][0] + ".test." + s
                     spamwriter.writerow([])
@@ -371,5 +447,5 @@ class Qt5Plotter(QFrame):
                     spamwriter.writerow(row)
                     for i in range(0, len(xIterValues)):
                         row = [int(xIterValues[i]), xTimeValues[i]]
-                        row.extend(yValues[i])
+                        row.extend(yValues[i].tolist())
                         spamwriter.writerow(row)
@@ -241,7 +241,13 @@ class SessionWidget(QWidget):
         """
         if state is None:
             state = self.session.getState()
-        if state is State.WAITING:
+        if state in (State.WAITING, State.PAUSED) and self.session.isQueued():
+            # pausing a queued session removes it from the queue
+            self.__buttons_queued()
+            self.__progress_show()
+            self.setStatus('Queued', 'teal')
+            self.statusLabel.setToolTip('Waiting for a free device on the host.')
+        elif state is State.WAITING:
             self.__buttons_wait()
             self.__progress_show()
             if self.session.getPretrainedWeights():
@@ -324,6 +330,13 @@ class SessionWidget(QWidget):
         self.pauseBtn.hide()
         self.snapshotBtn.setEnabled(False)
 
+    def __buttons_queued(self):
+        self.startBtn.setEnabled(False)
+        self.startBtn.hide()
+        self.pauseBtn.setEnabled(True)
+        self.pauseBtn.show()
+        self.snapshotBtn.setEnabled(False)
+
     def __buttons_disable(self):
         self.startBtn.setEnabled(False)
         self.startBtn.show()
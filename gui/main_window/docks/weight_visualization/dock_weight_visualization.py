@@ -14,12 +14,12 @@ from PyQt5.QtWidgets import (
 from backend.barista.utils.logger import Log
 from backend.barista.utils.logger import LogCaller
 from backend.caffe import loader
+from backend.caffe.caffemodel_index import loadLayerBlobs, CaffemodelFormatError
 from backend.barista.session.session import Session
 from backend.barista.session.client_session import ClientSession
 from gui.main_window.docks.dock import DockElement
 from gui.main_window.docks.weight_visualization.image_canvas import ImageCanvas
-from gui.main_window.docks.weight_visualization.weights import calculateConvWeights
-from gui.main_window.docks.weight_visualization.weights import loadNetParameter
+from gui.main_window.docks.weight_visualization.weights import tileFilters
 
 
 class DockElementWeightPlotter(DockElement, LogCaller):
@@ -69,11 +69,10 @@ class DockElementWeightPlotter(DockElement, LogCaller):
         self.__currentSessionId = None
         self.__currentSnapshotId = None
         self.__currentLayerName = None
-        self.__currentNet = None
+        # The 4D weights of the current layer
+        self.__currentWeights = None
 
         self.__sessionDict = {}
-        # Stores the snapshots which has been selected by the user, to load them faster the next time they are needed.
-        self.__alreadyOpenSnapshots = {}
 
     def __setupGui(self):
         """Add layouts and populate them with widgets"""
@@ -124,64 +123,57 @@ class DockElementWeightPlotter(DockElement, LogCaller):
 
     def __updateCanvas(self):
         """ Updates the current shown picture with the current settings """
-        # Load model
-        self.__currentNet = self.__getNetwork()
-        if self.__currentNet:
+        # Load the weights of the layer
+        self.__currentWeights = self.__getWeights()
+        if self.__currentWeights is not None:
             self.saveImageButton.setEnabled(True)
-            image = calculateConvWeights(self.__currentNet, self.__currentLayerName)
-            if image is not None:
-                self.canvasWidget.showImage(image)
+            self.canvasWidget.showImage(tileFilters(self.__currentWeights))
             self.canvasWidget.show()
         else:
             # Hide canvas when no snapshot, session or layer can be chosen
             self.canvasWidget.hide()
             self.saveImageButton.setEnabled(False)
 
-    def __getNetwork(self, sess_id=None, snap_id=None):
-        """ Return the caffe network of the current session and snapshot.
+    def __getWeights(self, sess_id=None, snap_id=None, layer_name=None):
+        """ Return the 4D weights of the current layer in the current session and snapshot.
+
+        Only the blobs of the layer are read from the caffemodel, or requested
+        from the server for remote sessions. Loaded layers are cached with a
+        bounded size by caffemodel_index and the client session.
         """
         if sess_id is None:
             sess_id = self.__currentSessionId
         if snap_id is None:
             snap_id = self.__currentSnapshotId
-        if sess_id and snap_id:
-            # Creates a Dictionary of Sessions Ids, which contains Snapshot Ids
-            # which point to Layer Id which point to
-            # already opened Networks.
-            net = None
-            if sess_id in self.__alreadyOpenSnapshots:
-                session_snapshots = self.__alreadyOpenSnapshots[sess_id]
-                if snap_id in session_snapshots:
-                    net = session_snapshots[snap_id]
-            if net:
-                # cached net found
-                return net
+        if layer_name is None:
+            layer_name = self.__currentLayerName
+        if sess_id and snap_id and layer_name:
+            session = self.__sessionDict[sess_id]
+            snapName = snap_id.replace('solverstate', 'caffemodel')
+            if isinstance(session, ClientSession):
+                blobs = session.loadLayerBlobs(snapName, layer_name)
+                if blobs is None:
+                    return
             else:
-                # snapshot was accessed for the first time
-                # create and cache the net
-                session = self.__sessionDict[sess_id]
-                snapName = snap_id.replace('solverstate', 'caffemodel')
-                if isinstance(session, ClientSession):
-                    net = session.loadNetParameter(snapName)
-                    if net is None:
-                        return
-                else:
-                    snapshotPath = session.getSnapshotDirectory()
-                    snapshotPath = str(os.path.join(snapshotPath, snapName))
-                    if not os.path.exists(snapshotPath):
-                        Log.error('Snapshot file '+snapshotPath+' does not exist!', self.getCallerId())
-                        return
-                    net = loadNetParameter(snapshotPath)
-                if net is not None:
-                    if sess_id not in self.__alreadyOpenSnapshots.keys():
-                        self.__alreadyOpenSnapshots[sess_id] = {snap_id: net}
-                    else:
-                        self.__alreadyOpenSnapshots[sess_id][snap_id] = net
-                    return net
-                else:
+                snapshotPath = session.getSnapshotDirectory()
+                snapshotPath = str(os.path.join(snapshotPath, snapName))
+                if not os.path.exists(snapshotPath):
+                    Log.error('Snapshot file '+snapshotPath+' does not exist!', self.getCallerId())
+                    return
+                try:
+                    blobs = loadLayerBlobs(snapshotPath, layer_name)
+                except KeyError:
+                    Log.error('Layer ' + layer_name + ' not found in snapshot ' + snapshotPath, self.getCallerId())
+                    return
+                except CaffemodelFormatError:
                     # Show a warning message
                     Log.error('The hdf5 snapshot format is not supported for the weight visualization! '
                               'This can be changed by setting the snapshot_format parameter in the solver properties.', self.getCallerId())
+                    return
+            # The parameters are a list of [weights, biases]
+            for blob in blobs:
+                if blob.ndim == 4:
+                    return blob
 
     def updatePlotter(self, sessionDict):
         """ Updates the comboboxes and redraws the weight image.
@@ -325,8 +317,8 @@ class DockElementWeightPlotter(DockElement, LogCaller):
                                 + allowedAsString)
                     msg.exec_()
             if filename != "":
-                if self.__currentNet:
-                    image = calculateConvWeights(self.__currentNet, self.__currentLayerName)
+                if self.__currentWeights is not None:
+                    image = tileFilters(self.__currentWeights)
                     self.canvasWidget.saveImage(image, filename)
                     Log.log("Saved image under " + filename, callerId)
                 else:
@@ -28,7 +28,15 @@ def loadNetParamFromString(paramstring):
     except:
         pass
 
-def calculateConvWeights(net, layer_name, padding=2):
+"""
+Normalization modes of the tiled filter image. GLOBAL scales the whole image to 0-1, FILTER every kernel of an input
+channel and OUTPUT all kernels of an output channel together.
+"""
+NORMALIZE_GLOBAL = "global"
+NORMALIZE_FILTER = "filter"
+NORMALIZE_OUTPUT = "output"
+
+def calculateConvWeights(net, layer_name, padding=2, normalization=NORMALIZE_GLOBAL):
     """ Return a grayscale image array which displays the weights of the
     convolutional layer in the net.
     """
@@ -37,35 +45,42 @@ def calculateConvWeights(net, layer_name, padding=2):
             for blob in layer.blobs:
                 if len(blob.shape.dim) == 4:
                     # The parameters are a list of [weights, biases]
-                    data = np.copy(blob.data).reshape(blob.shape.dim)
-                    # N is the total number of convolutions
-                    N = blob.shape.dim[0]*blob.shape.dim[1]
-                    # Ensure the resulting image is square
-                    filters_per_row = int(np.ceil(np.sqrt(N)))
-                    # Assume the filters are square
-                    filter_size = blob.shape.dim[2]
-                    # Size of the result image including padding
-                    result_size = filters_per_row*(filter_size + padding) - padding
-                    # Initialize result image to all zeros
-                    result = np.zeros((result_size, result_size))
+                    data = np.fromiter(blob.data, dtype=np.float32, count=len(blob.data))
+                    return tileFilters(data.reshape(blob.shape.dim), padding, normalization)
+
+def tileFilters(data, padding=2, normalization=NORMALIZE_GLOBAL):
+    """ Return a grayscale image array of the 2D kernels of the 4D weight
+    array data, tiled row by row into a square grid.
+    """
+    outputs, channels, height, width = data.shape
+    # N is the total number of convolutions
+    N = outputs * channels
+    # Ensure the resulting image is square
+    filters_per_row = int(np.ceil(np.sqrt(N)))
+    kernels = data.reshape(N, height, width).astype(np.float64)
+    if normalization == NORMALIZE_FILTER:
+        kernels = _normalize(kernels.reshape(N, -1)).reshape(kernels.shape)
+    elif normalization == NORMALIZE_OUTPUT:
+        kernels = _normalize(kernels.reshape(outputs, -1)).reshape(kernels.shape)
 
-                    # Tile the filters into the result image
-                    filter_x = 0
-                    filter_y = 0
-                    for n in range(blob.shape.dim[0]):
-                        for c in range(blob.shape.dim[1]):
-                            if filter_x == filters_per_row:
-                                filter_y += 1
-                                filter_x = 0
-                            for i in range(filter_size):
-                                for j in range(filter_size):
-                                    x = filter_y*(filter_size + padding) + i
-                                    y = filter_x*(filter_size + padding) + j
-                                    result[x, y] = data[n, c, i, j]
-                            filter_x += 1
+    # Pad every kernel on the bottom and the right, missing filters of the last row stay zero
+    tiles = np.zeros((filters_per_row * filters_per_row, height + padding, width + padding))
+    tiles[:N, :height, :width] = kernels
+    # Arrange the tiles in rows and drop the padding behind the last row and column
+    result = tiles.reshape(filters_per_row, filters_per_row, height + padding, width + padding)
+    result = result.transpose(0, 2, 1, 3).reshape(filters_per_row * (height + padding),
+                                                  filters_per_row * (width + padding))
+    result = result[:result.shape[0] - padding, :result.shape[1] - padding]
 
-                    # Normalize image to 0-1
-                    min = result.min()
-                    max = result.max()
-                    result = (result - min) / (max - min)
-                    return result
+    if normalization == NORMALIZE_GLOBAL:
+        # Normalize image to 0-1
+        result = _normalize(result.reshape(1, -1)).reshape(result.shape)
+    return result
+
+def _normalize(rows):
+    """ Scale every row of the 2D array to 0-1. Constant rows become 0.
+    """
+    minimum = rows.min(axis=1)[:, np.newaxis]
+    span = rows.max(axis=1)[:, np.newaxis] - minimum
+    span[span == 0] = 1
+    return (rows - minimum) / span
@@ -13,6 +13,7 @@ from gui.start_dialog import StartDialog
 from PyQt5.QtWidgets import QApplication
 from gui.caffepath_dialog import CaffepathDialog
 from backend.networking.barista_server import BaristaServer
+from backend.barista.session.session_pool import SessionPool
 import threading
 import subprocess
 
@@ -27,6 +28,8 @@ if __name__ == "__main__":
     parser.add_argument('-d', '--dir', help='local directory to run server sessions in', type=str, default='.')
     parser.add_argument('-o', '--open', help='path to a Barista project to be opened', type=str, default='')
     args = parser.parse_args()
+    # Fork the worker processes before Qt objects and threads exist.
+    SessionPool().startProcesses()
     # Get caffepath out of settings.
     settings = applicationQSetting()
     settings.beginGroup("Path")
@@ -6,6 +6,7 @@ import argparse
 import logging
 from PyQt5.QtCore import QCoreApplication
 from backend.networking.barista_server import BaristaServer
+from backend.barista.session.session_pool import SessionPool
 
 
 if __name__ == "__main__":
@@ -33,6 +34,8 @@ if __name__ == "__main__":
         logging.error("Path '%s' is not writeable.", args.dir)
         sys.stderr.write("Path '" + args.dir + "' is not writeable.\n")
         exit(4)
+    # Fork the parsing processes before Qt objects and threads exist.
+    SessionPool().startProcesses()
     # Create application and server.
     app = QCoreApplication(sys.argv)
     server = BaristaServer(app, args.ip, args.port, args.dir)
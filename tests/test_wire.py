@@ -0,0 +1,197 @@
+"""Round trip tests of the binary framing in backend.networking.wire.
+
+Run from the repository root:
+
+    python2 -m unittest discover tests
+"""
+
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from backend.networking import wire
+
+
+def splitFrames(data):
+    """ Return the (frame type, payload) tuples of a byte stream of frames.
+    """
+    frames = []
+    pos = 0
+    while pos < len(data):
+        ftype, codec, size = wire.decodeHeader(data[pos:pos + wire.HEADER.size])
+        pos += wire.HEADER.size
+        payload = data[pos:pos + size]
+        if len(payload) < size:
+            raise wire.WireError('Truncated frame payload.')
+        pos += size
+        frames.append((ftype, wire.decodePayload(codec, payload)))
+    return frames
+
+
+def roundTrip(msg, codec=wire.NONE):
+    """ Encode the message, split the stream into frames and decode it again.
+    """
+    frames = splitFrames(''.join(wire.encodeMessage(msg, codec)))
+    ftype, control = frames[0]
+    assert ftype == wire.CONTROL
+    blobs = [payload for ftype, payload in frames[1:]]
+    assert all(ftype == wire.BLOB for ftype, payload in frames[1:])
+    assert len(blobs) == wire.blobCount(control)
+    return wire.decodeMessage(control, blobs), len(blobs)
+
+
+class Custom(object):
+    """ A class without a typed encoding, sent with the pickle fallback.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Custom) and other.value == self.value
+
+
+class WireRoundTripTest(unittest.TestCase):
+
+    def testScalars(self):
+        msg = {'none': None, 'true': True, 'false': False, 'int': -42, 'big': 2 ** 62, 'float': 0.125,
+               'str': 'abc', 'unicode': u'\xe4\xf6\xfc', 'empty': ''}
+        decoded, blobs = roundTrip(msg)
+        self.assertEqual(decoded, msg)
+        self.assertIs(type(decoded['int']), int)
+        self.assertIs(type(decoded['unicode']), unicode)
+        self.assertIs(decoded['true'], True)
+        self.assertEqual(blobs, 0)
+
+    def testContainers(self):
+        ordered = OrderedDict([('b', 1), ('a', 2), ('c', 3)])
+        msg = {'list': [1, [2, 3], []], 'tuple': (1, 'a'), 'ordered': ordered, 1: 'int key',
+               'time': datetime(2017, 2, 10, 13, 39, 22, 381027)}
+        decoded, _ = roundTrip(msg)
+        self.assertEqual(decoded, msg)
+        self.assertIs(type(decoded['tuple']), tuple)
+        self.assertIs(type(decoded['ordered']), OrderedDict)
+        self.assertEqual(list(decoded['ordered'].keys()), ['b', 'a', 'c'])
+
+    def testArrays(self):
+        for array in [np.arange(12, dtype=np.float32).reshape(3, 4), np.zeros((0, 3), dtype=np.int64),
+                      np.array(5, dtype='>i2'), np.asfortranarray(np.arange(6.0).reshape(2, 3))]:
+            decoded, _ = roundTrip({'a': array})
+            self.assertEqual(decoded['a'].dtype, array.dtype)
+            self.assertEqual(decoded['a'].shape, array.shape)
+            self.assertTrue(np.array_equal(decoded['a'], array))
+
+    def testBlobThreshold(self):
+        below = 'x' * (wire.BLOB_THRESHOLD - 1)
+        at = 'y' * wire.BLOB_THRESHOLD
+        array = np.ones(wire.BLOB_THRESHOLD // 4, dtype=np.float32)
+        decoded, blobs = roundTrip({'below': below})
+        self.assertEqual(decoded['below'], below)
+        self.assertEqual(blobs, 0)
+        decoded, blobs = roundTrip({'at': at, 'array': array, 'again': at})
+        self.assertEqual(decoded['at'], at)
+        self.assertEqual(decoded['again'], at)
+        self.assertTrue(np.array_equal(decoded['array'], array))
+        self.assertEqual(blobs, 3)
+
+    def testCodecs(self):
+        msg = {'text': 'abc' * 10000, 'blob': 'z' * (2 * wire.BLOB_THRESHOLD), 'small': 'abc',
+               'array': np.arange(100000, dtype=np.int32)}
+        plain = sum(len(frame) for frame in wire.encodeMessage(msg, wire.NONE))
+        for codec in wire.supportedCodecs():
+            frames = wire.encodeMessage(msg, codec)
+            if codec != wire.NONE:
+                # compressible payloads are compressed with the codec
+                self.assertEqual(wire.decodeHeader(frames[0])[1], codec)
+                self.assertLess(sum(len(frame) for frame in frames), plain // 2)
+            decoded, _ = roundTrip(msg, codec)
+            self.assertEqual(decoded['text'], msg['text'])
+            self.assertEqual(decoded['blob'], msg['blob'])
+            self.assertTrue(np.array_equal(decoded['array'], msg['array']))
+
+    def testSmallPayloadsAreNotCompressed(self):
+        frames = wire.encodeMessage({'a': 1}, wire.ZLIB)
+        self.assertEqual(wire.decodeHeader(frames[0])[1], wire.NONE)
+
+    def testPickleFallback(self):
+        msg = {'long': 2 ** 70, 'set': set([1, 2]), 'custom': Custom([1, 'a']),
+               'objects': np.array([1, 'a'], dtype=object)}
+        decoded, _ = roundTrip(msg)
+        self.assertEqual(decoded['long'], 2 ** 70)
+        self.assertEqual(decoded['set'], set([1, 2]))
+        self.assertEqual(decoded['custom'], Custom([1, 'a']))
+        self.assertEqual(list(decoded['objects']), [1, 'a'])
+
+    def testBufferFrames(self):
+        array = np.arange(wire.BLOB_THRESHOLD, dtype=np.int32)
+        frames = splitFrames(''.join(wire.encodeMessage({'array': array, 'text': 'x' * wire.BLOB_THRESHOLD})))
+        control = bytearray(frames[0][1])
+        blobs = [bytearray(payload) for ftype, payload in frames[1:]]
+        decoded = wire.decodeMessage(buffer(control), blobs)
+        self.assertTrue(np.array_equal(decoded['array'], array))
+        self.assertIs(type(decoded['text']), str)
+        # the array is built on its blob without a copy and stays writable
+        owner = [blob for blob in blobs if len(blob) == array.nbytes][0]
+        decoded['array'][0] = 7
+        self.assertEqual(np.frombuffer(owner, dtype=np.int32)[0], 7)
+
+    def testHello(self):
+        frames = splitFrames(''.join(wire.encodeHello()))
+        self.assertEqual(frames[0][0], wire.HELLO)
+        codecs = wire.decodeHello(frames[0][1])
+        self.assertEqual(codecs, wire.supportedCodecs())
+        self.assertEqual(wire.chooseCodec(codecs), codecs[0])
+        self.assertEqual(wire.chooseCodec([wire.ZLIB, 200]), wire.ZLIB)
+        self.assertEqual(wire.chooseCodec([200]), wire.NONE)
+
+
+class WireErrorTest(unittest.TestCase):
+
+    def testTruncatedHeader(self):
+        header = wire.encodeMessage({'a': 1})[0]
+        self.assertRaises(wire.WireError, wire.decodeHeader, header[:-1])
+
+    def testInvalidHeader(self):
+        header = wire.encodeMessage({'a': 1})[0]
+        self.assertRaises(wire.WireError, wire.decodeHeader, 'XX' + header[2:])
+        self.assertRaises(wire.WireError, wire.decodeHeader, header[:2] + chr(wire.VERSION + 1) + header[3:])
+
+    def testOversizedFrame(self):
+        header = wire.HEADER.pack(wire.MAGIC, wire.VERSION, wire.BLOB, wire.NONE, wire.MAX_FRAME_SIZE + 1)
+        self.assertRaises(wire.WireError, wire.decodeHeader, header)
+        header = wire.HEADER.pack(wire.MAGIC, wire.VERSION, wire.BLOB, wire.NONE, wire.MAX_FRAME_SIZE)
+        self.assertEqual(wire.decodeHeader(header)[2], wire.MAX_FRAME_SIZE)
+
+    def testTruncatedControlFrame(self):
+        msg = {'list': [1, 2.5, u'\xe4', 'abc'], 'array': np.arange(4), 'custom': Custom(1)}
+        control = wire.encodeMessage(msg)[1]
+        decoded = wire.decodeMessage(control, [])
+        self.assertEqual(decoded['list'], msg['list'])
+        self.assertTrue(np.array_equal(decoded['array'], msg['array']))
+        for size in range(len(control)):
+            self.assertRaises(wire.WireError, wire.decodeMessage, control[:size], [])
+
+    def testTrailingData(self):
+        control = wire.encodeMessage({'a': 1})[1]
+        self.assertRaises(wire.WireError, wire.decodeMessage, control + 'N', [])
+
+    def testMissingBlob(self):
+        frames = wire.encodeMessage({'blob': 'x' * wire.BLOB_THRESHOLD})
+        self.assertEqual(wire.blobCount(frames[1]), 1)
+        self.assertRaises(wire.WireError, wire.decodeMessage, frames[1], [])
+
+    def testCorruptPayload(self):
+        frames = wire.encodeMessage({'text': 'abc' * 10000}, wire.ZLIB)
+        self.assertRaises(wire.WireError, wire.decodePayload, wire.ZLIB, frames[1][:len(frames[1]) // 2])
+        self.assertRaises(wire.WireError, wire.decodePayload, 200, frames[1])
+
+    def testTruncatedStream(self):
+        data = ''.join(wire.encodeMessage({'blob': 'x' * wire.BLOB_THRESHOLD, 'a': [1, 2]}))
+        for size in (1, wire.HEADER.size - 1, wire.HEADER.size + 3, len(data) - 1):
+            self.assertRaises(wire.WireError, splitFrames, data[:size])
+
+
+if __name__ == '__main__':
+    unittest.main()